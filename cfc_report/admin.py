@@ -14,13 +14,184 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db import transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 from .models import (Player, Roster, TournamentDirector, TournamentOrganizer,
-                     Match, )
-# Register your models here.
-
-admin.site.register(Player)
-admin.site.register(Roster)
-admin.site.register(TournamentDirector)
-admin.site.register(TournamentOrganizer)
-admin.site.register(Match)
+                     Match, Section, Job, Tournament, ApiToken, )
+from .services import database, results, writers
+
+# The player and match tables hold every CFC member and every game, so
+# their lists are paged without counting the whole table, each page joins
+# the rows its columns print instead of a query per row, players are
+# picked by search instead of a select of every one of them, and bulk
+# actions are one UPDATE however many rows are selected.
+
+# rows per page of a change list
+LIST_PER_PAGE = 100
+
+
+class BoundedAdmin(admin.ModelAdmin):
+    """a change list that never counts, or loads, the whole table"""
+    list_per_page = LIST_PER_PAGE
+    list_max_show_all = LIST_PER_PAGE
+    show_full_result_count = False
+
+
+@admin.register(Player)
+class PlayerAdmin(BoundedAdmin):
+    list_display = ("name", "cfc_id", "rating")
+    # exact id and name prefix, both answered by an index
+    search_fields = ("=cfc_id", "^name")
+    ordering = ("name", "pk")
+
+
+@admin.register(TournamentDirector, TournamentOrganizer)
+class PersonAdmin(BoundedAdmin):
+    list_display = ("name", "cfc_id")
+    search_fields = ("=cfc_id", "^name")
+    ordering = ("name", "pk")
+
+
+@admin.register(Tournament)
+class TournamentAdmin(BoundedAdmin):
+    list_display = ("name", "date", "num_rounds", "province")
+    search_fields = ("^name",)
+    raw_id_fields = ("roster",)
+    ordering = ("-date", "pk")
+
+
+class MatchActionForm(ActionForm):
+    """the values the bulk match actions set"""
+    round_number = forms.IntegerField(required=False, min_value=1)
+    result = forms.ChoiceField(required=False,
+                               choices=[("", "---")] + Match.RESULT_CHOICES)
+
+
+@admin.register(Match)
+class MatchAdmin(BoundedAdmin):
+    list_display = ("pk", "tournament__name", "round_number", "white",
+                    "black", "result")
+    list_select_related = ("tournament", "white", "black")
+    list_filter = ("result",)
+    search_fields = ("=white__cfc_id", "=black__cfc_id")
+    autocomplete_fields = ("white", "black", "tournament")
+    raw_id_fields = ("section",)
+    ordering = ("-pk",)
+    action_form = MatchActionForm
+    actions = ("reassign_round", "set_result", "export_ctr")
+
+    def _touch(self, queryset) -> None:
+        """count the change to the tournaments of updated matches"""
+        database.touch_tournaments(
+            queryset.values_list("tournament", flat=True).distinct())
+
+    @admin.action(description="Move selected matches to round")
+    def reassign_round(self, request, queryset):
+        try:
+            round_number = int(request.POST["round_number"])
+        except (KeyError, ValueError):
+            self.message_user(request, "Enter the round to move them to.",
+                              messages.ERROR)
+            return
+        if round_number < 1:
+            self.message_user(request, "Rounds start at 1.", messages.ERROR)
+            return
+        tournaments = Tournament.objects.filter(
+            pk__in=queryset.values("tournament")).order_by("name", "pk")
+        too_short = [f"{t.name} ({t.date}) has {t.num_rounds}"
+                     for t in tournaments.only("name", "date", "num_rounds")
+                     if t.num_rounds < round_number]
+        if too_short:
+            self.message_user(
+                request, f"No round {round_number}: "
+                         f"{', '.join(too_short)} rounds.", messages.ERROR)
+            return
+        with transaction.atomic():
+            database.ensure_rounds(tournaments.values_list("pk", flat=True),
+                                   {round_number})
+            self._touch(queryset)
+            moved = queryset.update(round_number=round_number)
+        self.message_user(request, f"{moved} matches moved to round "
+                                   f"{round_number}.")
+
+    @admin.action(description="Set the result of selected matches")
+    def set_result(self, request, queryset):
+        code = request.POST.get("result", "")
+        if code not in dict(Match.RESULT_CHOICES):
+            self.message_user(request, "Choose a result to set.",
+                              messages.ERROR)
+            return
+        # a bye result needs a bye, a game result a game
+        if code in results.BYES:
+            queryset = queryset.filter(black__isnull=True)
+        elif code != results.NOT_PLAYED:
+            queryset = queryset.filter(black__isnull=False)
+        self._touch(queryset)
+        changed = queryset.update(result=code)
+        self.message_user(request, f"{changed} matches set to "
+                                   f"{dict(Match.RESULT_CHOICES)[code]}.")
+
+    @admin.action(description="Export selected matches as a CTR")
+    def export_ctr(self, request, queryset):
+        tournaments = list(queryset.order_by().values_list(
+            "tournament", flat=True).distinct()[:2])
+        if len(tournaments) != 1 or tournaments[0] is None:
+            self.message_user(request, "Select matches of one tournament.",
+                              messages.ERROR)
+            return
+        info = database.get_report_info(
+            Tournament.objects.get(pk=tournaments[0]))
+        players = {
+            cfc_id: (name, rating) for cfc_id, name, rating in
+            Player.objects.filter(Q(pk__in=queryset.values("white"))
+                                  | Q(pk__in=queryset.values("black")))
+            .values_list("cfc_id", "name", "rating")
+        }
+        games = queryset.order_by("round_number", "pk").values_list(
+            "round_number", "white__cfc_id", "black__cfc_id", "result"
+        ).iterator(chunk_size=database.CHUNK_SIZE)
+        writer = writers.CTRWriter(info, players)
+        response = StreamingHttpResponse(
+            (text for _, text in writers.render(info, players, games,
+                                                ["ctr"])),
+            content_type="text/plain; charset=utf-8")
+        response["Content-Disposition"] = \
+            f'attachment; filename="{writer.filename()}"'
+        return response
+
+
+@admin.register(Section)
+class SectionAdmin(BoundedAdmin):
+    list_display = ("name", "tournament__name", "num_rounds")
+    list_select_related = ("tournament",)
+    autocomplete_fields = ("tournament",)
+    raw_id_fields = ("roster",)
+
+
+@admin.register(Roster)
+class RosterAdmin(BoundedAdmin):
+    autocomplete_fields = ("players",)
+
+
+@admin.register(Job)
+class JobAdmin(BoundedAdmin):
+    list_display = ("pk", "kind", "status", "progress", "total", "created")
+    list_filter = ("status", "kind")
+    ordering = ("-pk",)
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(BoundedAdmin):
+    """tokens are listed and revoked here, and made by the api_token
+    command, which shows the key once"""
+    list_display = ("pk", "user", "name", "created")
+    list_select_related = ("user",)
+    readonly_fields = ("user", "created")
+    ordering = ("-pk",)
+
+    def has_add_permission(self, request):
+        return False
@@ -21,3 +21,25 @@ from django.apps import AppConfig
 class CfcReportConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "cfc_report"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import (m2m_changed, post_delete,
+                                              post_migrate, post_save)
+
+        from .models import Match, Player, Roster
+        from .services.database import set_sqlite_pragmas
+        from .services.search import (create_fts, player_deleted,
+                                      player_saved)
+        from .services import snapshot
+
+        connection_created.connect(set_sqlite_pragmas)
+        post_migrate.connect(create_fts, sender=self)
+        post_save.connect(player_saved, sender=Player)
+        post_delete.connect(player_deleted, sender=Player)
+        # no post_delete for Match: a receiver makes every bulk delete of
+        # matches load them, those deletes touch the tournament themselves
+        post_save.connect(snapshot.player_saved, sender=Player)
+        post_save.connect(snapshot.match_saved, sender=Match)
+        m2m_changed.connect(snapshot.roster_changed,
+                            sender=Roster.players.through)
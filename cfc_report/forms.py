@@ -48,7 +48,8 @@ class TournamentInfoForm(forms.Form):
 
     name = forms.CharField(label="Tournament Name",
                            initial="Test Open", max_length=60)
-    num_rounds = forms.IntegerField(label="Number of Rounds", initial=1)
+    num_rounds = forms.IntegerField(label="Number of Rounds", initial=1,
+                                    min_value=1)
     date = forms.DateField(widget=SelectDateWidget)
     pairing_system = PairingSystemField(label="Pairing system used")
     province = ProvinceField()
@@ -0,0 +1,53 @@
+"""a throw away database for the benchmark and load test commands"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import (setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+
+@contextmanager
+def temp_database(verbosity: int = 0, on_disk: bool = False):
+    """Run the body against freshly created test databases, the
+    configured databases are never touched.
+
+    Parameters
+    ----------
+    verbosity : passed on to the test database setup
+    on_disk : put a SQLite test database in a temporary file instead of
+        memory, so connections from other threads lock it as they would
+        the real one
+    """
+    directory = tempfile.TemporaryDirectory() if on_disk else None
+    if directory is not None:
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if connections[alias].vendor == "sqlite":
+                settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+                    directory.name, f"{alias}.sqlite3")
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity)
+        teardown_test_environment()
+        if directory is not None:
+            directory.cleanup()
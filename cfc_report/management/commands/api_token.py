@@ -0,0 +1,47 @@
+"""make an API token for a staff user"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from cfc_report.models import ApiToken
+
+
+class Command(BaseCommand):
+    """Make an ApiToken a script writes through the JSON API with, and
+    print its key, which is not kept and cannot be shown again. Revoke a
+    token by deleting it in the admin.
+    """
+
+    help = "make an API token for a staff user and print its key"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="the staff user")
+        parser.add_argument("--name", default="",
+                            help="what the token is for")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(**{User.USERNAME_FIELD:
+                                       options["username"]})
+        except User.DoesNotExist:
+            raise CommandError(f"no user {options['username']}")
+        if not user.is_staff:
+            raise CommandError(f"{user} is not staff, the API would refuse "
+                               f"its writes")
+
+        _, key = ApiToken.issue(user, options["name"])
+        self.stdout.write(key)
@@ -0,0 +1,152 @@
+"""compare WSGI and ASGI throughput of the htmx endpoints"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from cfc_report.models import Match, Player, Tournament
+from cfc_report.services import database, session
+
+from ._temp_database import temp_database
+
+
+class Command(BaseCommand):
+    """Drive the htmx endpoints through the WSGI handler from a pool of
+    threads, then through the ASGI handler from one event loop, and
+    report the throughput of each. Runs against a temporary SQLite file.
+
+    Every request toggles a different player, or fetches the live
+    standings, alternately, in the session of one of `concurrency` TDs
+    building the same tournament.
+    """
+
+    help = "compare WSGI and ASGI throughput of the htmx endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400,
+                            help="requests per handler")
+        parser.add_argument("--concurrency", type=int, default=16,
+                            help="requests in flight at once")
+        parser.add_argument("--roster", type=int, default=40,
+                            help="players in the tournament")
+
+    def handle(self, *args, **options):
+        n, concurrency = options["requests"], options["concurrency"]
+        offset = options["roster"]
+
+        # on disk, so the TDs saving their sessions at once wait on the
+        # SQLite lock, as they would on the real database
+        with temp_database(on_disk=True):
+            # each handler toggles its own players, past the roster
+            keys = self.populate(offset + 2 * n, offset, concurrency)
+
+            wsgi = self.run_wsgi(self.urls(n, offset, keys), concurrency)
+            asgi = asyncio.run(
+                self.run_asgi(self.urls(n, offset + n, keys), concurrency))
+
+        self.stdout.write(f"{n} requests, {concurrency} concurrent")
+        for label, (seconds, errors) in (("WSGI", wsgi), ("ASGI", asgi)):
+            self.stdout.write(
+                f"{label}: {n / seconds:8.1f} req/s "
+                f"{seconds * 1000 / n:8.2f} ms/req  errors: {errors}")
+
+    @staticmethod
+    def populate(num_players: int, roster: int, tds: int) -> list[str]:
+        """players, a tournament with a round of matches, and the sessions
+        of tds TDs building it with a roster of them
+
+        Returns
+        -------
+        list(str) : the session keys
+        """
+        players = []
+        for n in range(num_players):
+            p = Player(name=f"Player {n}", cfc_id=100000 + n)
+            p.save()
+            players.append(p)
+
+        tournament = Tournament.objects.create(
+            name="Bench Open", num_rounds=1, pairing_system="RR",
+            date=datetime.date.today(), province="ON", to_cfc=100000,
+            td_cfc=100000)
+        Match.objects.bulk_create(
+            Match(white=w, black=b, result="w", round_number=1,
+                  tournament=tournament)
+            for w, b in zip(players[:roster:2], players[1:roster:2])
+        )
+
+        keys = []
+        for _ in range(tds):
+            td_session = SessionStore()
+            td_session["Tournament"] = tournament.pk
+            session.set_tournament_info(
+                td_session, database.get_report_info(tournament))
+            session.update_players(td_session, players[:roster])
+            td_session.save()
+            keys.append(td_session.session_key)
+        return keys
+
+    @staticmethod
+    def urls(n: int, first_player: int,
+             keys: list[str]) -> list[tuple[str, str, str]]:
+        """(method, url, session key) of n requests, toggling players from
+        first_player, sent by each TD in turn"""
+        standings = reverse("live-standings")
+        return [
+            (("post", reverse("create-toggle-player",
+                              args=[str(100000 + first_player + i)]))
+             if i % 2 else ("get", standings)) + (keys[i % len(keys)],)
+            for i in range(n)
+        ]
+
+    @staticmethod
+    def run_wsgi(urls: list, concurrency: int) -> tuple[float, int]:
+        """Returns (seconds taken, failed requests)"""
+
+        def send(request):
+            method, url, key = request
+            client = Client()
+            client.cookies[settings.SESSION_COOKIE_NAME] = key
+            return getattr(client, method)(url).status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            codes = list(pool.map(send, urls))
+        return time.perf_counter() - start, sum(c != 200 for c in codes)
+
+    @staticmethod
+    async def run_asgi(urls: list, concurrency: int) -> tuple[float, int]:
+        """Returns (seconds taken, failed requests)"""
+        in_flight = asyncio.Semaphore(concurrency)
+
+        async def send(request):
+            method, url, key = request
+            client = AsyncClient()
+            client.cookies[settings.SESSION_COOKIE_NAME] = key
+            async with in_flight:
+                response = await getattr(client, method)(url)
+                return response.status_code
+
+        start = time.perf_counter()
+        codes = await asyncio.gather(*(send(r) for r in urls))
+        return time.perf_counter() - start, sum(c != 200 for c in codes)
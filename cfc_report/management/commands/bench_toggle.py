@@ -0,0 +1,107 @@
+"""benchmark rendering an htmx player toggle"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+
+from cfc_report.models import Player
+
+LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+FULL_FORM = "cfc_report/create/player-form.html"
+ROW_FRAGMENT = "cfc_report/create/partials/toggle-player.html"
+
+
+class Command(BaseCommand):
+    """Compare the render time of one player toggle before and after the
+    player form was split into row fragments.
+
+    before: the whole player-form.html, with the un-cached loaders
+    after: the toggle-player.html fragment, with the cached loader
+
+    The players are built in memory, nothing is written to the database.
+    """
+
+    help = "benchmark the render time of an htmx player toggle"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=5000,
+                            help="number of players in the database")
+        parser.add_argument("--selected", type=int, default=30,
+                            help="number of players in the tournament")
+        parser.add_argument("--toggles", type=int, default=20,
+                            help="number of toggles to time")
+
+    def handle(self, *args, **options):
+        players = [Player(name=f"Player {n}", cfc_id=100000 + n)
+                   for n in range(options["players"])]
+        tournament_players = players[:options["selected"]]
+        selected_ids = {p.cfc_id for p in tournament_players}
+
+        full_context = {
+            "players": players,
+            "tournament_players": tournament_players,
+            "selected_ids": selected_ids,
+        }
+        row_context = {
+            "player": players[0],
+            "selected": True,
+            "selected_ids": {players[0].cfc_id},
+        }
+
+        dirs = settings.TEMPLATES[0]["DIRS"]
+        plain = Engine(dirs=dirs, loaders=LOADERS)
+        cached = Engine(dirs=dirs,
+                        loaders=[("django.template.loaders.cached.Loader",
+                                  LOADERS)])
+
+        runs = [
+            ("full form, plain loader (before)", plain, FULL_FORM,
+             full_context),
+            ("full form, cached loader", cached, FULL_FORM, full_context),
+            ("row fragment, plain loader", plain, ROW_FRAGMENT, row_context),
+            ("row fragment, cached loader (after)", cached, ROW_FRAGMENT,
+             row_context),
+        ]
+
+        self.stdout.write(
+            f"{options['players']} players, {options['selected']} selected, "
+            f"{options['toggles']} toggles")
+        for label, engine, name, context in runs:
+            ms = self.time_toggles(engine, name, context, options["toggles"])
+            self.stdout.write(f"{label:40} {ms:10.3f} ms/toggle")
+
+    @staticmethod
+    def time_toggles(engine: Engine, name: str, context: dict,
+                     toggles: int) -> float:
+        """render template name toggles times
+
+        Returns
+        -------
+        float : mean milliseconds per render
+        """
+        # warm up, so the cached loader has compiled the template
+        engine.get_template(name).render(Context(context))
+
+        start = time.perf_counter()
+        for _ in range(toggles):
+            engine.get_template(name).render(Context(context))
+        return (time.perf_counter() - start) * 1000 / toggles
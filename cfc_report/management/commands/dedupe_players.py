@@ -0,0 +1,66 @@
+"""find duplicate players, and merge them"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import time
+
+from django.core.management.base import BaseCommand
+
+from cfc_report.services.dedupe import THRESHOLD, find_duplicates, merge_players
+
+
+class Command(BaseCommand):
+    """List the players that are the same person, and with --merge merge
+    each group into one player, repointing their games and rosters. Only
+    players with the same cfc id are merged, the players that may be the
+    same person are listed for review.
+    """
+
+    help = "find duplicate players, and merge them with --merge"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--merge", action="store_true",
+                            help="merge the duplicates, default only list")
+        parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                            help="least name similarity, 0 to 1, of players "
+                                 "with different cfc ids listed for review")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        found = find_duplicates(options["threshold"])
+        duplicates = found["duplicates"]
+        for group in duplicates:
+            self.stdout.write(self.players(group))
+        self.stdout.write(f"{len(duplicates)} groups of duplicates found in "
+                          f"{time.perf_counter() - start:.1f}s")
+        for pair in found["candidates"]:
+            self.stdout.write(f"review: {self.players(pair)}")
+        self.stdout.write(f"{len(found['candidates'])} pairs to review, "
+                          f"never merged")
+
+        if options["merge"] and duplicates:
+            stats = merge_players(duplicates)
+            self.stdout.write(
+                f"{stats['merged']} players merged, {stats['matches']} "
+                f"match sides and {stats['roster_entries']} roster entries "
+                f"repointed in {time.perf_counter() - start:.1f}s")
+            for group in stats["skipped"]:
+                self.stderr.write(f"not merged, more than one cfc id or "
+                                  f"games between them: pks {group}")
+
+    @staticmethod
+    def players(group: list[dict]) -> str:
+        """one line of players"""
+        return " | ".join(f"{p['name']} ({p['cfc_id']}, pk {p['pk']})"
+                          for p in group)
@@ -0,0 +1,60 @@
+"""export the CTR reports of many tournaments to a zip archive"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cfc_report.services.bulk_export import select_tournaments, zip_tournaments
+from cfc_report.services.writers import WRITERS
+
+
+class Command(BaseCommand):
+    """Write the reports of a date range and/or a list of tournaments to a
+    zip archive. Reports are rendered in a thread pool and added to the
+    archive as they finish.
+    """
+
+    help = "export tournament reports to a zip archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="zip file to write")
+        parser.add_argument("--start", type=datetime.date.fromisoformat,
+                            help="first tournament date, YYYY-MM-DD")
+        parser.add_argument("--end", type=datetime.date.fromisoformat,
+                            help="last tournament date, YYYY-MM-DD")
+        parser.add_argument("--tournament", type=int, action="append",
+                            dest="tournaments", help="tournament id, repeatable")
+        parser.add_argument("--format", action="append", dest="formats",
+                            choices=list(WRITERS),
+                            help="report format, repeatable, default ctr")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="report threads")
+
+    def handle(self, *args, **options):
+        tournaments = select_tournaments(options["start"], options["end"],
+                                         options["tournaments"])
+        count = tournaments.count()
+        if not count:
+            raise CommandError("no tournaments selected")
+
+        with open(options["output"], "wb") as archive:
+            for chunk in zip_tournaments(tournaments,
+                                         options["formats"] or ["ctr"],
+                                         options["workers"]):
+                archive.write(chunk)
+
+        self.stdout.write(f"{count} tournaments exported to "
+                          f"{options['output']}")
@@ -0,0 +1,53 @@
+"""finalize every section of a tournament to CTR files"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from django.core.management.base import BaseCommand, CommandError
+
+from cfc_report.models import Tournament
+from cfc_report.services.sections import finalize_tournament, write_reports
+
+
+class Command(BaseCommand):
+    """Validate every section of a tournament and write a CTR for each,
+    the sections in parallel in a process pool.
+    """
+
+    help = "finalize every section of a tournament to CTR files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("tournament", type=int, help="tournament id")
+        parser.add_argument("--output", default=".",
+                            help="directory to write the CTR files to")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="processes, default one per cpu")
+
+    def handle(self, *args, **options):
+        try:
+            tournament = Tournament.objects.get(pk=options["tournament"])
+        except Tournament.DoesNotExist:
+            raise CommandError(f"no tournament {options['tournament']}")
+
+        reports = finalize_tournament(tournament, options["workers"])
+        for report in reports:
+            for error in report["errors"]:
+                self.stderr.write(f"{report['section'] or tournament.name}: "
+                                  f"{error}")
+        paths = write_reports(reports, options["output"])
+        for path in paths:
+            self.stdout.write(f"written {path}")
+
+        if len(paths) < len(reports):
+            raise CommandError(f"{len(reports) - len(paths)} sections have "
+                               f"errors, their CTR was not written")
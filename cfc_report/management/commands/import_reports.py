@@ -0,0 +1,61 @@
+"""import a season of CTR and TRF reports"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cfc_report.services.importer import SUFFIXES, import_files
+
+
+class Command(BaseCommand):
+    """Import CTR and FIDE TRF report files into Tournament, Round, Match
+    and Player rows. Directories are searched for report files.
+    """
+
+    help = "import CTR and TRF tournament reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+",
+                            help="report files or directories of them")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="parser processes, default one per cpu")
+
+    def handle(self, *args, **options):
+        paths = list(self.find_reports(options["paths"]))
+        if not paths:
+            raise CommandError("no report files found")
+
+        failed = 0
+        for path, tournament, error in import_files(paths, options["workers"]):
+            if error:
+                failed += 1
+                self.stderr.write(f"{path}: {error}")
+            else:
+                self.stdout.write(f"{path}: {tournament.name} "
+                                  f"({tournament.date})")
+
+        self.stdout.write(f"imported {len(paths) - failed} of "
+                          f"{len(paths)} reports")
+
+    @staticmethod
+    def find_reports(paths: list[str]):
+        """the report files in paths"""
+        for path in map(Path, paths):
+            if path.is_dir():
+                yield from sorted(str(p) for p in path.rglob("*")
+                                  if p.suffix.lower() in SUFFIXES)
+            else:
+                yield str(path)
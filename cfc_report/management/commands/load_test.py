@@ -0,0 +1,299 @@
+"""simulate tournament directors and spectators against a temp database"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection
+from django.test import Client
+from django.urls import reverse
+
+from cfc_report.models import ApiToken, Player
+
+from ._temp_database import temp_database
+
+# The TDs enter their tournaments through the JSON API, as their pairing
+# programs would.
+
+USERNAME = "load-td"
+# tries of a request that failed on a locked database or a server error,
+# the first waiting RETRY_WAIT seconds, each next twice as long
+RETRIES = 3
+RETRY_WAIT = 0.05
+CODES = ("w", "b", "d")
+
+
+class Command(BaseCommand):
+    """K tournament directors each enter a tournament, its roster, the
+    pairings and results of every round, then download its CTR, while M
+    spectators poll the standings and results of the tournaments being
+    entered. Every request goes through the WSGI handler, as gunicorn's
+    sync workers run it, from its own thread, against a temporary SQLite
+    file the configured databases never see.
+
+    Reports the throughput and p50/p95/p99 latency of each kind of
+    request, the failed ones, and how many failed on a locked database.
+    A failed request is retried, every try counted, and a TD whose request
+    failed for good goes on with the rest of its tournament, so the lock
+    errors of the whole run are reported. Run with
+    DJANGO_CONFIGURATION=Prod to use its SQLite pragmas.
+    """
+
+    help = "load test the report flows of concurrent TDs and spectators"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tds", type=int, default=4,
+                            help="tournament directors, one tournament each")
+        parser.add_argument("--spectators", type=int, default=16,
+                            help="spectators polling result pages")
+        parser.add_argument("--players", type=int, default=20,
+                            help="players in each tournament")
+        parser.add_argument("--rounds", type=int, default=5,
+                            help="rounds in each tournament")
+        parser.add_argument("--poll", type=float, default=0.1,
+                            help="seconds a spectator waits between pages")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="seed of the random results")
+
+    def handle(self, *args, **options):
+        tds, spectators = options["tds"], options["spectators"]
+        num_players = options["players"] + options["players"] % 2
+        num_rounds = min(options["rounds"], num_players - 1)
+        random.seed(options["seed"])
+
+        with temp_database(on_disk=True):
+            user = User.objects.create_user(USERNAME, is_staff=True)
+            _, self.key = ApiToken.issue(user, "load test")
+            Player.objects.bulk_create(
+                Player(name=f"Load Player {n}", cfc_id=100000 + n,
+                       slug=Player.make_slug(f"Load Player {n}", 100000 + n))
+                for n in range(tds * num_players))
+
+            self.samples = []
+            self.gave_up = []
+            self.tournaments = []
+            done = threading.Event()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=tds + spectators) as pool:
+                entering = [
+                    pool.submit(self.td, n, num_players, num_rounds)
+                    for n in range(tds)]
+                watching = [pool.submit(self.spectator, done,
+                                        options["poll"])
+                            for _ in range(spectators)]
+                for future in entering:
+                    future.result()
+                done.set()
+                for future in watching:
+                    future.result()
+            seconds = time.perf_counter() - start
+
+        self.report(seconds, tds, spectators, num_players, num_rounds)
+
+    def send(self, client: Client, kind: str, method: str, url: str,
+             data=None, **headers):
+        """send a request and record its latency, data is the query of a
+        GET and the JSON body of anything else. A request failing on a
+        locked database or with a server error is tried RETRIES times,
+        each try recorded.
+
+        Returns
+        -------
+        HttpResponse or None if the view raised every time
+        """
+        if data is not None and method != "get":
+            headers["content_type"] = "application/json"
+            data = json.dumps(data)
+        for attempt in range(RETRIES):
+            if attempt:
+                time.sleep(RETRY_WAIT * 2 ** (attempt - 1))
+            response, error = self.attempt(client, kind, method, url, data,
+                                           headers)
+            if error is None or not retryable(response, error):
+                break
+        if error is not None:
+            self.gave_up.append((kind, error))
+        return response
+
+    def attempt(self, client: Client, kind: str, method: str, url: str,
+                data, headers: dict) -> tuple:
+        """send a request once and record it
+
+        Returns
+        -------
+        tuple(HttpResponse or None, error or None)
+        """
+        start = time.perf_counter()
+        try:
+            response = getattr(client, method)(url, data, **headers)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            error = None if response.status_code < 400 else \
+                str(response.status_code)
+        except OperationalError as err:
+            response, error = None, ("locked" if "locked" in str(err)
+                                     else f"OperationalError: {err}")
+        except Exception as err:
+            response, error = None, f"{type(err).__name__}: {err}"
+        finally:
+            close_old_connections()
+        self.samples.append((kind, time.perf_counter() - start, error))
+        return response, error
+
+    def td(self, n: int, num_players: int, num_rounds: int) -> None:
+        """enter a whole tournament, as a TD or their pairing program"""
+        client = Client()
+        auth = {"HTTP_AUTHORIZATION": f"Token {self.key}"}
+        try:
+            response = self.send(
+                client, "td: create tournament", "post",
+                reverse("api-tournaments"),
+                [{"name": f"Load Open {n}", "num_rounds": num_rounds,
+                  "date": datetime.date.today().isoformat(),
+                  "pairing_system": "RR", "province": "ON",
+                  "td_cfc": 100000, "to_cfc": 100000}], **auth)
+            try:
+                pk = results(response)[0]["id"]
+            except ValueError:
+                # nothing to enter without the tournament
+                self.stderr.write(f"TD {n} stopped: its tournament was not "
+                                  f"created")
+                return
+            cfc_ids = [100000 + n * num_players + i
+                       for i in range(num_players)]
+            self.send(client, "td: roster", "put",
+                      reverse("api-roster", args=[pk]),
+                      [{"cfc_id": cfc_id} for cfc_id in cfc_ids], **auth)
+            self.tournaments.append(pk)
+
+            for number in range(1, num_rounds + 1):
+                pairings = [{"white": w, "black": b, "result": "_"}
+                            for w, b in round_robin(cfc_ids, number)]
+                response = self.send(
+                    client, "td: pair round", "put",
+                    reverse("api-round", args=[pk, number]), pairings,
+                    **auth)
+                try:
+                    ids = [m["id"] for m in results(response)]
+                except ValueError:
+                    # counted, the TD goes on to the next round
+                    self.stderr.write(f"TD {n}: round {number} not paired")
+                    continue
+                # results come in a game at a time
+                for match_id in ids:
+                    self.send(client, "td: enter result", "patch",
+                              reverse("api-matches", args=[pk]),
+                              [{"id": match_id,
+                                "result": random.choice(CODES)}], **auth)
+
+            self.send(client, "td: export ctr", "get",
+                      reverse("export-report", args=[pk]),
+                      {"format": "ctr"})
+        finally:
+            connection.close()
+
+    def spectator(self, done: threading.Event, poll: float) -> None:
+        """poll the standings and results of the tournaments entered"""
+        client = Client()
+        try:
+            while not done.is_set():
+                if not self.tournaments:
+                    time.sleep(poll)
+                    continue
+                pk = random.choice(self.tournaments)
+                self.send(client, "spectator: standings", "get",
+                          reverse("api-standings", args=[pk]))
+                self.send(client, "spectator: results", "get",
+                          reverse("api-matches", args=[pk]))
+                time.sleep(poll)
+        finally:
+            connection.close()
+
+    def report(self, seconds: float, tds: int, spectators: int,
+               num_players: int, num_rounds: int) -> None:
+        """write throughput, latency percentiles and errors by kind"""
+        by_kind = defaultdict(list)
+        errors = defaultdict(int)
+        for kind, latency, error in self.samples:
+            by_kind[kind].append(latency)
+            if error:
+                errors[error] += 1
+
+        self.stdout.write(
+            f"{tds} TDs, {spectators} spectators, {num_players} players, "
+            f"{num_rounds} rounds: {len(self.samples)} requests in "
+            f"{seconds:.2f} s, {len(self.samples) / seconds:.1f} req/s")
+        self.stdout.write(f"{'':24} {'requests':>8} {'req/s':>8} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for kind, latencies in sorted(by_kind.items()):
+            p50, p95, p99 = percentiles(latencies)
+            self.stdout.write(
+                f"{kind:24} {len(latencies):8} "
+                f"{len(latencies) / seconds:8.1f} {p50 * 1000:8.1f} "
+                f"{p95 * 1000:8.1f} {p99 * 1000:8.1f}")
+        self.stdout.write(f"failed: {sum(errors.values())}, "
+                          f"database locked: {errors.pop('locked', 0)}, "
+                          f"given up after {RETRIES} tries: "
+                          f"{len(self.gave_up)}")
+        for error, count in sorted(errors.items()):
+            self.stdout.write(f"  {count} x {error}")
+
+
+def results(response) -> list:
+    """the "results" of an API response
+
+    Raises
+    ------
+    ValueError if the request failed
+    """
+    if response is None or response.status_code >= 400:
+        raise ValueError("a request failed")
+    return json.loads(response.content)["results"]
+
+
+def retryable(response, error: str) -> bool:
+    """True if a failed request may pass if tried again: the database was
+    locked, or the server failed, not the request"""
+    return error == "locked" or response is None \
+        or response.status_code >= 500
+
+
+def round_robin(cfc_ids: list, number: int) -> list[tuple]:
+    """the (white, black) games of round number of a round robin of an
+    even number of players, by the circle method"""
+    rest = cfc_ids[1:]
+    shift = (number - 1) % len(rest)
+    circle = [cfc_ids[0]] + rest[shift:] + rest[:shift]
+    half = len(circle) // 2
+    games = zip(circle[:half], reversed(circle[half:]))
+    # alternate colours by round
+    return [(w, b) if number % 2 else (b, w) for w, b in games]
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float, float]:
+    """p50, p95 and p99 of latencies"""
+    if len(latencies) < 2:
+        return (latencies[0],) * 3 if latencies else (0.0,) * 3
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
@@ -0,0 +1,52 @@
+"""run queued background jobs"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from django.core.management.base import BaseCommand
+
+from cfc_report.services import jobs
+
+
+class Command(BaseCommand):
+    """The worker of the background jobs: CTRs, imports and exports queued
+    by the web app. Run one, or more on other machines sharing the database;
+    each job is run by one worker only.
+    """
+
+    help = "run queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2,
+                            help="jobs run at once")
+        parser.add_argument("--poll", type=float, default=jobs.POLL_INTERVAL,
+                            help="seconds between looks at an empty queue")
+        parser.add_argument("--once", action="store_true",
+                            help="stop when the queue is empty")
+        parser.add_argument("--recover", action="store_true",
+                            help="queue again the jobs left running by a "
+                                 "dead worker, only with no other worker")
+        parser.add_argument("--purge", type=int, metavar="DAYS",
+                            help="first delete jobs finished DAYS ago")
+
+    def handle(self, *args, **options):
+        if options["purge"] is not None:
+            self.stdout.write(f"{jobs.purge(options['purge'])} old jobs "
+                              f"deleted")
+        if options["recover"]:
+            self.stdout.write(f"{jobs.requeue_running()} jobs queued again")
+        try:
+            jobs.run_worker(options["workers"], options["poll"],
+                            options["once"])
+        except KeyboardInterrupt:
+            self.stdout.write("worker stopped")
@@ -0,0 +1,103 @@
+"""middleware of the cfc_report app"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import cProfile
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve
+
+from cfc_report.services import profiling
+
+# ?profile in the url, or this header, asks for a request to be profiled
+PROFILE_PARAM = "profile"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+
+def asked(request) -> bool:
+    """if request asks to be profiled"""
+    return PROFILE_PARAM in request.GET or PROFILE_HEADER in request.META
+
+
+class ProfileMiddleware:
+    """Profile a request of a staff user who asks for it, saving the
+    profile to settings.PROFILE_DIR, see cfc_report.services.profiling.
+    The response names the profile in its X-Profile header.
+
+    Any other request costs a dict lookup, and nothing at all when
+    PROFILE_DIR is empty, the middleware is then left out. Goes after
+    AuthenticationMiddleware, which gives request.user. A streaming
+    response is profiled up to its first byte, not while it streams.
+
+    Under ASGI the middleware is async, so the chain is not moved to a
+    thread for it, and cProfile runs in the thread the view runs in: the
+    request's sync thread for a sync view, the event loop for an async
+    one, where the other requests running meanwhile are profiled too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not profiling.profile_dir():
+            raise MiddlewareNotUsed("PROFILE_DIR is not set")
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not asked(request) or not request.user.is_staff:
+            return self.get_response(request)
+
+        response, profiler = profiling.profile(self.get_response, request)
+        response["X-Profile"] = profiling.save(profiler, request.method,
+                                               request.path)
+        return response
+
+    async def __acall__(self, request):
+        if not asked(request) or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        # a sync view runs in the request's thread sensitive executor, and
+        # so do these sync_to_async calls
+        sync_view = not async_view(request)
+        if sync_view:
+            await sync_to_async(profiler.enable)()
+        else:
+            profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if sync_view:
+                await sync_to_async(profiler.disable)()
+            else:
+                profiler.disable()
+        response["X-Profile"] = await sync_to_async(profiling.save)(
+            profiler, request.method, request.path)
+        return response
+
+
+def async_view(request) -> bool:
+    """if the view of request is a coroutine function"""
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return False
+    return iscoroutinefunction(match.func)
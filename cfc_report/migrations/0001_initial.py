@@ -0,0 +1,165 @@
+# Generated by Django 5.1.2 on 2026-10-19 12:57
+
+import cfc_report.model_fields
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Report',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(editable=False, max_length=64, unique=True)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=30)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed'), ('cancelled', 'cancelled')], default='queued', max_length=10)),
+                ('progress', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('message', models.CharField(blank=True, max_length=200)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('output', models.CharField(blank=True, max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='job_queue')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Player',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('cfc_id', cfc_report.model_fields.CfcIdField()),
+                ('slug', models.SlugField(default='', unique=True)),
+                ('rating', models.IntegerField(default=0)),
+                ('fide_id', models.PositiveBigIntegerField(blank=True, null=True, unique=True)),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['cfc_id'], name='player_cfc_id'), models.Index(fields=['name'], name='player_name')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Roster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('players', models.ManyToManyField(blank=True, related_name='rosters', to='cfc_report.player')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tournament',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Tournament Name.', max_length=60)),
+                ('num_rounds', models.IntegerField()),
+                ('date', models.DateField()),
+                ('pairing_system', cfc_report.model_fields.PairingSystemField(choices=[('SW', 'Swiss'), ('RR', 'round robin'), ('DR', 'double round robin')], max_length=2)),
+                ('province', cfc_report.model_fields.ProvinceField(choices=[('ON', 'Ontario'), ('QC', 'Quebec'), ('NS', 'Nova Scotia'), ('NB', 'New Brunswick'), ('MB', 'Manitoba'), ('BC', 'British Columbia'), ('PE', 'Prince Edward Island'), ('SK', 'Saskatchewan'), ('AB', 'Alberta'), ('NL', 'Newfoundland and Labrador')], max_length=2)),
+                ('to_cfc', cfc_report.model_fields.CfcIdField()),
+                ('td_cfc', cfc_report.model_fields.CfcIdField()),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('roster', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tournament_roster', to='cfc_report.roster')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Section',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('num_rounds', models.IntegerField()),
+                ('pairing_system', cfc_report.model_fields.PairingSystemField(choices=[('SW', 'Swiss'), ('RR', 'round robin'), ('DR', 'double round robin')], max_length=2)),
+                ('roster', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='section_roster', to='cfc_report.roster')),
+                ('tournament', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='cfc_report.tournament')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Round',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_num', models.IntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(999)])),
+                ('section', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='cfc_report.section')),
+                ('tournament', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='cfc_report.tournament')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result', models.CharField(choices=[('b', '0 - 1'), ('w', '1 - 0'), ('d', '0.5 - 0.5'), ('+', '+ - -'), ('-', '- - +'), ('B', '1 - bye'), ('H', '0.5 - bye'), ('U', '0 - bye'), ('_', '_')], default='_', max_length=1)),
+                ('round_number', models.IntegerField()),
+                ('client_id', models.UUIDField(blank=True, null=True, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('black', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='black_player', to='cfc_report.player')),
+                ('white', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='white_player', to='cfc_report.player')),
+                ('section', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='cfc_report.section')),
+                ('tournament', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='cfc_report.tournament')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TournamentDirector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('cfc_id', cfc_report.model_fields.CfcIdField()),
+                ('slug', models.SlugField(default='', unique=True)),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['cfc_id'], name='tournamentdirector_cfc_id'), models.Index(fields=['name'], name='tournamentdirector_name')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TournamentOrganizer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20)),
+                ('cfc_id', cfc_report.model_fields.CfcIdField()),
+                ('slug', models.SlugField(default='', unique=True)),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['cfc_id'], name='tournamentorganizer_cfc_id'), models.Index(fields=['name'], name='tournamentorganizer_name')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='tournament',
+            constraint=models.UniqueConstraint(fields=('name', 'date'), name='unique_tournament_name_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='section',
+            constraint=models.UniqueConstraint(fields=('tournament', 'name'), name='unique_section_name'),
+        ),
+    ]
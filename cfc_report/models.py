@@ -14,11 +14,15 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
 import json
+import secrets
 
+from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 
 from . import logger
@@ -48,6 +52,8 @@ class PersonWithCfcId(models.Model):
         create a serialized version of this Player
     decode(cls) : Player
         classmethod to decode a serialized player into a python object
+    make_slug(name, cfc_id) : str
+        the slug of a person, for when save() is bypassed by bulk_create
     """
 
     name = models.CharField(max_length=20)
@@ -55,6 +61,20 @@ class PersonWithCfcId(models.Model):
     slug = models.SlugField(default="", unique=True, null=False)
     # make sure slug exists for every person
 
+    class Meta:
+        # each kind of person gets its own table, so they can be bulk created
+        abstract = True
+        # players are looked up by id, and searched by name prefix
+        indexes = [
+            models.Index(fields=["cfc_id"], name="%(class)s_cfc_id"),
+            models.Index(fields=["name"], name="%(class)s_name"),
+        ]
+
+    @staticmethod
+    def make_slug(name: str, cfc_id: "CfcId") -> str:
+        """the unique slug of a person, names are not unique on their own"""
+        return slugify(f"{name}-{cfc_id}")
+
     def save(self, *args, **kwargs):
         """create slug url before saving
         Override of save()
@@ -68,7 +88,7 @@ class PersonWithCfcId(models.Model):
         None
         """
 
-        self.slug = slugify(self.name)
+        self.slug = self.make_slug(self.name, self.cfc_id)
         logger.info(
             "PersonWithCfdId: (%s) saved and slug (%s) created for it", self, self.slug
         )
@@ -107,6 +127,11 @@ class Player(PersonWithCfcId):
         CFC Id of the player
     slug : SlugField
         unique slug for this players url
+    rating : IntegerField
+        the player's rating, 0 if unknown
+    fide_id : PositiveBigIntegerField
+        the player's FIDE id, None if unknown, what a TRF report knows
+        them by
 
     Methods
     -------
@@ -119,6 +144,10 @@ class Player(PersonWithCfcId):
         classmethod to decode a serialized player into a python object
     """
 
+    rating = models.IntegerField(default=0)
+    fide_id = models.PositiveBigIntegerField(null=True, blank=True,
+                                             unique=True)
+
     def __str__(self):
         return f"Player: {self.name} CFC: {self.cfc_id}"
 
@@ -221,7 +250,7 @@ class Roster(models.Model):
 
     Attributes
     ----------
-    players : ForeignKey
+    players : ManyToManyField
         players in roster
 
     Methods
@@ -230,11 +259,12 @@ class Roster(models.Model):
         number of players in this roster
     """
 
-    players = models.ForeignKey(Player, on_delete=models.CASCADE)
+    players = models.ManyToManyField(Player, related_name="rosters",
+                                     blank=True)
 
     def size(self):
         """Number of Player ie: size of this roster"""
-        raise NotImplementedError
+        return self.players.count()
 
 
 class Match(models.Model):
@@ -245,29 +275,70 @@ class Match(models.Model):
     white : Player
         the White player in the match
     black : Player
-        the black player in the match
+        the black player in the match, None for a bye
     result : CharField
-        KEY: {b == black victory, w == white victory, d == no victory)
+        KEY: {b == black victory, w == white victory, d == no victory,
+        + == white wins by forfeit, - == black wins by forfeit,
+        B == full point bye, H == half point bye,
+        U == unpaired or withdrawn for the round,
+        _ == not played yet}, see services/results.py
+        A bye or withdrawal is a match with only a white player, so it is
+        counted by the same queries as a game.
     round_number : Int
         What round of the tournament this game is for
+    tournament : Tournament
+        the tournament this game was played in, if it has been saved
+    section : Section
+        the section of the tournament, None if it has no sections
+    client_id : UUIDField
+        id given by the offline result queue that entered this match, if any
+    version : PositiveIntegerField
+        edit count from the offline result queue, the highest version wins
     """
 
-    RESULT_CHOICES = [("b", "0 - 1"), ("w", "1 - 0"), ("d", "0.5 - 0.5"), ("_", "_")]
+    RESULT_CHOICES = [
+        ("b", "0 - 1"),
+        ("w", "1 - 0"),
+        ("d", "0.5 - 0.5"),
+        ("+", "+ - -"),
+        ("-", "- - +"),
+        ("B", "1 - bye"),
+        ("H", "0.5 - bye"),
+        ("U", "0 - bye"),
+        ("_", "_"),
+    ]
 
     white = models.ForeignKey(
         Player, on_delete=models.CASCADE, related_name="white_player"
     )
     black = models.ForeignKey(
-        Player, on_delete=models.CASCADE, related_name="black_player"
+        Player, on_delete=models.CASCADE, related_name="black_player",
+        null=True, blank=True,
     )
     result = models.CharField(
-        max_length=1, choices=RESULT_CHOICES, default=RESULT_CHOICES[3]
+        max_length=1, choices=RESULT_CHOICES, default="_"
     )
     round_number = models.IntegerField()
+    tournament = models.ForeignKey(
+        "Tournament", on_delete=models.CASCADE, related_name="matches",
+        null=True, blank=True,
+    )
+    section = models.ForeignKey(
+        "Section", on_delete=models.CASCADE, related_name="matches",
+        null=True, blank=True,
+    )
+    client_id = models.UUIDField(null=True, blank=True, unique=True)
+    version = models.PositiveIntegerField(default=0)
 
     def get_absolute_url(self):
         return reverse("select-match-round", kwargs={"pk": self.pk})
 
+    @property
+    def is_bye(self) -> bool:
+        """True if this is a bye or withdrawal, not a game"""
+        # black_id first: no query, and an unsaved black player has no id
+        return self.black_id is None and self.black is None
+
     def __str__(self):
         return (
             f"MATCH - [ "
@@ -285,11 +356,23 @@ class Round(models.Model):
     ----------
     round_num : IntegerField
         the round of it's tournament this is
+    tournament : Tournament
+        the tournament this round is in
+    section : Section
+        the section of the tournament, None if it has no sections
     """
 
     round_num = models.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(999)]
     )
+    tournament = models.ForeignKey(
+        "Tournament", on_delete=models.CASCADE, related_name="rounds",
+        null=True, blank=True,
+    )
+    section = models.ForeignKey(
+        "Section", on_delete=models.CASCADE, related_name="rounds",
+        null=True, blank=True,
+    )
 
 
 
@@ -299,9 +382,17 @@ class Tournament(models.Model):
     Attributes
     ----------
     name : models.CharField
-        name of the tournament
+        name of the tournament, unique together with date
     num_rounds : models.IntegerField
         number of rounds
+    roster : Roster
+        the players in the tournament
+    rounds : reverse ForeignKey
+        the Round's of the tournament
+    matches : reverse ForeignKey
+        the Match's played in the tournament
+    sections : reverse ForeignKey
+        the Section's of the tournament, none for a single section event
     date : models.DateField
         The date of the tournament
     pairing_system : PairingSystem
@@ -312,6 +403,9 @@ class Tournament(models.Model):
         The CFC ID of the TournamentOrganizer
     td_cfc : CfcIdField
         The CFC ID of the TournamentDirector
+    version : models.PositiveIntegerField
+        counts changes to the tournament, its roster and matches, so what is
+        computed from them can be cached, see services/snapshot.py
 
     Methods
     -------
@@ -319,19 +413,14 @@ class Tournament(models.Model):
         add a player to the tournament
     """
 
-    name = models.CharField(help_text="Tournament Name.", primary_key=True, max_length=30)
+    name = models.CharField(help_text="Tournament Name.", max_length=60)
     num_rounds = models.IntegerField()
     roster = models.ForeignKey(
         Roster,
-        on_delete=models.CASCADE,
+        on_delete=models.SET_NULL,
         related_name="tournament_roster",
-        default=False,
-    )
-    rounds = models.ForeignKey(
-        Round,
-        on_delete=models.CASCADE,
-        related_name="rounds_in_tournament",
-        default=False,
+        null=True,
+        blank=True,
     )
 
     date = models.DateField()
@@ -339,7 +428,13 @@ class Tournament(models.Model):
     province = ProvinceField()
     to_cfc = CfcIdField()  # TournamentOrganizer CFC id
     td_cfc = CfcIdField()  # TournamentDirector CFC id
+    version = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["name", "date"],
+                                    name="unique_tournament_name_date"),
+        ]
 
     def __str__(self):
         return f"""Tournament name: {self.name}
@@ -352,6 +447,178 @@ class Tournament(models.Model):
         """
 
 
+class Section(models.Model):
+    """A section of a cfc rated tournament, ie: Open, U1800, U1400.
+    Each section has its own players and rounds, and is reported in its
+    own CTR.
+
+    Attributes
+    ----------
+    name : models.CharField
+        name of the section, unique in its tournament
+    tournament : Tournament
+        the tournament this section is in
+    roster : Roster
+        the players in the section
+    num_rounds : models.IntegerField
+        number of rounds
+    pairing_system : PairingSystem
+        The pairing system used in this section.
+    rounds : reverse ForeignKey
+        the Round's of the section
+    matches : reverse ForeignKey
+        the Match's played in the section
+    """
+
+    name = models.CharField(max_length=30)
+    tournament = models.ForeignKey(
+        Tournament, on_delete=models.CASCADE, related_name="sections"
+    )
+    roster = models.ForeignKey(
+        Roster,
+        on_delete=models.SET_NULL,
+        related_name="section_roster",
+        null=True,
+        blank=True,
+    )
+    num_rounds = models.IntegerField()
+    pairing_system = PairingSystemField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tournament", "name"],
+                                    name="unique_section_name"),
+        ]
+
+    def __str__(self):
+        return f"Section: {self.name} of {self.tournament.name}"
+
+
+class Job(models.Model):
+    """A long task run off the request path by the run_jobs worker,
+    see services/jobs.py
+
+    Attributes
+    ----------
+    kind : CharField
+        which task, one of services.jobs.HANDLERS
+    params : JSONField
+        arguments of the task, plain data
+    status : CharField
+        one of Job.STATUS_CHOICES
+    progress, total : PositiveIntegerField
+        steps done out of total, total 0 if not known yet
+    message : CharField
+        what the job is doing, or why it failed
+    result : JSONField
+        what the task returned, ie: {"filename": ...} or {"errors": [...]}
+    output : CharField
+        path of the file the task wrote, if any
+    attempts, max_attempts : PositiveIntegerField
+        runs started, and how many a failing job gets
+    cancel_requested : BooleanField
+        set to stop a running job at its next progress report
+    run_after : DateTimeField
+        not run before, later for a retry
+    created, started, finished : DateTimeField
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    STATUS_CHOICES = [
+        (QUEUED, "queued"),
+        (RUNNING, "running"),
+        (DONE, "done"),
+        (FAILED, "failed"),
+        (CANCELLED, "cancelled"),
+    ]
+    FINISHED = (DONE, FAILED, CANCELLED)
+
+    kind = models.CharField(max_length=30)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    output = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    run_after = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"],
+                                name="job_queue")]
+
+    @property
+    def is_finished(self) -> bool:
+        """True once the job will not run again"""
+        return self.status in self.FINISHED
+
+    @property
+    def percent(self) -> int:
+        """progress as a whole percentage, 0 while the total is unknown"""
+        return 100 * self.progress // self.total if self.total else 0
+
+    def get_absolute_url(self):
+        return reverse("job", kwargs={"pk": self.pk})
+
+    def __str__(self):
+        return f"Job {self.pk}: {self.kind} {self.status}"
+
+
+class ApiToken(models.Model):
+    """A key a script writes through the JSON API with, see views/api.py.
+    Only the SHA-256 of the key is kept, the key is shown once, by issue.
+
+    Attributes
+    ----------
+    digest : CharField
+        hex SHA-256 of the key, what a write is looked up by
+    user : User
+        who writes with the key, a staff user
+    name : CharField
+        what the key is for, ie: the pairing program using it
+    created : DateTimeField
+    """
+
+    digest = models.CharField(max_length=64, unique=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE,
+                             related_name="api_tokens")
+    name = models.CharField(max_length=100, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def hash(key: str) -> str:
+        """the digest of key, one SHA-256 and no salt: the key is random,
+        so it needs no slow hash and can be looked up by its digest"""
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, name: str = "") -> tuple["ApiToken", str]:
+        """make a token for user
+
+        Returns
+        -------
+        tuple(ApiToken, str) : the saved token, and its key
+        """
+        key = secrets.token_urlsafe(32)
+        return cls.objects.create(digest=cls.hash(key), user=user,
+                                  name=name), key
+
+    def __str__(self):
+        return f"API token {self.pk} of {self.user}: {self.name}"
+
+
 class Report(models.Model):
     """A CFC Report for a tournament
 
@@ -0,0 +1,518 @@
+"""JSON API: field selection, cursor pagination, ETags and bulk writes"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import base64
+import binascii
+import hashlib
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import QuerySet
+
+from cfc_report import logger
+from cfc_report.models import Match, Player, Roster, Tournament
+from cfc_report.services import database, results
+from cfc_report.services.importer import upsert_players
+from cfc_report.services.snapshot import RosterSnapshot
+
+# Reads select only the requested columns with values_list, so no model is
+# built for a row. Writes take arrays and are saved with bulk queries in one
+# transaction: every item is checked first and nothing is saved if any is
+# wrong.
+
+# rows of a page, ?limit= asks for up to MAX_PAGE_SIZE
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# items of a bulk write
+MAX_BULK = 5000
+
+# API field -> ORM lookup, by resource
+TOURNAMENT_FIELDS = {
+    "id": "pk",
+    "name": "name",
+    "date": "date",
+    "num_rounds": "num_rounds",
+    "pairing_system": "pairing_system",
+    "province": "province",
+    "td_cfc": "td_cfc",
+    "to_cfc": "to_cfc",
+}
+PLAYER_FIELDS = {
+    "cfc_id": "cfc_id",
+    "name": "name",
+    "rating": "rating",
+}
+ROUND_FIELDS = {
+    "id": "pk",
+    "round": "round_num",
+    "section": "section__name",
+}
+MATCH_FIELDS = {
+    "id": "pk",
+    "round": "round_number",
+    "white": "white__cfc_id",
+    "black": "black__cfc_id",
+    "result": "result",
+    "section": "section__name",
+}
+
+
+class ApiException(Exception):
+    """A request the API cannot answer
+
+    Attributes
+    ----------
+    status : int
+        HTTP status of the answer
+    errors : dict
+        what is wrong, ie: {item index: message} of a bulk write
+    """
+
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors or {}
+
+
+def select_fields(spec: str | None, available: dict) -> dict:
+    """The fields asked for with ?fields=a,b, every field by default
+
+    Raises
+    ------
+    ApiException for a field the resource does not have
+    """
+    if not spec:
+        return available
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiException(f"unknown fields {unknown}, "
+                           f"choose from {list(available)}")
+    return {name: available[name] for name in names}
+
+
+def rows(queryset: QuerySet, fields: dict) -> list[dict]:
+    """the rows of queryset with only fields, in one query"""
+    names = list(fields)
+    return [dict(zip(names, row))
+            for row in queryset.values_list(*fields.values())]
+
+
+def encode_cursor(pk: int) -> str:
+    """opaque cursor of the page after the row pk"""
+    return base64.urlsafe_b64encode(f"pk:{pk}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """the pk a cursor continues after
+
+    Raises
+    ------
+    ApiException for a cursor this API did not make
+    """
+    try:
+        kind, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        if kind != "pk":
+            raise ValueError(kind)
+        return int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ApiException(f"bad cursor {cursor!r}") from None
+
+
+def page(queryset: QuerySet, fields: dict, cursor: str = None,
+         limit: str = None) -> dict:
+    """One page of rows, keyset paginated on pk, so a page costs the same
+    however deep it is
+
+    Parameters
+    ----------
+    queryset : the rows to page
+    fields : the fields of a row, from select_fields
+    cursor : "next" of the previous page, None for the first
+    limit : rows of the page, default PAGE_SIZE
+
+    Returns
+    -------
+    dict
+        {"results": [row], "next": cursor of the next page or None}
+    """
+    try:
+        limit = min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiException(f"bad limit {limit!r}") from None
+    if limit < 1:
+        raise ApiException(f"bad limit {limit!r}")
+
+    queryset = queryset.order_by("pk")
+    if cursor:
+        queryset = queryset.filter(pk__gt=decode_cursor(cursor))
+    # the pk is read for the cursor, even if it was not asked for
+    found = rows(queryset[:limit + 1], {"_pk": "pk", **fields})
+    more = len(found) > limit
+    found = found[:limit]
+    last = found[-1]["_pk"] if found else None
+    for row in found:
+        del row["_pk"]
+    return {"results": found,
+            "next": encode_cursor(last) if more else None}
+
+
+def render(data) -> bytes:
+    """the JSON body of an answer"""
+    return json.dumps(data, cls=DjangoJSONEncoder,
+                      separators=(",", ":")).encode()
+
+
+def etag(body: bytes) -> str:
+    """strong ETag of a body, so any change of the data changes it"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def tournament_rows(pks: list[int] = None) -> QuerySet:
+    """tournaments, all of them or those with pks"""
+    tournaments = Tournament.objects.all()
+    if pks is not None:
+        tournaments = tournaments.filter(pk__in=pks)
+    return tournaments
+
+
+def roster_rows(t: Tournament) -> QuerySet:
+    """the players of a tournament"""
+    if t.roster_id is None:
+        return Player.objects.none()
+    return Player.objects.filter(rosters=t.roster_id)
+
+
+def match_rows(t: Tournament, round_number: int = None) -> QuerySet:
+    """the matches of a tournament, or of one of its rounds"""
+    matches = Match.objects.filter(tournament=t)
+    if round_number is not None:
+        matches = matches.filter(round_number=round_number)
+    return matches
+
+
+def standings(snap: RosterSnapshot) -> list[dict]:
+    """the standings of a tournament snapshot, best first"""
+    buchholz = snap.buchholz()
+    return [
+        {"rank": rank, "cfc_id": snap.cfc_ids[i], "name": snap.names[i],
+         "rating": snap.ratings[i], "points": snap.scores[i],
+         "played": snap.played[i], "buchholz": buchholz[i],
+         "colours": snap.colour_history(i)}
+        for rank, i in enumerate(snap.ranking(buchholz), start=1)
+    ]
+
+
+def _items(items, key: str = None) -> list[dict]:
+    """check the body of a bulk write is an array of objects, with key"""
+    if not isinstance(items, list):
+        raise ApiException("the body must be an array")
+    if len(items) > MAX_BULK:
+        raise ApiException(f"at most {MAX_BULK} items in one request",
+                           status=413)
+    errors = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[i] = "not an object"
+        elif key and key not in item:
+            errors[i] = f"no {key!r}"
+        elif key == "id" and type(item["id"]) is not int:
+            errors[i] = "the id must be an integer"
+    if errors:
+        raise ApiException("bad items", errors=errors)
+    return items
+
+
+def _check(instances: list, exclude: list[str]) -> None:
+    """full_clean every instance
+
+    Raises
+    ------
+    ApiException with the errors of each bad instance, by index
+    """
+    errors = {}
+    for i, instance in enumerate(instances):
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False)
+        except ValidationError as err:
+            errors[i] = err.message_dict
+    if errors:
+        raise ApiException("bad items", errors=errors)
+
+
+# writable tournament fields
+TOURNAMENT_WRITABLE = [name for name in TOURNAMENT_FIELDS if name != "id"]
+
+
+def create_tournaments(items: list[dict]) -> list[Tournament]:
+    """Create tournaments, each an object of TOURNAMENT_WRITABLE fields"""
+    items = _items(items)
+    tournaments = []
+    errors = {}
+    for i, item in enumerate(items):
+        unknown = set(item) - set(TOURNAMENT_WRITABLE)
+        if unknown:
+            errors[i] = f"unknown fields {sorted(unknown)}"
+        tournaments.append(Tournament(**{k: v for k, v in item.items()
+                                         if k in TOURNAMENT_WRITABLE}))
+    if errors:
+        raise ApiException("bad items", errors=errors)
+    _check(tournaments, exclude=["roster"])
+
+    with transaction.atomic():
+        for t in tournaments:
+            t.roster = Roster.objects.create()
+        Tournament.objects.bulk_create(tournaments)
+    logger.info("api: %s tournaments created", len(tournaments))
+    return tournaments
+
+
+def update_tournaments(items: list[dict]) -> list[Tournament]:
+    """Update tournaments, each an object with its "id" and the
+    TOURNAMENT_WRITABLE fields to change"""
+    items = _items(items, key="id")
+    found = Tournament.objects.in_bulk([item["id"] for item in items])
+    errors = {}
+    changed = set()
+    for i, item in enumerate(items):
+        t = found.get(item["id"])
+        unknown = set(item) - set(TOURNAMENT_FIELDS)
+        if t is None:
+            errors[i] = f"no tournament {item['id']}"
+        elif unknown:
+            errors[i] = f"unknown fields {sorted(unknown)}"
+        else:
+            for name in TOURNAMENT_WRITABLE:
+                if name in item:
+                    setattr(t, name, item[name])
+                    changed.add(name)
+    if errors:
+        raise ApiException("bad items", errors=errors)
+    tournaments = [found[item["id"]] for item in items]
+    _check(tournaments, exclude=["roster"])
+
+    if changed:
+        Tournament.objects.bulk_update(set(tournaments), list(changed))
+        database.touch_tournaments(t.pk for t in tournaments)
+    logger.info("api: %s tournaments updated", len(tournaments))
+    return tournaments
+
+
+def tournament_object(t: Tournament) -> dict:
+    """every field of a tournament"""
+    return {name: getattr(t, lookup) for name, lookup in
+            TOURNAMENT_FIELDS.items()}
+
+
+def set_roster(t: Tournament, items: list[dict]) -> int:
+    """Replace the players of a tournament. Each item is {"cfc_id"} with
+    an optional "name" and "rating": unknown players are created, known
+    ones updated.
+
+    Returns
+    -------
+    int : players on the roster
+    """
+    items = _items(items, key="cfc_id")
+    records, errors = {}, {}
+    for i, item in enumerate(items):
+        try:
+            cfc_id = int(item["cfc_id"])
+            rating = int(item["rating"]) if item.get("rating") else None
+        except (TypeError, ValueError) as err:
+            errors[i] = f"bad player: {err}"
+            continue
+        if not 100000 <= cfc_id <= 999999:
+            errors[i] = f"bad cfc id {cfc_id}"
+            continue
+        records[cfc_id] = (item.get("name") or None, rating)
+    if errors:
+        raise ApiException("bad items", errors=errors)
+
+    with transaction.atomic():
+        players = upsert_players(records)
+        if t.roster is None:
+            t.roster = Roster.objects.create()
+            t.save(update_fields=["roster"])
+        t.roster.players.set(players.values())
+    logger.info("api: roster of %s set to %s players", t.name, len(players))
+    return len(players)
+
+
+# match fields a write may set, sections are not written by the API
+_MATCH_WRITABLE = {"round", "white", "black", "result"}
+
+
+def _games(t: Tournament, items: list[dict],
+           existing: dict[int, Match] = None) -> list[dict]:
+    """Check and type games of a tournament. An item is {"round", "white",
+    "black", "result"}, white and black cfc ids, black null for a bye,
+    result a Match result code, "_" if not played. With existing, an item
+    is {"id"} and the fields it changes.
+
+    Returns
+    -------
+    list(dict) : each game's Match fields, white and black as Players
+
+    Raises
+    ------
+    ApiException with the errors by item index
+    """
+    games, errors = [], {}
+    for i, item in enumerate(items):
+        try:
+            if existing is not None:
+                match = existing.get(item["id"])
+                if match is None:
+                    raise ValueError(f"no match {item['id']} in {t.name}")
+                game = {"round": match.round_number,
+                        "white": match.white.cfc_id,
+                        "black": None if match.is_bye else match.black.cfc_id,
+                        "result": match.result, **item}
+            else:
+                game = {"result": results.NOT_PLAYED, **item}
+            writable = _MATCH_WRITABLE | ({"id"} if existing is not None
+                                          else set())
+            unknown = set(game) - writable
+            if unknown:
+                raise ValueError(f"unknown fields {sorted(unknown)}")
+            game["round"] = int(game["round"])
+            game["white"] = int(game["white"])
+            if game.get("black") is not None:
+                game["black"] = int(game["black"])
+            else:
+                game["black"] = None
+        except (KeyError, TypeError, ValueError) as err:
+            errors[i] = f"bad match: {err}"
+            continue
+
+        result = game["result"]
+        if result not in results.CODES and result != results.NOT_PLAYED:
+            errors[i] = f"unknown result {result!r}"
+        elif (game["black"] is None) != (result in results.BYES):
+            errors[i] = (f"result {result!r} with black "
+                         f"{game['black']}")
+        elif not 1 <= game["round"] <= t.num_rounds:
+            errors[i] = f"no round {game['round']} in {t.name}"
+        elif game["white"] == game["black"]:
+            errors[i] = f"{game['white']} paired against themselves"
+        games.append(game)
+    if errors:
+        raise ApiException("bad items", errors=errors)
+
+    # every player in one query
+    cfc_ids = {g["white"] for g in games} | {g["black"] for g in games
+                                            if g["black"] is not None}
+    players = {p.cfc_id: p for p in Player.objects.filter(cfc_id__in=cfc_ids)}
+    for i, game in enumerate(games):
+        missing = [c for c in (game["white"], game["black"])
+                   if c is not None and c not in players]
+        if missing:
+            errors[i] = f"unknown players {missing}"
+            continue
+        game["white"] = players[game["white"]]
+        game["black"] = players.get(game["black"])
+    if errors:
+        raise ApiException("bad items", errors=errors)
+    return games
+
+
+def _match_object(match: Match) -> dict:
+    """a saved match, in MATCH_FIELDS"""
+    return {"id": match.pk, "round": match.round_number,
+            "white": match.white.cfc_id,
+            "black": None if match.is_bye else match.black.cfc_id,
+            "result": match.result, "section": None}
+
+
+def _new_matches(t: Tournament, games: list[dict]) -> list[Match]:
+    """unsaved matches of t for checked games"""
+    return [Match(tournament=t, round_number=g["round"], white=g["white"],
+                  black=g["black"], result=g["result"]) for g in games]
+
+
+def create_matches(t: Tournament, items: list[dict]) -> list[dict]:
+    """Add matches to a tournament, see _games for an item
+
+    Returns
+    -------
+    list(dict) : the created matches, in MATCH_FIELDS
+    """
+    games = _games(t, _items(items))
+    with transaction.atomic():
+        database.ensure_rounds([t.pk], {g["round"] for g in games})
+        matches = Match.objects.bulk_create(_new_matches(t, games))
+        database.touch_tournaments([t.pk])
+    logger.info("api: %s matches added to %s", len(matches), t.name)
+    return [_match_object(m) for m in matches]
+
+
+def update_matches(t: Tournament, items: list[dict]) -> list[dict]:
+    """Change matches of a tournament, each item {"id"} and the fields it
+    changes, ie: {"id": 7, "result": "w"}
+
+    Returns
+    -------
+    list(dict) : the updated matches, in MATCH_FIELDS
+    """
+    items = _items(items, key="id")
+    with transaction.atomic():
+        existing = (match_rows(t).select_for_update()
+                    .select_related("white", "black")
+                    .in_bulk([item["id"] for item in items]))
+        games = _games(t, items, existing)
+        matches = []
+        for item, game in zip(items, games):
+            match = existing[item["id"]]
+            match.round_number = game["round"]
+            match.white = game["white"]
+            match.black = game["black"]
+            match.result = game["result"]
+            matches.append(match)
+        database.ensure_rounds([t.pk], {g["round"] for g in games})
+        Match.objects.bulk_update(
+            matches, ["round_number", "white", "black", "result"])
+        database.touch_tournaments([t.pk])
+    logger.info("api: %s matches of %s updated", len(matches), t.name)
+    return [_match_object(m) for m in matches]
+
+
+def replace_round(t: Tournament, number: int, items: list[dict]) -> list[dict]:
+    """Replace every match of a round, ie: a pairing program sending its
+    pairings or results. An item's "round" defaults to number.
+
+    Returns
+    -------
+    list(dict) : the round's matches, in MATCH_FIELDS
+    """
+    items = _items(items)
+    for item in items:
+        if item.setdefault("round", number) != number:
+            raise ApiException(f"a match of round {item['round']} "
+                               f"sent for round {number}")
+    if not 1 <= number <= t.num_rounds:
+        raise ApiException(f"no round {number} in {t.name}", status=404)
+    games = _games(t, items)
+
+    with transaction.atomic():
+        database.ensure_rounds([t.pk], {number})
+        match_rows(t, number).delete()
+        matches = Match.objects.bulk_create(_new_matches(t, games))
+        database.touch_tournaments([t.pk])
+    logger.info("api: round %s of %s replaced, %s matches", number, t.name,
+                len(matches))
+    return [_match_object(m) for m in matches]
@@ -0,0 +1,102 @@
+"""export the reports of many tournaments as one zip archive"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator
+
+from django.db import connection
+from django.db.models import QuerySet
+
+from cfc_report import logger
+from cfc_report.models import Tournament
+from cfc_report.services import sections, writers
+
+
+def select_tournaments(start: datetime.date = None, end: datetime.date = None,
+                       pks: Iterable[int] = None) -> QuerySet:
+    """The tournaments held from start to end, inclusive, and/or with the
+    given primary keys. No arguments selects every tournament.
+    """
+    tournaments = Tournament.objects.order_by("date", "pk")
+    if start:
+        tournaments = tournaments.filter(date__gte=start)
+    if end:
+        tournaments = tournaments.filter(date__lte=end)
+    if pks:
+        tournaments = tournaments.filter(pk__in=list(pks))
+    return tournaments
+
+
+def render_tournament(pk: int, formats: Iterable[str]) -> list[tuple[str, bytes]]:
+    """Render the reports of one tournament, in a worker thread
+
+    Returns
+    -------
+    list((file name, content)) one per format per section
+    """
+    try:
+        tournament = Tournament.objects.get(pk=pk)
+        return [
+            report
+            for section in sections.get_sections_data(tournament)
+            for report in writers.render_reports(
+                section["info"], section["players"], section["games"],
+                formats)
+        ]
+    finally:
+        # the worker thread's connection, it is not reused across requests
+        connection.close()
+
+
+def iter_reports(tournaments: QuerySet, formats: Iterable[str] = ("ctr",),
+                 workers: int = 4) -> Iterator[tuple[str, bytes]]:
+    """Render the reports of tournaments in a thread pool, yielding each as
+    it finishes. At most 2 * workers tournaments are in flight, so memory
+    stays bounded however many tournaments there are.
+
+    Yields
+    ------
+    (file name, content) per tournament per format
+    """
+    formats = list(formats)
+    pks = tournaments.values_list("pk", flat=True).iterator()
+    max_in_flight = 2 * workers
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for pk in pks:
+            in_flight.add(pool.submit(render_tournament, pk, formats))
+            if len(in_flight) < max_in_flight:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+        for future in in_flight:
+            yield from future.result()
+
+    logger.info("bulk export of %s finished", formats)
+
+
+def zip_tournaments(tournaments: QuerySet, formats: Iterable[str] = ("ctr",),
+                    workers: int = 4) -> Iterator[bytes]:
+    """Stream a zip archive of the reports of tournaments, each member added
+    as soon as its report is rendered
+    """
+    return writers.zip_stream(
+        (name, [content])
+        for name, content in iter_reports(tournaments, formats, workers)
+    )
@@ -15,33 +15,52 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # Copyright (C) 2024  Nicolas Vaagen
-from typing import List
+from typing import Iterable, Iterator, List
 
 # make a ctr tournament report file
 from cfc_report import logger
 from cfc_report.models import Match, Player, Tournament
+from cfc_report.services import results
+from cfc_report.services.database import (get_report_info,
+                                          iter_tournament_games)
+from cfc_report.services.validation import validate_games
+from cfc_report.services.writers import report_name
 
 
 class CtrCreationException(Exception):
-    """Something went wrong with ctr creation"""
-    pass
+    """Something went wrong with ctr creation
+
+    Attributes
+    ----------
+    errors : list(ReportError)
+        what is wrong with the tournament, if it failed validation
+    """
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
 
 class CTR:
     """CTR is a wrapper class for CTR (Tournament Report) File format"""
 
-    def __init__(self, tournament_info, session):
-        logger.info("class CTR init w -- tournament_info: %s, session: %s", tournament_info, session)
-        self.player_ids = session.get_player_ids()
+    def __init__(self, tournament: Tournament, player_ids: list["CfcId"]):
+        """the report of tournament, its roster player_ids
+
+        Raises
+        ------
+        CtrCreationException if data is missing or a game is wrong
+        """
+        tournament_info = get_report_info(tournament)
+        logger.info("class CTR init w -- tournament_info: %s, player_ids: %s", tournament_info, player_ids)
+        self.player_ids = [int(cfc_id) for cfc_id in player_ids]
         self.num_players = len(self.player_ids)
 
         name = tournament_info["name"]
-        num_rounds = int(tournament_info["num_rounds"])
         pairing_system = tournament_info["pairing_system"]
         td_cfc_id = tournament_info["td_cfc"]
         to_cfc_id = tournament_info["to_cfc"]
         province =  tournament_info["province"]
-        date = (tournament_info["date_year"] + "-" + tournament_info["date_month"]
-                + "-" + tournament_info["date_day"])
+        date = tournament_info["date"]
 
 
         # make sure the tournament has requisite data
@@ -57,13 +76,16 @@ class CTR:
             raise CtrCreationException("missing tournament data.")
 
         # get the pairing abbreviation
-        if pairing_system == "Swiss":
+        if pairing_system == "SW":
             pairing_abriviation = "S"
         else:
             # Round Robin is default,
             # I think this works ie: I think there are only 2 options
             pairing_abriviation = "R"
 
+        # file name written to by default
+        self.filename = report_name({"name": name, "date": date}) + ".ctr"
+
         """List with one index per CTR line"""
         self.ctr: List[str] = []
 
@@ -74,28 +96,46 @@ class CTR:
 
         logger.info("ctr init. ctr: %s", self.ctr)
 
-        # add all matches to report
-        for rnd in range(num_rounds):
-            # get matches in round
-            matches =  Match.objects.filter(round_number=rnd)
-
-            logger.info("building round: %s \nw: Matches: %s", rnd, matches)
-            for match in matches:
-                match_report = self.make_match_report(
-                    match, match.white
-                )
-                match_report += self.make_match_report(
-                    match, match.black
-                )
-                # append both players match reports to main report
-                for line in match_report:
-                    self.ctr.append(line)
-
-    def write_file(self) -> None:
+        # one pass over the games, tuples read in chunks from one query:
+        # each is checked and its lines added as it goes by, so the games
+        # are never held, only the report lines. Those are about 3 per
+        # player per game; writers.CTRWriter streams a report instead
+        games = self._add_lines(iter_tournament_games(tournament))
+
+        # never build a report the CFC would reject
+        self.errors = validate_games(self.player_ids, games)
+        if self.errors:
+            del self.ctr[1:]
+            raise CtrCreationException(
+                f"{len(self.errors)} errors in {name}", self.errors)
+
+    def _add_lines(self, games: Iterable[tuple]) -> Iterator[tuple]:
+        """games, the lines of each added to the report as it goes by.
+        They are in round order, a bye is reported for its one player.
+        A game without a CTR result adds nothing, validate_games reports it
+        """
+        for game in games:
+            _, white, black, result = game
+            try:
+                lines = [line for cfc_id, colour in
+                         results.sides(white, black)
+                         for line in self.game_lines(cfc_id, result, colour)]
+            except CtrCreationException:
+                lines = []
+            self.ctr += lines
+            yield game
+
+    def write_file(self, path: str = None) -> str:
         """write the ctr report to file.
-        side effect: creates file 'ctr_report.crt' in current directory.
+        side effect: creates file path, by default named after the
+                     tournament in the current directory.
                      If file already exists, it will be overwritten.
+
+        Returns
+        -------
+        str : the path written
         """
+        path = path or self.filename
 
         # make sure ctr data has been created
         try:
@@ -108,32 +148,33 @@ class CTR:
             )
 
         # write the ctr report to file
-        ctr_report = open("ctr_report.crt", "w")
-        for line in self.ctr:
-            ctr_report.write(line)
-        ctr_report.close()
+        with open(path, "w") as ctr_report:
+            for line in self.ctr:
+                ctr_report.write(line + "\n")
+        return path
 
     def make_match_report(self, m: Match, player: Player) -> List[str]:
         """make a match part of ctr report file for a given player
         returns: a list of strings to be written to ctr_report one per line"""
 
         logger.info("make_match_report entered with match: %s, and player: %s", m, player)
-        match_result = m.result
-        if match_result == player.cfc_id:
-            res = "W"
-            points = "1.0"
-        elif match_result is None:
-            res = "D"
-            points = "0.5"
-        else:
-            res = "L"
-            points = "0.0"
+        colour = results.WHITE if player == m.white else results.BLACK
+        return CTR.game_lines(player.cfc_id, m.result, colour)
+
+    @staticmethod
+    def game_lines(cfc_id: "CfcId", result: str, colour: str) -> List[str]:
+        """the ctr lines of one player of a game"""
+        try:
+            res, points = results.ctr_result(result, colour)
+        except results.ResultCodeException as err:
+            raise CtrCreationException(
+                f"game of {cfc_id}: {err}") from err
 
         # match report
         match_report: List[str] = []
 
         # line 1
-        match_report.append(f'"{player.cfc_id}"')
+        match_report.append(f'"{cfc_id}"')
 
         # line 2
         match_report.append(f'"{res}","0"')
@@ -144,20 +185,15 @@ class CTR:
         return match_report
 
     def __str__(self) -> str:
-        ctr = ""
-        for line in self.ctr:
-            ctr += line + "\n"
-        return ctr
+        return "".join(line + "\n" for line in self.ctr)
 
 if __name__ == "__main__":
     # test
     T = {"name": "my test tornament",
          "num_rounds": 4,
-         "pairing_system": "Swiss",
+         "pairing_system": "SW",
          "td_cfc": "111111",
          "to_cfc": "222222",
-         "date_year": "1",
-         "date_month": "1",
-         "date_day": "1",}
+         "date": "2024-01-01",}
     ctr = CTR(T)
     ctr.write_to_file()
@@ -20,23 +20,84 @@ from cfc_report import logger
 from cfc_report.models import (
     Match,
     Player,
+    Roster,
+    Round,
     TournamentDirector,
     TournamentOrganizer,
     Tournament,
 )
-from django.db.models import QuerySet
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import F, Q, QuerySet
 from django.shortcuts import get_object_or_404
 
 
+# CONNECTION
+def set_sqlite_pragmas(sender, connection, **kwargs) -> None:
+    """Apply settings.SQLITE_PRAGMAS to a new SQLite connection.
+    connection_created signal receiver, connected in CfcReportConfig.ready
+
+    Parameters
+    ----------
+    sender : the database wrapper class
+    connection : the new DatabaseWrapper
+    """
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", None)
+    if connection.vendor != "sqlite" or not pragmas:
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+    logger.debug("sqlite pragmas set on new connection: %s", pragmas)
+
+
+# rows fetched per round trip by the iter_ functions, which stream a query
+# without caching its rows, so memory stays flat however many there are
+CHUNK_SIZE = 2000
+# players on a page of a player list
+PLAYERS_PER_PAGE = 100
+
+
 # GET
 def get_players() -> QuerySet:
-    """Get players in database
+    """Get players in database, lazily: slice, page or count it rather
+    than evaluate it, see iter_players and get_players_page
     returns:
         QuerySet of players in db
     """
-    all_players = Player.objects.all()
-    logger.debug("get_players got these players from db: %s", all_players)
-    return all_players
+    # a QuerySet's repr runs it, only the query is logged
+    logger.debug("get_players called")
+    return Player.objects.all()
+
+
+def iter_players(chunk_size: int = CHUNK_SIZE):
+    """Iterate over every player in the database, in cfc id order, without
+    caching model instances
+
+    Yields
+    ------
+    (cfc id, name, rating)
+    """
+    return (Player.objects.order_by("cfc_id", "pk")
+            .values_list("cfc_id", "name", "rating")
+            .iterator(chunk_size=chunk_size))
+
+
+def get_players_page(number, per_page: int = PLAYERS_PER_PAGE) -> "Page":
+    """One page of the players in the database, by name. A bad page number
+    gives the first or last page.
+
+    Parameters
+    ----------
+    number : the page number, ie: from ?page=, may be None or not a number
+
+    Returns
+    -------
+    django.core.paginator.Page of Players
+    """
+    paginator = Paginator(Player.objects.order_by("name", "pk"), per_page)
+    return paginator.get_page(number)
 
 
 def get_player_by_cfc(cfc_id: "Cfc_id") -> Player:
@@ -62,9 +123,8 @@ def get_TDs() -> QuerySet:
     returns:
         QuerySet of TD's
     """
-    tds = TournamentDirector.objects.all()
-    logger.debug("get_TDs got %s", tds)
-    return tds
+    logger.debug("get_TDs called")
+    return TournamentDirector.objects.all()
 
 
 def get_TOs() -> QuerySet:
@@ -72,9 +132,8 @@ def get_TOs() -> QuerySet:
     returns:
         QuerySet of TD's
     """
-    tos = TournamentOrganizer.objects.all()
-    logger.debug("get_TOs got: %s", tos)
-    return tos
+    logger.debug("get_TOs called")
+    return TournamentOrganizer.objects.all()
 
 
 def get_matches() -> QuerySet:
@@ -84,10 +143,143 @@ def get_matches() -> QuerySet:
     -------
     The matches in the Database
     """
-    matches = Match.objects.all()
-    logger.debug("get_matches got: %s", matches)
+    logger.debug("get_matches called")
+    return Match.objects.all()
+
+
+def iter_matches(chunk_size: int = CHUNK_SIZE):
+    """Iterate over every match in the database, in round order, without
+    caching model instances, see iter_tournament_games for one tournament
+
+    Yields
+    ------
+    (tournament pk, round number, white cfc id, black cfc id, result)
+    """
+    return (Match.objects.order_by("tournament", "round_number", "pk")
+            .values_list("tournament", "round_number", "white__cfc_id",
+                         "black__cfc_id", "result")
+            .iterator(chunk_size=chunk_size))
 
-    return matches
+
+def get_report_info(t: Tournament) -> dict:
+    """The fields of a tournament the report writers need
+
+    Returns
+    -------
+    dict
+        name, province, pairing_system, date, num_rounds, td_cfc, to_cfc
+    """
+    return {
+        "name": t.name,
+        "province": t.province,
+        "pairing_system": t.pairing_system,
+        "date": t.date,
+        "num_rounds": t.num_rounds,
+        "td_cfc": t.td_cfc,
+        "to_cfc": t.to_cfc,
+    }
+
+
+def save_tournament_info(info: dict) -> Tournament:
+    """Save the tournament info of a validated TournamentInfoForm, updating
+    the tournament of the same name and date if there is one
+
+    Parameters
+    ----------
+    info : dict
+        TournamentInfoForm.cleaned_data
+
+    Returns
+    -------
+    Tournament
+    """
+    fields = {f: info[f] for f in ("num_rounds", "pairing_system", "province",
+                                   "to_cfc", "td_cfc")}
+    t, created = Tournament.objects.update_or_create(
+        name=info["name"], date=info["date"], defaults=fields)
+    logger.info("tournament %s %s", t.name, "created" if created else "updated")
+    return t
+
+
+def get_roster(t: Tournament) -> dict:
+    """The players of a tournament, in one query
+
+    Returns
+    -------
+    dict{cfc id: (name, rating)}
+    """
+    if t.roster_id is None:
+        return {}
+    players = Player.objects.filter(rosters=t.roster_id).values_list(
+        "cfc_id", "name", "rating")
+    return {cfc_id: (name, rating) for cfc_id, name, rating in players}
+
+
+def iter_tournament_games(t: Tournament, chunk_size: int = CHUNK_SIZE):
+    """Iterate over the games of a tournament, in round order, with one
+    query and without caching model instances
+
+    Yields
+    ------
+    (round number, white cfc id, black cfc id, result)
+    """
+    return (
+        Match.objects.filter(tournament=t)
+        .order_by("round_number", "pk")
+        .values_list("round_number", "white__cfc_id", "black__cfc_id",
+                     "result")
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def ensure_rounds(pks, numbers: set[int]) -> None:
+    """create the Round rows missing for numbers in tournaments pks, one
+    query and one bulk insert however many tournaments
+
+    Parameters
+    ----------
+    pks : iterable of Tournament primary keys
+    numbers : the round numbers
+    """
+    pks = {pk for pk in pks if pk is not None}
+    known = set(Round.objects.filter(tournament__in=pks, round_num__in=numbers)
+                .values_list("tournament", "round_num"))
+    Round.objects.bulk_create(
+        Round(tournament_id=pk, round_num=n)
+        for pk in sorted(pks) for n in sorted(numbers)
+        if (pk, n) not in known)
+
+
+def touch_tournaments(pks) -> None:
+    """Count a change to tournaments, their roster or matches, so what was
+    cached for their old version is built again. Bulk writes send no
+    signals, they call this themselves.
+
+    Parameters
+    ----------
+    pks : iterable of Tournament primary keys
+    """
+    pks = {pk for pk in pks if pk is not None}
+    if pks:
+        Tournament.objects.filter(pk__in=pks).update(version=F("version") + 1)
+
+
+def touch_player_tournaments(player_pks) -> None:
+    """touch_tournaments for every tournament players are on the roster of,
+    or played in, ie: after they are renamed or merged
+
+    Parameters
+    ----------
+    player_pks : iterable of Player primary keys
+    """
+    player_pks = list(player_pks)
+    if player_pks:
+        touch_tournaments(Tournament.objects.filter(
+            Q(roster__players__in=player_pks)
+            | Q(sections__roster__players__in=player_pks)
+            | Q(matches__white__in=player_pks)
+            | Q(matches__black__in=player_pks)
+        ).values_list("pk", flat=True))
 
 
 #def get_tournament(name: str) -> Tournament:
@@ -124,17 +316,17 @@ def add_player_by_cfc(cfc_id: "CfcId", name: str) -> None:
     add_player(p)
 
 
-def add_match(white_id: "CfcId", black_id: "CfcId", result: "w,b,or d") -> Match:
+def add_match(white_id: "CfcId", black_id: "CfcId", result: str) -> Match:
     """white : Player
         the White player in the match
     black : Player
-        the black player in the match
+        the black player in the match, None for a bye
     result : CharField
-        KEY: {b == black victory, w == white victory, d == no victory)
+        a Match.result code
     """
 
     white_player = get_player_by_cfc(white_id)
-    black_player = get_player_by_cfc(black_id)
+    black_player = get_player_by_cfc(black_id) if black_id else None
 
     chess_match = Match(white=white_player, black=black_player, result=result)
 
@@ -143,6 +335,113 @@ def add_match(white_id: "CfcId", black_id: "CfcId", result: "w,b,or d") -> Match
     return chess_match
 
 
+def delete_tournament_match(tournament_pk: int, pk: int) -> int:
+    """Delete match pk if it is a game of tournament tournament_pk, ie: one
+    the TD removed, and touch the tournament
+
+    Returns
+    -------
+    int : matches deleted, 0 or 1
+    """
+    deleted, _ = Match.objects.filter(tournament=tournament_pk,
+                                      pk=pk).delete()
+    if deleted:
+        touch_tournaments([tournament_pk])
+    logger.debug("match %s of tournament %s deleted: %s", pk, tournament_pk,
+                 deleted)
+    return deleted
+
+
+# ASYNC
+async def aget_player_by_cfc(cfc_id: "Cfc_id") -> Player:
+    """async get_player_by_cfc
+
+    Raises
+    ------
+    DoesNotExist exception if player not found
+    """
+    p = await Player.objects.aget(cfc_id=cfc_id)
+
+    logger.debug("Player %s got from cfc_id %s", p, cfc_id)
+    return p
+
+
+async def aget_players_by_cfc(cfc_ids: list["Cfc_id"]) -> list[Player]:
+    """Get the players with the given cfc ids in one query
+
+    Returns
+    -------
+    list(Player)
+        the found players, in the order of cfc_ids
+    """
+    if not cfc_ids:
+        return []
+
+    found = await Player.objects.filter(cfc_id__in=cfc_ids).ain_bulk()
+    by_cfc = {p.cfc_id: p for p in found.values()}
+
+    return [by_cfc[int(cfc_id)] for cfc_id in cfc_ids
+            if int(cfc_id) in by_cfc]
+
+
+async def adelete_tournament_match(tournament_pk: int, pk: int) -> int:
+    """async delete_tournament_match"""
+    deleted, _ = await Match.objects.filter(tournament=tournament_pk,
+                                            pk=pk).adelete()
+    if deleted:
+        await Tournament.objects.filter(pk=tournament_pk).aupdate(
+            version=F("version") + 1)
+    logger.debug("match %s of tournament %s deleted: %s", pk, tournament_pk,
+                 deleted)
+    return deleted
+
+
+def tournament_players(pk: int) -> QuerySet:
+    """The players of tournament pk: its roster, and everyone with a game
+    in it, which is all of them while its roster is only in a session.
+    Subqueries, not joins, so a player is a row once.
+    """
+    return Player.objects.filter(
+        Q(pk__in=Roster.players.through.objects.filter(
+            roster__tournament_roster=pk).values("player"))
+        | Q(pk__in=Match.objects.filter(tournament=pk).values("white"))
+        | Q(pk__in=Match.objects.filter(tournament=pk).values("black"))
+    ).order_by("name", "pk")
+
+
+async def aget_tournament_players(pk: int) -> list[Player]:
+    """async tournament_players, in one query"""
+    return [p async for p in tournament_players(pk)]
+
+
+async def aget_tournament_results(pk: int) -> list[tuple]:
+    """Get the results of the matches of tournament pk, and its byes
+
+    Returns
+    -------
+    list(tuple)
+        (white cfc id, black cfc id, result) for every match, one query
+    """
+    results = Match.objects.filter(tournament=pk).values_list(
+        "white__cfc_id", "black__cfc_id", "result")
+
+    return [r async for r in results]
+
+
+async def aget_tournament_matches(pk: int) -> list[Match]:
+    """Get the matches of tournament pk, with both players, in one query
+
+    Returns
+    -------
+    list(Match)
+        ordered by round
+    """
+    matches = Match.objects.filter(tournament=pk).select_related(
+        "white", "black").order_by("round_number", "pk")
+
+    return [m async for m in matches]
+
+
 def populate_database() -> None:
     """Populate the db with dumby data"""
 
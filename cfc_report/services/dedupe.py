@@ -0,0 +1,263 @@
+"""find and merge duplicate players"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, Value, When
+
+from cfc_report import logger
+from cfc_report.models import Match, Player, Roster
+from cfc_report.services import database
+from cfc_report.services.search import normalize
+
+# Players are only compared inside blocks, groups sharing a key built
+# from their cfc id or name, so the work grows with the block sizes and
+# not with the square of the number of players.
+#
+# Only players with the same cfc id are merged: a cfc id names one CFC
+# member, so two ids are two members however alike their names. Players
+# with different ids and alike names are listed for a person to review.
+
+# least name similarity, 0 to 1, of players with different cfc ids
+# listed for review
+THRESHOLD = 0.85
+# ... of players with the same cfc id taken for the same person, the
+# others are listed for review
+SAME_ID_THRESHOLD = 0.5
+# blocks bigger than this are too common a key to tell anyone apart
+MAX_BLOCK = 50
+# rows per bulk update
+BATCH_SIZE = 500
+
+_VOWELS = re.compile(r"[aeiouy]")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+def skeleton(word: str) -> str:
+    """a word without its vowels after the first letter, nor doubled
+    letters, so "smith", "smyth" and "smitth" agree"""
+    if not word:
+        return ""
+    return word[0] + _REPEATS.sub(r"\1", _VOWELS.sub("", word[1:]))
+
+
+def blocking_keys(cfc_id: "CfcId", name: str) -> list[str]:
+    """the blocks of a player, name normalized
+
+    Keys
+    ----
+    id : the same cfc id
+    name : the same words in any order
+    sound : first initial and the skeleton of the last name
+    """
+    words = name.split()
+    keys = [f"id:{cfc_id}", f"name:{' '.join(sorted(words))}"]
+    if words:
+        keys.append(f"sound:{words[0][0]}:{skeleton(words[-1])[:4]}")
+    return keys
+
+
+def similarity(a: str, b: str) -> float:
+    """0 to 1 likeness of two normalized names, word order ignored"""
+    return SequenceMatcher(None, " ".join(sorted(a.split())),
+                           " ".join(sorted(b.split()))).ratio()
+
+
+def find_duplicates(threshold: float = THRESHOLD) -> dict:
+    """Find the players that are the same person, and those that may be
+
+    Parameters
+    ----------
+    threshold : float
+        least name similarity of two players with different cfc ids
+        listed as candidates
+
+    Returns
+    -------
+    dict
+        "duplicates": list(list(dict)), one list per cfc id held by more
+            than one player with alike names, safe to merge_players
+        "candidates": list(list(dict)), pairs of players with alike names
+            and different cfc ids, or the same cfc id and unlike names,
+            for a person to review, never merged
+        a player is {"pk", "cfc_id", "name", "rating"}, ordered by pk
+    """
+    players = {}
+    blocks = defaultdict(list)
+    rows = Player.objects.values_list("pk", "cfc_id", "name", "rating")
+    for pk, cfc_id, name, rating in rows.iterator(chunk_size=5000):
+        norm = normalize(name)
+        players[pk] = {"pk": pk, "cfc_id": cfc_id, "name": name,
+                       "rating": rating, "norm": norm}
+        for key in blocking_keys(cfc_id, norm):
+            blocks[key].append(pk)
+
+    # union-find over the pairs that are the same person, which share a
+    # cfc id, so a group never joins two ids
+    parent = {}
+
+    def root(pk):
+        while parent.get(pk, pk) != pk:
+            # halve the path as it is walked
+            parent[pk] = parent.get(parent[pk], parent[pk])
+            pk = parent[pk]
+        return pk
+
+    compared = set()
+    candidates = []
+    skipped = 0
+    for key, members in blocks.items():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BLOCK:
+            skipped += 1
+            continue
+        for a, b in combinations(members, 2):
+            if (a, b) in compared:
+                continue
+            compared.add((a, b))
+            pa, pb = players[a], players[b]
+            alike = similarity(pa["norm"], pb["norm"])
+            if pa["cfc_id"] != pb["cfc_id"]:
+                if alike >= threshold:
+                    candidates.append((a, b))
+            elif alike >= SAME_ID_THRESHOLD:
+                parent[root(b)] = root(a)
+            else:
+                candidates.append((a, b))
+
+    clusters = defaultdict(set)
+    for pk in parent:
+        top = root(pk)
+        clusters[top].update((pk, top))
+
+    def public(pks):
+        return [{k: v for k, v in players[pk].items() if k != "norm"}
+                for pk in sorted(pks)]
+
+    found = {"duplicates": [public(members) for members in clusters.values()],
+             "candidates": [public(pair) for pair in candidates]}
+    logger.info("%s players, %s comparisons, %s blocks too big, "
+                "%s duplicate groups, %s candidates to review", len(players),
+                len(compared), skipped, len(found["duplicates"]),
+                len(found["candidates"]))
+    return found
+
+
+def merge_players(duplicates: list[list[dict]]) -> dict:
+    """Merge each group of duplicates into the player with the most games,
+    the oldest on a tie. Matches and roster entries are repointed with bulk
+    updates, then the others are deleted, all in one transaction.
+
+    A group is left alone if its players have more than one cfc id, or if
+    they played each other, which merged would be a player paired against
+    themselves.
+
+    Parameters
+    ----------
+    duplicates : "duplicates" of find_duplicates, or groups of {"pk"}
+
+    Returns
+    -------
+    dict
+        "merged": players deleted, "matches": match sides repointed,
+        "roster_entries": roster entries repointed or dropped,
+        "skipped": list(list(int)) pks of the groups left alone
+    """
+    groups = [sorted({p["pk"] for p in group}) for group in duplicates]
+    groups = [group for group in groups if len(group) > 1]
+    pks = [pk for group in groups for pk in group]
+    cfc_ids = dict(Player.objects.filter(pk__in=pks)
+                   .values_list("pk", "cfc_id"))
+    group_of = {pk: n for n, group in enumerate(groups) for pk in group}
+
+    bad = {n for n, group in enumerate(groups)
+           if len({cfc_ids.get(pk) for pk in group}) != 1}
+    # games inside a group, in one query
+    for white, black in Match.objects.filter(
+            white__in=pks, black__in=pks).values_list("white", "black"):
+        if group_of[white] == group_of[black]:
+            bad.add(group_of[white])
+    skipped = [groups[n] for n in sorted(bad)]
+    if skipped:
+        logger.warning("duplicate groups not merged, more than one cfc id "
+                       "or games against each other: %s", skipped)
+    groups = [group for n, group in enumerate(groups) if n not in bad]
+    pks = [pk for group in groups for pk in group]
+
+    games = Counter()
+    for field in ("white", "black"):
+        games.update(dict(
+            Match.objects.filter(**{f"{field}__in": pks})
+            .values_list(field).annotate(n=Count("pk"))))
+
+    # the player each duplicate becomes
+    keep_of = {}
+    for group in groups:
+        keep = min(group, key=lambda pk: (-games[pk], pk))
+        keep_of.update((pk, keep) for pk in group if pk != keep)
+
+    stats = {"merged": len(keep_of), "matches": 0, "roster_entries": 0,
+             "skipped": skipped}
+    if not keep_of:
+        return stats
+
+    entries = Roster.players.through.objects
+    with transaction.atomic():
+        pairs = list(keep_of.items())
+        for start in range(0, len(pairs), BATCH_SIZE):
+            batch = dict(pairs[start:start + BATCH_SIZE])
+            for field in ("white", "black"):
+                column = f"{field}_id"
+                stats["matches"] += Match.objects.filter(
+                    **{f"{column}__in": list(batch)}
+                ).update(**{column: _repoint(column, batch)})
+
+            # a roster can hold a player once, drop what would repeat
+            known = set(entries.filter(
+                player_id__in=set(batch.values())
+            ).values_list("roster_id", "player_id"))
+            drop, move = [], {}
+            for pk, roster_id, player_id in entries.filter(
+                    player_id__in=list(batch)).values_list(
+                    "pk", "roster_id", "player_id"):
+                target = (roster_id, batch[player_id])
+                if target in known:
+                    drop.append(pk)
+                else:
+                    known.add(target)
+                    move[pk] = batch[player_id]
+            entries.filter(pk__in=drop).delete()
+            if move:
+                entries.filter(pk__in=list(move)).update(
+                    player_id=_repoint("pk", move))
+            stats["roster_entries"] += len(drop) + len(move)
+
+        Player.objects.filter(pk__in=list(keep_of)).delete()
+        database.touch_player_tournaments(set(keep_of.values()))
+
+    logger.info("players merged: %s", stats)
+    return stats
+
+
+def _repoint(column: str, mapping: dict) -> Case:
+    """CASE expression giving each row its new player id"""
+    return Case(*(When(**{column: old}, then=Value(new))
+                  for old, new in mapping.items()),
+                output_field=BigIntegerField())
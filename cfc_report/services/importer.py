@@ -0,0 +1,257 @@
+"""import CTR and FIDE TRF tournament reports"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import csv
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from cfc_report import logger
+from cfc_report.models import Match, Player, Roster, Round, Tournament
+from cfc_report.services import database, search
+from cfc_report.services.parsers import ReportImportException, parse_file
+
+# rows per bulk query
+BATCH_SIZE = 500
+# report files picked up from a directory or an upload
+SUFFIXES = {".ctr", ".crt", ".trf", ".txt"}
+# what a bad report file can raise, reading or saving it: it is reported
+# and the other files are imported
+IMPORT_ERRORS = (ReportImportException, OSError, ValueError, KeyError,
+                 IndexError, TypeError, csv.Error, ValidationError,
+                 DatabaseError)
+
+
+def import_files(paths: Iterable[str], workers: int = None) -> Iterator[tuple]:
+    """Import report files, parsed in parallel by a process pool and saved
+    by this process as each parse finishes.
+
+    Parameters
+    ----------
+    paths : the CTR and TRF files
+    workers : parser processes, default one per cpu
+
+    Yields
+    ------
+    (path, Tournament, None) for an imported file,
+    (path, None, error message) for a file that could not be imported
+    """
+    # spawned, not forked: this runs in a job worker thread, and a fork
+    # would copy the locks and database connections other threads hold
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")
+                             ) as pool:
+        futures = {pool.submit(parse_file, path): path for path in paths}
+        try:
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    yield path, save_report(future.result()), None
+                except IMPORT_ERRORS as err:
+                    logger.warning("could not import %s: %s", path, err)
+                    yield path, None, str(err)
+        finally:
+            # stopped early, ie: a cancelled job, the rest are not parsed
+            for future in futures:
+                future.cancel()
+
+
+def save_report(parsed: dict) -> Tournament:
+    """Save a parsed report with batched upserts, in one transaction.
+    A report imported again replaces the tournament's rounds and games.
+
+    Parameters
+    ----------
+    parsed : dict
+        from parse_file
+
+    Returns
+    -------
+    Tournament : the imported tournament
+
+    Raises
+    ------
+    ReportImportException if a player is not a CFC member: a bad cfc id,
+    or a TRF player not found, see match_trf_players
+    """
+    info = parsed["tournament"]
+    with transaction.atomic():
+        if parsed.get("format") == "trf":
+            players = match_trf_players(parsed["players"])
+        else:
+            players = upsert_players(parsed["players"])
+
+        tournament, created = Tournament.objects.update_or_create(
+            name=info["name"], date=info["date"],
+            defaults={k: v for k, v in info.items()
+                      if k not in ("name", "date")},
+        )
+        if not created:
+            tournament.matches.all().delete()
+            tournament.rounds.all().delete()
+        if tournament.roster is None:
+            tournament.roster = Roster.objects.create()
+            tournament.save(update_fields=["roster"])
+        tournament.roster.players.set(players.values())
+
+        Round.objects.bulk_create(
+            Round(tournament=tournament, round_num=n)
+            for n in range(1, info["num_rounds"] + 1)
+        )
+        Match.objects.bulk_create(
+            (Match(tournament=tournament, round_number=round_number,
+                   white=players[white], black=players.get(black),
+                   result=result)
+             for round_number, white, black, result in parsed["games"]),
+            batch_size=BATCH_SIZE,
+        )
+        database.touch_tournaments([tournament.pk])
+
+    # bulk saves send no post_save, the search index is told here
+    search.index_players(players.values())
+    logger.info("imported %s: %s players, %s games", parsed["path"],
+                len(players), len(parsed["games"]))
+    return tournament
+
+
+def upsert_players(records: dict) -> dict[int, Player]:
+    """create the players not in the database, update the known ones whose
+    name or rating the report has
+
+    Parameters
+    ----------
+    records : dict{cfc id: (name or None, rating or None)}
+
+    Returns
+    -------
+    dict{cfc id: Player} of every player in records
+
+    Raises
+    ------
+    ReportImportException if a cfc id is out of range, bulk_create does not
+    run the field validators
+    """
+    field = Player._meta.get_field("cfc_id")
+    bad = []
+    for cfc_id in records:
+        try:
+            field.run_validators(cfc_id)
+        except ValidationError:
+            bad.append(cfc_id)
+    if bad:
+        raise ReportImportException(f"not cfc ids: {_some(bad)}")
+
+    cfc_ids = list(records)
+    players: dict[int, Player] = {}
+    for start in range(0, len(cfc_ids), BATCH_SIZE):
+        chunk = cfc_ids[start:start + BATCH_SIZE]
+        players.update(
+            (p.cfc_id, p) for p in Player.objects.filter(cfc_id__in=chunk))
+
+    new, changed = [], []
+    for cfc_id, (name, rating) in records.items():
+        # Player.name holds 20 characters
+        name = name[:20] if name else None
+        player = players.get(cfc_id)
+        if player is None:
+            name = name or str(cfc_id)
+            player = Player(name=name, cfc_id=cfc_id, rating=rating or 0,
+                            slug=Player.make_slug(name, cfc_id))
+            players[cfc_id] = player
+            new.append(player)
+        elif (name and name != player.name) or (rating and
+                                                  rating != player.rating):
+            player.name = name or player.name
+            player.rating = rating or player.rating
+            player.slug = Player.make_slug(player.name, cfc_id)
+            changed.append(player)
+
+    Player.objects.bulk_create(new, batch_size=BATCH_SIZE)
+    Player.objects.bulk_update(changed, ["name", "rating", "slug"],
+                               batch_size=BATCH_SIZE)
+    # other tournaments show the new names and ratings
+    database.touch_player_tournaments(p.pk for p in changed)
+    return players
+
+
+def match_trf_players(records: dict) -> dict[int, Player]:
+    """Find the players of a TRF report, which has FIDE ids, not cfc ids:
+    by FIDE id, else by name, and rating if the name is not enough. A player
+    found by name gets their FIDE id, so the next report finds them by it.
+    Players are never created, a player without a cfc id cannot be in a CFC
+    report.
+
+    Parameters
+    ----------
+    records : dict{start rank: (name, rating, FIDE id or None)}
+
+    Returns
+    -------
+    dict{start rank: Player} of every player in records
+
+    Raises
+    ------
+    ReportImportException naming the players not found, or found twice
+    """
+    fide_ids = [fide_id for _, _, fide_id in records.values() if fide_id]
+    # Player.name holds 20 characters
+    names = list({name[:20] for name, _, _ in records.values()})
+    by_fide: dict[int, Player] = {}
+    by_name: dict[str, list[Player]] = defaultdict(list)
+    for start in range(0, max(len(fide_ids), len(names)), BATCH_SIZE):
+        by_fide.update((p.fide_id, p) for p in Player.objects.filter(
+            fide_id__in=fide_ids[start:start + BATCH_SIZE]))
+        for p in Player.objects.filter(
+                name__in=names[start:start + BATCH_SIZE]):
+            by_name[p.name].append(p)
+
+    players: dict[int, Player] = {}
+    changed, missing = [], []
+    taken = set()
+    for rank, (name, rating, fide_id) in records.items():
+        player = by_fide.get(fide_id)
+        if player is None:
+            found = [p for p in by_name[name[:20]] if p.fide_id is None]
+            if len(found) > 1:
+                found = [p for p in found if p.rating == rating]
+            if len(found) != 1:
+                missing.append(f"{name} ({fide_id or 'no FIDE id'})")
+                continue
+            player = found[0]
+            if fide_id and player.fide_id is None:
+                player.fide_id = fide_id
+                changed.append(player)
+        if player.pk in taken:
+            missing.append(f"{name} ({fide_id or 'no FIDE id'})")
+            continue
+        taken.add(player.pk)
+        players[rank] = player
+    if missing:
+        raise ReportImportException(
+            f"TRF players not found, or found twice: {_some(missing)}")
+
+    Player.objects.bulk_update(changed, ["fide_id"], batch_size=BATCH_SIZE)
+    return players
+
+
+def _some(items: list, shown: int = 10) -> str:
+    """the first items of a list for a message, and how many more"""
+    text = ", ".join(map(str, items[:shown]))
+    return f"{text} and {len(items) - shown} more" \
+        if len(items) > shown else text
@@ -0,0 +1,408 @@
+"""run long tasks off the request path, queued in the Job table"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F
+from django.utils import timezone
+
+from cfc_report import logger
+from cfc_report.models import Job, Tournament
+from cfc_report.services import bulk_export, database, sections, writers
+from cfc_report.services.ctr import CTR, CtrCreationException
+from cfc_report.services.importer import SUFFIXES, import_files
+
+# No broker: a request saves a Job row and returns, the run_jobs command
+# claims queued rows with a conditional UPDATE, so two workers never run the
+# same job, and runs them in a thread pool. A task reports progress through
+# the row, which the job page polls, and is stopped there when cancelled.
+
+# seconds before a failed job is tried again, doubled for each attempt
+RETRY_DELAY = 30
+# seconds an idle worker waits before looking at the queue again
+POLL_INTERVAL = 1.0
+# least seconds between progress writes of a task
+PROGRESS_INTERVAL = 0.5
+
+
+class JobCancelledException(Exception):
+    """The job was cancelled while it ran"""
+    pass
+
+
+class JobFailedException(Exception):
+    """A job that cannot succeed, trying it again would not help
+
+    Attributes
+    ----------
+    errors : list(str)
+        what the TD has to fix, ie: report validation errors
+    """
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = [str(e) for e in errors]
+
+
+class Progress:
+    """Given to a task to report its progress, which raises
+    JobCancelledException once its job is cancelled.
+
+    Writes are throttled to one per PROGRESS_INTERVAL, the last step is
+    always written.
+    """
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.total = None
+        self.written = 0.0
+
+    def __call__(self, done: int, total: int = None, message: str = None):
+        """record done steps out of total, and what the task is doing"""
+        if total is not None:
+            self.total = total
+        last = self.total is not None and done >= self.total
+        now = time.monotonic()
+        if (total is None and not last
+                and now - self.written < PROGRESS_INTERVAL):
+            return
+        self.written = now
+        fields = {"progress": done}
+        if total is not None:
+            fields["total"] = total
+        if message is not None:
+            fields["message"] = message[:200]
+        jobs = Job.objects.filter(pk=self.job.pk)
+        jobs.update(**fields)
+        if jobs.filter(cancel_requested=True).exists():
+            raise JobCancelledException(f"job {self.job.pk} cancelled")
+
+
+# kind -> task(job, progress) -> result dict, a result "output" is the path
+# of the file the task wrote
+HANDLERS: dict[str, Callable[[Job, Progress], dict]] = {}
+
+
+def handler(kind: str):
+    """register a function as the task of a kind of job"""
+    def register(task):
+        HANDLERS[kind] = task
+        return task
+    return register
+
+
+def enqueue(kind: str, params: dict = None, max_attempts: int = 3) -> Job:
+    """Queue a job for the worker
+
+    Parameters
+    ----------
+    kind : str
+        one of HANDLERS
+    params : dict
+        arguments of the task, must be JSON
+    max_attempts : int
+        runs a failing job gets
+
+    Returns
+    -------
+    Job : the queued job
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"no job kind {kind!r}")
+    job = Job.objects.create(kind=kind, params=params or {},
+                             max_attempts=max_attempts)
+    logger.info("queued %s", job)
+    return job
+
+
+def cancel(pk: int) -> None:
+    """Cancel a job: a queued job never runs, a running one stops at its
+    next progress report"""
+    now = timezone.now()
+    queued = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+        status=Job.CANCELLED, cancel_requested=True, finished=now,
+        message="cancelled")
+    if not queued:
+        Job.objects.filter(pk=pk, status=Job.RUNNING).update(
+            cancel_requested=True)
+    logger.info("job %s cancel requested", pk)
+
+
+def claim_next() -> Job | None:
+    """Take the oldest job due to run, None if there is none.
+    The status is checked in the UPDATE, so of many workers only one wins a
+    job.
+    """
+    now = timezone.now()
+    due = (Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+           .order_by("run_after", "pk").values_list("pk", flat=True))
+    for pk in due[:10]:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, started=now, attempts=F("attempts") + 1,
+            message="")
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job: Job) -> None:
+    """Run a claimed job to the end: done, failed, cancelled, or queued
+    again after a delay if it failed and has attempts left.
+    """
+    jobs = Job.objects.filter(pk=job.pk)
+    task = HANDLERS.get(job.kind)
+    try:
+        if task is None:
+            raise JobFailedException(f"no job kind {job.kind!r}")
+        result = task(job, Progress(job))
+    except JobCancelledException:
+        _finish(job, Job.CANCELLED, message="cancelled")
+    except JobFailedException as err:
+        _finish(job, Job.FAILED, message=str(err),
+                result={"errors": err.errors})
+    except Exception as err:
+        logger.exception("%s attempt %s failed", job, job.attempts)
+        if job.attempts < job.max_attempts:
+            delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+            jobs.update(
+                status=Job.QUEUED,
+                run_after=timezone.now() + datetime.timedelta(seconds=delay),
+                message=f"attempt {job.attempts} failed: {err}"[:200])
+        else:
+            _finish(job, Job.FAILED, message=str(err))
+    else:
+        output = result.pop("output", "")
+        _finish(job, Job.DONE, result=result, output=output,
+                progress=F("total"), message="")
+
+
+def _finish(job: Job, status: str, **fields) -> None:
+    """record the end of a job"""
+    if "message" in fields:
+        fields["message"] = fields["message"][:200]
+    Job.objects.filter(pk=job.pk).update(status=status,
+                                         finished=timezone.now(), **fields)
+    logger.info("job %s %s: %s", job.pk, job.kind, status)
+
+
+def _run_in_thread(job: Job) -> None:
+    """run_job in a pool thread, which has its own database connection"""
+    try:
+        run_job(job)
+    finally:
+        connection.close()
+
+
+def run_worker(workers: int = 2, poll: float = POLL_INTERVAL,
+               once: bool = False) -> None:
+    """Claim and run jobs, workers at a time, until interrupted
+
+    Parameters
+    ----------
+    workers : int
+        jobs run at once, each in a thread
+    poll : float
+        seconds between looks at an empty queue
+    once : bool
+        stop when no job is due and none is running
+    """
+    logger.info("job worker started with %s threads", workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        while True:
+            running = {f for f in running if not f.done()}
+            claimed = None
+            while len(running) < workers and (claimed := claim_next()):
+                running.add(pool.submit(_run_in_thread, claimed))
+            if once and not running and claimed is None:
+                break
+            time.sleep(poll)
+
+
+def requeue_running() -> int:
+    """Queue again the jobs left running by a worker that died, only safe
+    when no other worker is running.
+
+    Returns
+    -------
+    int : jobs queued again
+    """
+    count = Job.objects.filter(status=Job.RUNNING).update(status=Job.QUEUED)
+    logger.info("%s running jobs queued again", count)
+    return count
+
+
+def purge(days: int) -> int:
+    """Delete the jobs finished more than days ago, and their files
+
+    Returns
+    -------
+    int : jobs deleted
+    """
+    before = timezone.now() - datetime.timedelta(days=days)
+    old = Job.objects.filter(status__in=Job.FINISHED, finished__lt=before)
+    for pk in old.values_list("pk", flat=True):
+        shutil.rmtree(job_dir(pk), ignore_errors=True)
+    count, _ = old.delete()
+    return count
+
+
+def job_dir(pk: int) -> str:
+    """the directory of the files of job pk"""
+    return os.path.join(settings.JOBS_DIR, str(pk))
+
+
+def job_file(job: Job, filename: str) -> str:
+    """the path a job writes filename to, its directory created"""
+    directory = job_dir(job.pk)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(filename))
+
+
+def save_uploads(files: Iterable) -> list[str]:
+    """Save uploaded report files for an import job, the files that are not
+    reports are left out.
+
+    Returns
+    -------
+    list(str) : paths of the saved files
+    """
+    os.makedirs(settings.JOBS_DIR, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix="upload-", dir=settings.JOBS_DIR)
+    paths = []
+    for upload in files:
+        name = os.path.basename(upload.name)
+        if os.path.splitext(name)[1].lower() not in SUFFIXES:
+            continue
+        path = os.path.join(directory, name)
+        with open(path, "wb") as saved:
+            for chunk in upload.chunks():
+                saved.write(chunk)
+        paths.append(path)
+    return paths
+
+
+def _write_stream(path: str, chunks: Iterable[bytes]) -> None:
+    """write a stream of bytes, ie: a zip_stream, to path"""
+    with open(path, "wb") as out:
+        for chunk in chunks:
+            out.write(chunk)
+
+
+@handler("finalize_report")
+def finalize_report(job: Job, progress: Progress) -> dict:
+    """The CTR of the tournament built in the session, from its matches.
+    params: {"tournament": pk, "player_ids": [cfc id]}, the roster as it
+    was when the job was queued
+    """
+    try:
+        tournament = Tournament.objects.get(pk=job.params["tournament"])
+    except (KeyError, Tournament.DoesNotExist) as err:
+        raise JobFailedException("no such tournament") from err
+    progress(0, 1, "building the CTR")
+    try:
+        ctr = CTR(tournament, job.params["player_ids"])
+    except CtrCreationException as err:
+        raise JobFailedException(str(err), err.errors or [str(err)]) from err
+    except (KeyError, TypeError, ValueError) as err:
+        raise JobFailedException(f"missing tournament data: {err}") from err
+    path = ctr.write_file(job_file(job, ctr.filename))
+    return {"filename": ctr.filename, "output": path}
+
+
+@handler("finalize_tournament")
+def finalize_tournament(job: Job, progress: Progress) -> dict:
+    """A zip of the CTRs of every section of a tournament.
+    params: {"tournament": pk}
+    """
+    try:
+        tournament = Tournament.objects.get(pk=job.params["tournament"])
+    except Tournament.DoesNotExist as err:
+        raise JobFailedException("no such tournament") from err
+    progress(0, 1, "validating the sections")
+    reports = sections.finalize_tournament(tournament)
+
+    errors = [f"{r['section'] or tournament.name}: {e}"
+              for r in reports for e in r["errors"]]
+    if errors:
+        raise JobFailedException(
+            f"{sum(1 for r in reports if r['errors'])} sections have errors",
+            errors)
+
+    name = writers.report_name(database.get_report_info(tournament))
+    filename = f"{name}-ctr.zip"
+    path = job_file(job, filename)
+    _write_stream(path, writers.zip_stream(
+        (r["filename"], [r["ctr"].encode()]) for r in reports))
+    return {"filename": filename, "output": path}
+
+
+@handler("bulk_export")
+def bulk_export_reports(job: Job, progress: Progress) -> dict:
+    """A zip of the reports of many tournaments.
+    params: {"start", "end": YYYY-MM-DD or None, "tournaments": [pk],
+             "formats": ["ctr", ...]}
+    """
+    params = job.params
+    start, end = (datetime.date.fromisoformat(params[key])
+                  if params.get(key) else None for key in ("start", "end"))
+    formats = params.get("formats") or ["ctr"]
+    tournaments = bulk_export.select_tournaments(start, end,
+                                                 params.get("tournaments"))
+
+    # one report per format per section, a tournament without sections is one
+    counts = tournaments.annotate(n=Count("sections")).values_list("n",
+                                                                   flat=True)
+    total = sum(max(n, 1) for n in counts) * len(formats)
+    progress(0, total, f"exporting {total} reports")
+
+    def reports():
+        for done, report in enumerate(
+                bulk_export.iter_reports(tournaments, formats), 1):
+            yield report[0], [report[1]]
+            progress(done)
+
+    path = job_file(job, "reports.zip")
+    _write_stream(path, writers.zip_stream(reports()))
+    return {"filename": "reports.zip", "reports": total, "output": path}
+
+
+@handler("import_reports")
+def import_reports(job: Job, progress: Progress) -> dict:
+    """Import uploaded CTR and TRF files.
+    params: {"paths": [path]}
+    """
+    paths = job.params.get("paths", [])
+    progress(0, len(paths), f"importing {len(paths)} reports")
+    imported, errors = [], []
+    for done, (path, tournament, error) in enumerate(import_files(paths), 1):
+        name = os.path.basename(path)
+        if error:
+            errors.append(f"{name}: {error}")
+        else:
+            imported.append(tournament.pk)
+        progress(done, message=f"imported {name}")
+
+    if errors and not imported:
+        raise JobFailedException("no report could be imported", errors)
+    return {"imported": imported, "errors": errors}
@@ -0,0 +1,156 @@
+"""live tournament updates, fanned out to every connected viewer"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import threading
+
+from django.db.models import Q
+from django.template.loader import render_to_string
+
+from cfc_report import logger
+from cfc_report.models import Match
+from cfc_report.services.results import game_points
+
+# events waiting for a slow viewer, before it is dropped
+QUEUE_SIZE = 100
+
+
+class TournamentFeed:
+    """The viewers of one tournament's live page.
+
+    An update is computed once by publish() and the same payload is handed
+    to every subscriber, so N viewers cost one computation.
+
+    Attributes
+    ----------
+    pk : int
+        the tournament primary key
+    name : str
+        how it is named in the log
+    subscribers : dict{asyncio.Queue: asyncio.AbstractEventLoop}
+        one queue per connected viewer, with the loop it is read on
+    """
+
+    def __init__(self, pk: int):
+        self.pk = pk
+        self.name = f"tournament {pk}"
+        self.subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> asyncio.Queue:
+        """add a viewer, must be called from its event loop
+
+        Returns
+        -------
+        asyncio.Queue : the (event, data) tuples for the viewer
+        """
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self.subscribers[queue] = asyncio.get_running_loop()
+        logger.debug("viewer subscribed to %s, %s viewers",
+                     self.name, len(self.subscribers))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """remove a viewer"""
+        with self._lock:
+            self.subscribers.pop(queue, None)
+        logger.debug("viewer left %s, %s viewers",
+                     self.name, len(self.subscribers))
+
+    def publish(self, event: str, data: str) -> None:
+        """send an event to every viewer. Thread safe, so it can be called
+        from the sync views.
+        """
+        with self._lock:
+            subscribers = list(self.subscribers.items())
+
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(_offer, self, queue, (event, data))
+
+
+def _offer(feed: TournamentFeed, queue: asyncio.Queue, item: tuple) -> None:
+    """put item in a viewer's queue, dropping the viewer if it is full"""
+    try:
+        queue.put_nowait(item)
+    except asyncio.QueueFull:
+        logger.warning("live viewer of %s fell behind, dropped", feed.name)
+        feed.unsubscribe(queue)
+
+
+# by tournament pk, names are only unique with the tournament date
+_feeds: dict[int, TournamentFeed] = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(pk: int) -> TournamentFeed:
+    """get the feed of tournament pk, creating it if needed"""
+    with _feeds_lock:
+        if pk not in _feeds:
+            _feeds[pk] = TournamentFeed(pk)
+        return _feeds[pk]
+
+
+def format_event(event: str, data: str) -> str:
+    """format an event for a text/event-stream response"""
+    lines = "".join(f"data: {line}\n" for line in data.splitlines())
+    return f"event: {event}\n{lines}\n"
+
+
+def publish_match(match: Match) -> None:
+    """push a saved match to the viewers of its tournament: the result row,
+    and the standings rows of its two players.
+
+    Nothing is computed when no one is watching.
+
+    Parameters
+    ----------
+    match : Match
+        the saved match
+    """
+    with _feeds_lock:
+        feed = _feeds.get(match.tournament_id)
+    if feed is None or not feed.subscribers:
+        return
+
+    feed.publish("result", render_to_string(
+        "cfc_report/show/partials/result-row.html", {"match": match}))
+
+    players = (match.white,) if match.is_bye else (match.white, match.black)
+    for row in _standing_rows(players, match.tournament_id):
+        feed.publish(f"standing-{row['player'].cfc_id}", render_to_string(
+            "cfc_report/show/partials/standing-row.html", {"row": row}))
+
+
+def _standing_rows(players: tuple, tournament_id: int) -> list[dict]:
+    """points and games played of players in the tournament, one query"""
+    ids = [p.cfc_id for p in players]
+    results = Match.objects.filter(
+        Q(white__cfc_id__in=ids) | Q(black__cfc_id__in=ids),
+        tournament=tournament_id,
+    ).values_list("white__cfc_id", "black__cfc_id", "result")
+
+    rows = {cfc_id: {"player": p, "points": 0.0, "played": 0}
+            for cfc_id, p in zip(ids, players)}
+    for white, black, result in results:
+        match_points = game_points(result)
+        if match_points is None:
+            continue
+        for cfc_id, points in zip((white, black), match_points):
+            if cfc_id in rows:
+                rows[cfc_id]["points"] += points
+                rows[cfc_id]["played"] += 1
+
+    return list(rows.values())
@@ -0,0 +1,238 @@
+"""streaming readers for CTR and FIDE TRF tournament reports
+
+No database access, so the readers can run in a process pool.
+"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import csv
+import datetime
+from typing import Iterable, Iterator
+
+from cfc_report import logger
+from cfc_report.services.results import BYES
+from cfc_report.services.results import FROM_CTR as CTR_RESULTS
+from cfc_report.services.results import FROM_TRF as TRF_RESULTS
+
+# CTR result letters of a bye, an entry without an opponent entry
+CTR_BYES = {letter for letter, code in CTR_RESULTS.items() if code in BYES}
+
+# CTR pairing abbreviation -> PairingSystemField
+CTR_PAIRING = {"S": "SW", "R": "RR"}
+
+
+class ReportImportException(Exception):
+    """A report file could not be read"""
+    pass
+
+
+# the readers are generators over the lines of a report. They yield
+#   ("tournament", {field: value})                    once, first
+#   ("player", key, name, rating, ...)                per player
+#   ("game", round_number, white, black, result)      per game
+# with result a Match result code, and players keyed by an int: the cfc
+# id in a CTR, the start rank in a TRF, which has no cfc ids. A TRF player
+# also has its FIDE id, None if it has none.
+
+
+def read_ctr(lines: Iterable[str]) -> Iterator[tuple]:
+    """read a CTR report, as written by services.ctr.CTR
+
+    After the header line, each game is two players' three line entries,
+    white then black: "cfc id" / "result letter","0" / "points".
+    A bye is one entry, its letter one of CTR_BYES.
+    The file has no round numbers, a new round is started when a player
+    comes up a second time.
+    """
+    rows = (row for row in csv.reader(lines) if row)
+
+    try:
+        (name, province, _, pairing, date, _, td_cfc, to_cfc) = next(rows)
+    except (StopIteration, ValueError) as err:
+        raise ReportImportException(f"bad CTR header: {err}")
+
+    tournament = {
+        "name": name,
+        "province": province,
+        "pairing_system": CTR_PAIRING.get(pairing, "RR"),
+        "date": _ctr_date(date),
+        "td_cfc": int(td_cfc or 0),
+        "to_cfc": int(to_cfc or 0),
+    }
+    yield ("tournament", tournament)
+
+    round_number = 1
+    in_round: set[int] = set()
+    seen: set[int] = set()
+    for (white_id, letter), black_id in _ctr_games(_ctr_entries(rows)):
+        ids = {white_id, black_id} - {None}
+        if not in_round.isdisjoint(ids):
+            round_number += 1
+            in_round.clear()
+        in_round.update(ids)
+
+        for cfc_id in (white_id, black_id):
+            if cfc_id is not None and cfc_id not in seen:
+                seen.add(cfc_id)
+                yield ("player", cfc_id, None, None)
+        yield ("game", round_number, white_id, black_id,
+               CTR_RESULTS.get(letter, "_"))
+
+
+def _ctr_entries(rows: Iterator[list]) -> Iterator[tuple[int, str]]:
+    """(cfc id, result letter) of each three line player entry"""
+    for cfc_row in rows:
+        try:
+            result_row = next(rows)
+            next(rows)  # points, implied by the result letter
+        except StopIteration:
+            raise ReportImportException(f"truncated CTR entry for {cfc_row}")
+        yield int(cfc_row[0]), result_row[0]
+
+
+def _ctr_games(entries: Iterator[tuple[int, str]]) -> Iterator[tuple]:
+    """((white cfc id, result letter), black cfc id) of each game,
+    black is None for a bye"""
+    for white in entries:
+        if white[1] in CTR_BYES:
+            yield white, None
+            continue
+        black = next(entries, None)
+        if black is None:
+            raise ReportImportException(
+                f"CTR game of {white[0]} has no opponent")
+        yield white, black[0]
+
+
+def _ctr_date(date: str) -> datetime.date:
+    """a CTR date, year-month-day with or without zero padding"""
+    try:
+        year, month, day = (int(part) for part in date.split("-"))
+        return datetime.date(year, month, day)
+    except ValueError as err:
+        raise ReportImportException(f"bad CTR date {date!r}: {err}")
+
+
+def read_trf(lines: Iterable[str]) -> Iterator[tuple]:
+    """read a FIDE TRF(-16) report
+
+    Players are keyed by start rank, and yielded with their FIDE id,
+    columns 58-68, which is not a cfc id: the importer finds the players
+    in the database, see importer.match_trf_players.
+    Games are listed under both players, each is yielded once, from the
+    white player's line. Byes are games without a black player, rounds
+    left empty are skipped.
+    """
+    tournament = {"name": "", "province": "", "pairing_system": "SW",
+                  "date": None, "td_cfc": 0, "to_cfc": 0}
+    # start ranks read, and the white player's games by start rank
+    ranks: set[int] = set()
+    games: list[tuple[int, int, int | None, str]] = []
+    header_sent = False
+
+    for line in lines:
+        code = line[:3]
+        if code == "012":
+            tournament["name"] = line[4:].strip()
+        elif code == "042":
+            tournament["date"] = _trf_date(line[4:].strip())
+        elif code == "092":
+            if "robin" in line.lower():
+                tournament["pairing_system"] = "RR"
+        elif code == "001":
+            if not header_sent:
+                if tournament["date"] is None:
+                    raise ReportImportException("TRF has no start date (042)")
+                yield ("tournament", tournament)
+                header_sent = True
+
+            rank = int(line[4:8])
+            ranks.add(rank)
+            yield ("player", rank, line[14:47].strip(),
+                   int(line[48:52].strip() or 0),
+                   int(line[57:68].strip() or 0) or None)
+
+            for round_number, block in enumerate(_trf_rounds(line), start=1):
+                opponent, colour, result = block
+                code = TRF_RESULTS.get(result)
+                if code is None:
+                    continue
+                if colour == "w" and opponent:
+                    games.append((round_number, rank, opponent, code))
+                elif not opponent and code in BYES:
+                    games.append((round_number, rank, None, code))
+
+    if not header_sent:
+        raise ReportImportException("TRF has no players (001)")
+
+    # a game is yielded once both its players are known
+    for round_number, white, black, result in games:
+        if black is None or black in ranks:
+            yield ("game", round_number, white, black, result)
+        else:
+            logger.warning("TRF round %s: no player %s, game skipped",
+                           round_number, black)
+
+
+def _trf_rounds(line: str) -> Iterator[tuple[int, str, str]]:
+    """(opponent start rank, colour, result) of each round on a player line"""
+    for start in range(91, len(line.rstrip()), 10):
+        block = line[start:start + 8].ljust(8)
+        opponent = block[0:4].strip()
+        yield (int(opponent) if opponent.isdigit() else 0,
+               block[5], block[7])
+
+
+def _trf_date(date: str) -> datetime.date:
+    """a TRF date, YYYY/MM/DD or YY/MM/DD"""
+    for fmt in ("%Y/%m/%d", "%y/%m/%d", "%Y.%m.%d", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(date, fmt).date()
+        except ValueError:
+            continue
+    raise ReportImportException(f"bad TRF date {date!r}")
+
+
+def parse_file(path: str) -> dict:
+    """Parse one report file, CTR or TRF by its content. Runs in the
+    import process pool, so it touches no database and returns plain data.
+
+    Returns
+    -------
+    dict
+        "path", "format": "ctr" or "trf", "tournament": {field: value},
+        "players": {key: (name, rating)} of a CTR, keyed by cfc id,
+            {key: (name, rating, FIDE id)} of a TRF, keyed by start rank,
+        "games": [(round number, white key, black key, result)]
+    """
+    with open(path, encoding="utf-8", errors="replace", newline="") as f:
+        first = f.readline()
+        f.seek(0)
+        fmt = "ctr" if first.startswith('"') else "trf"
+        reader = read_ctr(f) if fmt == "ctr" else read_trf(f)
+
+        parsed = {"path": path, "format": fmt, "tournament": None,
+                  "players": {}, "games": []}
+        for record in reader:
+            kind = record[0]
+            if kind == "game":
+                parsed["games"].append(record[1:])
+            elif kind == "player":
+                parsed["players"][record[1]] = record[2:]
+            else:
+                parsed["tournament"] = record[1]
+
+    parsed["tournament"]["num_rounds"] = max(
+        (g[0] for g in parsed["games"]), default=0)
+    return parsed
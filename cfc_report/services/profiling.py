@@ -0,0 +1,189 @@
+"""profile single requests on demand, and the profiles kept"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import cProfile
+import os
+import pstats
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from cfc_report import logger
+
+# Each profile is two files in settings.PROFILE_DIR sharing a name:
+#   <name>.prof       cProfile stats, for pstats or snakeviz
+#   <name>.collapsed  "a;b;c microseconds" lines, for flamegraph.pl or
+#                     speedscope
+
+PSTATS = ".prof"
+COLLAPSED = ".collapsed"
+# profiles kept, the oldest are deleted past it
+KEEP = 50
+# frames deep a collapsed stack goes, deeper calls are cut off
+MAX_DEPTH = 64
+# seconds a call path must take to be followed, so the paths walked stay
+# a few per millisecond of the request however tangled its call graph
+MIN_PATH_TIME = 1e-5
+
+_NAME = re.compile(r"[\w-]+")
+_UNSAFE = re.compile(r"[^\w-]+")
+
+
+def profile_dir() -> str:
+    """the directory profiles are saved in, empty if profiling is off"""
+    return getattr(settings, "PROFILE_DIR", "") or ""
+
+
+def profile(func, *args, **kwargs) -> tuple:
+    """call func under cProfile
+
+    Returns
+    -------
+    tuple(what func returned, cProfile.Profile)
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, profiler
+
+
+def save(profiler: cProfile.Profile, method: str, path: str) -> str:
+    """Write the pstats and collapsed stacks of a request's profile, then
+    delete the oldest profiles past KEEP.
+
+    Parameters
+    ----------
+    profiler : the finished profile
+    method, path : of the request, they name the files
+
+    Returns
+    -------
+    str : the name of the profile, see get_profile_path
+    """
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    slug = _UNSAFE.sub("-", path).strip("-")[:60] or "root"
+    # names sort by when they were taken
+    seconds, nanos = divmod(time.time_ns(), 10**9)
+    name = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(seconds))}" \
+           f"-{nanos:09d}-{method.lower()}-{slug}"
+
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(os.path.join(directory, name + PSTATS))
+    with open(os.path.join(directory, name + COLLAPSED), "w",
+              encoding="utf-8") as collapsed:
+        collapsed.writelines(f"{stack} {micros}\n"
+                             for stack, micros in collapsed_stacks(stats))
+
+    for old in list_profiles()[KEEP:]:
+        for suffix in (PSTATS, COLLAPSED):
+            try:
+                os.remove(os.path.join(directory, old["name"] + suffix))
+            except FileNotFoundError:
+                pass
+    logger.info("profile of %s %s saved: %s, %.3f s", method, path, name,
+                stats.total_tt)
+    return name
+
+
+def collapsed_stacks(stats: pstats.Stats) -> list[tuple[str, int]]:
+    """Collapsed stacks of a profile, the format flame graph tools read.
+
+    cProfile keeps the callers of each function, not whole stacks, so the
+    stacks are rebuilt from the entry points down, and a function's time is
+    shared between its callers by the cumulative time each spent in it.
+    Recursive calls are folded into the first frame of the function, and
+    paths quicker than MIN_PATH_TIME are left out.
+
+    Returns
+    -------
+    list(tuple(str, int))
+        ("entry;caller;function", self time in microseconds), heaviest first
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+    roots = [func for func, (*_, callers) in stats.stats.items()
+             if not callers]
+
+    weights = defaultdict(float)
+
+    def walk(func, stack: tuple, share: float) -> None:
+        # share: the part of func's calls made along this stack
+        self_time = stats.stats[func][2]
+        stack = stack + (label(func),)
+        weights[";".join(stack)] += self_time * share
+        if len(stack) >= MAX_DEPTH:
+            return
+        for callee, (_, _, _, edge_cumulative) in callees[func].items():
+            callee_cumulative = stats.stats[callee][3]
+            if share * edge_cumulative < MIN_PATH_TIME \
+                    or label(callee) in stack:
+                continue
+            walk(callee, stack,
+                 share * min(edge_cumulative / callee_cumulative, 1.0))
+
+    for root in roots:
+        walk(root, (), 1.0)
+
+    stacks = [(stack, round(seconds * 1e6))
+              for stack, seconds in weights.items()]
+    return sorted((s for s in stacks if s[1] > 0), key=lambda s: -s[1])
+
+
+def label(func: tuple) -> str:
+    """the frame name of a pstats function key (file, line, name)"""
+    filename, line, name = func
+    if filename == "~":
+        # a builtin, name is already "<built-in method ...>"
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def list_profiles() -> list[dict]:
+    """the saved profiles, newest first
+
+    Returns
+    -------
+    list(dict)
+        {"name", "size": bytes of its pstats, "modified": datetime}
+    """
+    directory = profile_dir()
+    if not directory or not os.path.isdir(directory):
+        return []
+    found = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(PSTATS) and entry.is_file():
+                info = entry.stat()
+                found.append({"name": entry.name[:-len(PSTATS)],
+                              "size": info.st_size,
+                              "modified": datetime.fromtimestamp(
+                                  info.st_mtime, timezone.utc)})
+    return sorted(found, key=lambda p: p["name"], reverse=True)
+
+
+def get_profile_path(name: str, suffix: str) -> str | None:
+    """the path of one file of a saved profile, None if there is none.
+    name comes from a url, so it may not leave the profile directory.
+    """
+    if suffix not in (PSTATS, COLLAPSED) or not _NAME.fullmatch(name) \
+            or not profile_dir():
+        return None
+    path = os.path.join(profile_dir(), name + suffix)
+    return path if os.path.isfile(path) else None
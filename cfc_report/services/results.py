@@ -0,0 +1,156 @@
+"""encode Match.result codes for reports and standings"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every format agrees on one table, so a result is encoded with a single
+# dict lookup, and a code missing from the table is an error, never a loss.
+# No Django imports here: the parsers and writers run in worker processes.
+
+WHITE = "w"
+BLACK = "b"
+
+# Match.result codes
+WHITE_WIN = "w"
+BLACK_WIN = "b"
+DRAW = "d"
+WHITE_FORFEIT_WIN = "+"
+BLACK_FORFEIT_WIN = "-"
+FULL_BYE = "B"
+HALF_BYE = "H"
+ZERO_BYE = "U"
+NOT_PLAYED = "_"
+
+# (Match.result, colour) -> (CTR letter, TRF result, points)
+# a bye has no opponent, its player holds the white side
+RESULTS = {
+    (WHITE_WIN, WHITE): ("W", "1", 1.0),
+    (WHITE_WIN, BLACK): ("L", "0", 0.0),
+    (BLACK_WIN, WHITE): ("L", "0", 0.0),
+    (BLACK_WIN, BLACK): ("W", "1", 1.0),
+    (DRAW, WHITE): ("D", "=", 0.5),
+    (DRAW, BLACK): ("D", "=", 0.5),
+    (WHITE_FORFEIT_WIN, WHITE): ("+", "+", 1.0),
+    (WHITE_FORFEIT_WIN, BLACK): ("-", "-", 0.0),
+    (BLACK_FORFEIT_WIN, WHITE): ("-", "-", 0.0),
+    (BLACK_FORFEIT_WIN, BLACK): ("+", "+", 1.0),
+    (FULL_BYE, WHITE): ("B", "F", 1.0),
+    (HALF_BYE, WHITE): ("H", "H", 0.5),
+    (ZERO_BYE, WHITE): ("U", "Z", 0.0),
+}
+
+# codes with a result, and those of them without an opponent
+CODES = frozenset(code for code, _ in RESULTS)
+BYES = frozenset({FULL_BYE, HALF_BYE, ZERO_BYE})
+# games played over the board, not forfeited or byes
+OVER_THE_BOARD = frozenset({WHITE_WIN, BLACK_WIN, DRAW})
+
+# points of (white, black) by code, black is None for a bye
+GAME_POINTS = {
+    code: (RESULTS[(code, WHITE)][2],
+           RESULTS[(code, BLACK)][2] if (code, BLACK) in RESULTS else None)
+    for code in CODES
+}
+
+# PGN game termination by code, byes are not games
+PGN_RESULTS = {
+    WHITE_WIN: "1-0",
+    BLACK_WIN: "0-1",
+    DRAW: "1/2-1/2",
+    WHITE_FORFEIT_WIN: "1-0",
+    BLACK_FORFEIT_WIN: "0-1",
+}
+
+# result of the white player in a report file -> code
+FROM_CTR = {letter: code for (code, colour), (letter, _, _) in RESULTS.items()
+            if colour == WHITE}
+FROM_TRF = {trf: code for (code, colour), (_, trf, _) in RESULTS.items()
+            if colour == WHITE}
+# TRF-16 pairing allocated bye, scored as a full point bye
+FROM_TRF["U"] = FULL_BYE
+
+# values posted by the match form, see Match.RESULT_CHOICES
+FROM_DISPLAY = {
+    "1 - 0": WHITE_WIN,
+    "0 - 1": BLACK_WIN,
+    "0.5 - 0.5": DRAW,
+    "+ - -": WHITE_FORFEIT_WIN,
+    "- - +": BLACK_FORFEIT_WIN,
+    "1 - bye": FULL_BYE,
+    "0.5 - bye": HALF_BYE,
+    "0 - bye": ZERO_BYE,
+}
+
+
+class ResultCodeException(ValueError):
+    """A result code, or colour, that has no encoding"""
+    pass
+
+
+def encode(code: str, colour: str) -> tuple[str, str, float]:
+    """encode a result for one player of a game
+
+    Parameters
+    ----------
+    code : str
+        the Match.result of the game
+    colour : str
+        WHITE or BLACK, the side of the player
+
+    Returns
+    -------
+    tuple(CTR letter, TRF result, points)
+
+    Raises
+    ------
+    ResultCodeException if the game has no result, or the code is unknown
+    """
+    try:
+        return RESULTS[(code, colour)]
+    except KeyError:
+        raise ResultCodeException(
+            f"no result {code!r} for {colour!r}") from None
+
+
+def ctr_result(code: str, colour: str) -> tuple[str, float]:
+    """(CTR letter, points) of one player of a game, see encode"""
+    letter, _, points = encode(code, colour)
+    return letter, points
+
+
+def game_points(code: str) -> tuple[float, float] | None:
+    """(white, black) points of a game, None if it has no result yet"""
+    return GAME_POINTS.get(code)
+
+
+def sides(white, black) -> tuple[tuple, ...]:
+    """(player, colour) of each player a result is for, a bye has one"""
+    if black is None:
+        return ((white, WHITE),)
+    return ((white, WHITE), (black, BLACK))
+
+
+def from_entry(value: str) -> str:
+    """the code of a result as entered, a code or a form display value
+
+    Raises
+    ------
+    ResultCodeException if value is not a result
+    """
+    if value in CODES:
+        return value
+    try:
+        return FROM_DISPLAY[value]
+    except KeyError:
+        raise ResultCodeException(f"unknown result {value!r}") from None
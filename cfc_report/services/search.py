@@ -0,0 +1,322 @@
+"""find players by partial or misspelled name"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Iterable
+
+from django.db import DatabaseError, connection, connections
+
+from cfc_report import logger
+from cfc_report.models import Player
+
+# Two indexes answer a search:
+#   FTS5, kept in step with the player table by triggers, for word prefixes,
+#   made after the migrations by create_fts
+#   an in-memory trigram index, for misspellings, and for every search
+#   when the database is not SQLite or was built without FTS5.
+
+FTS_TABLE = "cfc_report_player_fts"
+
+# results of a search
+LIMIT = 10
+# trigram candidates scored exactly, the most trigrams in common first
+CANDIDATES = 100
+# slots read from postings to find the candidates
+POSTINGS_BUDGET = 20000
+# FTS5 hits ranked, a prefix of a common name has thousands
+FTS_CANDIDATES = 1000
+# least share of trigrams in common for a fuzzy match
+MIN_SIMILARITY = 0.25
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(name: str) -> str:
+    """lower case, no accents, words separated by single spaces"""
+    decomposed = unicodedata.normalize("NFKD", name.lower())
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(_WORD.findall(plain))
+
+
+def trigrams(name: str) -> set[str]:
+    """trigrams of a normalized name, each word padded so short words and
+    word starts count"""
+    grams = set()
+    for word in name.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """In-memory trigram index of player names.
+
+    Postings hold slot numbers into flat lists rather than players, so 100k
+    players cost a few MB. A renamed or deleted player leaves a dead slot,
+    which searches skip.
+
+    Attributes
+    ----------
+    names : list(str or None)
+        normalized name by slot, None for a dead slot
+    pks : list(int)
+        player primary key by slot, so players are fetched by index
+    slots : dict{int: int}
+        the live slot of each player, by primary key
+    postings : dict{str: list(int)}
+        slots by trigram
+    """
+
+    def __init__(self):
+        self.names: list = []
+        self.pks: list = []
+        self.slots: dict = {}
+        self.postings: dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def add(self, pk: int, name: str) -> None:
+        """index a player, replacing its old name if it has one"""
+        name = normalize(name)
+        with self.lock:
+            old = self.slots.get(pk)
+            if old is not None:
+                if self.names[old] == name:
+                    return
+                self.names[old] = None
+            slot = len(self.names)
+            self.names.append(name)
+            self.pks.append(pk)
+            self.slots[pk] = slot
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, []).append(slot)
+
+    def remove(self, pk: int) -> None:
+        """drop a player from the index"""
+        with self.lock:
+            slot = self.slots.pop(pk, None)
+            if slot is not None:
+                self.names[slot] = None
+
+    def search(self, query: str, limit: int = LIMIT) -> list[int]:
+        """primary keys of the players named most like query, best first
+
+        The rarest query trigrams pick the candidates, so a search reads
+        about POSTINGS_BUDGET slots however common the others are. Candidates
+        are then ranked by their share of trigrams with the query, word
+        prefixes of the query first.
+        """
+        query = normalize(query)
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        # trigrams no name has are typos
+        postings = sorted((self.postings[g] for g in grams
+                           if g in self.postings), key=len)
+        # read the rarest postings up to a budget, at least two of them so
+        # a typo in one still finds the name
+        counts = Counter()
+        read = 0
+        for n, posting in enumerate(postings):
+            if n >= 2 and read + len(posting) > POSTINGS_BUDGET:
+                break
+            counts.update(posting)
+            read += len(posting)
+
+        words = query.split()
+        scored = []
+        for slot, _ in counts.most_common(CANDIDATES):
+            name = self.names[slot]
+            if name is None:
+                continue
+            name_grams = trigrams(name)
+            similarity = len(grams & name_grams) / len(grams | name_grams)
+            prefix = all(any(w.startswith(q) for w in name.split())
+                         for q in words)
+            if prefix or similarity >= MIN_SIMILARITY:
+                scored.append((not prefix, -similarity, name, slot))
+
+        scored.sort()
+        return [self.pks[slot] for *_, slot in scored[:limit]]
+
+
+_index: TrigramIndex = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> TrigramIndex:
+    """the trigram index, built from the player table on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = TrigramIndex()
+                rows = Player.objects.values_list("pk", "name").iterator(
+                    chunk_size=5000)
+                for pk, name in rows:
+                    index.add(pk, name)
+                logger.info("player trigram index built: %s players",
+                            len(index.slots))
+                _index = index
+    return _index
+
+
+def index_players(players: Iterable[Player]) -> None:
+    """update the trigram index for saved players, if it has been built.
+    post_save receiver, and called after bulk saves, which send no signal.
+    """
+    if _index is not None:
+        for p in players:
+            _index.add(p.pk, p.name)
+
+
+def player_saved(sender, instance: Player, **kwargs) -> None:
+    """post_save receiver for Player, connected in CfcReportConfig.ready"""
+    index_players([instance])
+
+
+def player_deleted(sender, instance: Player, **kwargs) -> None:
+    """post_delete receiver for Player, connected in CfcReportConfig.ready"""
+    if _index is not None:
+        _index.remove(instance.pk)
+
+
+# FTS5
+_fts_ready = None
+
+
+def create_fts(sender, using: str = "default", **kwargs) -> None:
+    """Create the FTS5 table and its triggers, if they are not there.
+    post_migrate receiver, connected in CfcReportConfig.ready, so the DDL
+    runs with the migrations and never in a request.
+
+    Parameters
+    ----------
+    sender : the cfc_report AppConfig
+    using : alias of the database migrated
+    """
+    global _fts_ready
+    db = connections[using]
+    if db.vendor != "sqlite":
+        return
+
+    player = Player._meta.db_table
+    try:
+        with db.cursor() as cursor:
+            if _fts_exists(cursor):
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                f"name, content='{player}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', "
+                f"prefix='1 2 3')")
+            cursor.execute(
+                f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {player} "
+                f"BEGIN INSERT INTO {FTS_TABLE}(rowid, name) "
+                f"VALUES (new.id, new.name); END")
+            cursor.execute(
+                f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {player} "
+                f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) "
+                f"VALUES ('delete', old.id, old.name); END")
+            cursor.execute(
+                f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name "
+                f"ON {player} "
+                f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name) "
+                f"VALUES ('delete', old.id, old.name); "
+                f"INSERT INTO {FTS_TABLE}(rowid, name) "
+                f"VALUES (new.id, new.name); END")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        logger.info("player FTS5 index created")
+    except DatabaseError as err:
+        logger.warning("no FTS5 player index, using trigrams: %s", err)
+    # looked up again on the next search
+    _fts_ready = None
+
+
+def _fts_exists(cursor) -> bool:
+    """True if the FTS5 table is in the database of cursor"""
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+        [FTS_TABLE])
+    return cursor.fetchone() is not None
+
+
+def fts_available() -> bool:
+    """True if the FTS5 table made by create_fts is there, looked up once
+
+    Returns
+    -------
+    bool : False if the database is not SQLite, has no FTS5, or was not
+    migrated since
+    """
+    global _fts_ready
+    if _fts_ready is None:
+        if connection.vendor != "sqlite":
+            _fts_ready = False
+        else:
+            with connection.cursor() as cursor:
+                _fts_ready = _fts_exists(cursor)
+    return _fts_ready
+
+
+def _fts_search(query: str, limit: int) -> list[Player]:
+    """players whose name words start with every word of query, best first"""
+    words = normalize(query).split()
+    if not words:
+        return []
+    match = " ".join(f'"{w}"*' for w in words)
+    # ranking every hit of a short prefix costs more than the search
+    return list(Player.objects.raw(
+        f"SELECT p.* FROM {Player._meta.db_table} p JOIN ("
+        f"SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+        f"LIMIT %s) f ON f.rowid = p.id ORDER BY f.rank LIMIT %s",
+        [match, FTS_CANDIDATES, limit]))
+
+
+def search_players(query: str, limit: int = LIMIT) -> list[Player]:
+    """Players by cfc id, name prefix or fuzzy name, best match first
+
+    Parameters
+    ----------
+    query : str
+        what the TD typed, a cfc id or all or part of a name
+    limit : int
+        most players returned
+
+    Returns
+    -------
+    list(Player)
+    """
+    query = query.strip()
+    if not query:
+        return []
+    if query.isdigit():
+        return list(Player.objects.filter(cfc_id=int(query))[:limit])
+
+    found = _fts_search(query, limit) if fts_available() else []
+    if len(found) < limit:
+        # misspellings, and every search without FTS5
+        seen = {p.pk for p in found}
+        pks = [pk for pk in get_index().search(query, limit)
+               if pk not in seen][:limit - len(found)]
+        by_pk = Player.objects.in_bulk(pks)
+        found += [by_pk[pk] for pk in pks if pk in by_pk]
+
+    logger.debug("search %r found %s players", query, len(found))
+    return found
@@ -0,0 +1,127 @@
+"""tournaments in sections, each validated and reported on its own"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from cfc_report import logger
+from cfc_report.models import Match, Roster, Tournament
+from cfc_report.services import database, snapshot
+from cfc_report.services.writers import report_section
+
+
+def get_sections_data(t: Tournament) -> list[dict]:
+    """The report data of each section of a tournament, as plain data, in
+    three queries however many sections it has. A tournament without
+    sections is reported as one section.
+
+    Returns
+    -------
+    list(dict)
+        {"section": name, "info": report fields,
+         "players": {cfc id: (name, rating)},
+         "games": [(round number, white cfc id, black cfc id, result)]}
+    """
+    info = database.get_report_info(t)
+    sections = list(t.sections.order_by("pk"))
+    if not sections:
+        snap = snapshot.get_snapshot(t)
+        return [{"section": "", "info": info, "players": snap.roster(),
+                 "games": list(snap.games())}]
+
+    # every section roster, in one query
+    rosters = defaultdict(dict)
+    entries = Roster.players.through.objects.filter(
+        roster_id__in=[s.roster_id for s in sections if s.roster_id],
+    ).values_list("roster_id", "player__cfc_id", "player__name",
+                  "player__rating")
+    for roster_id, cfc_id, name, rating in entries:
+        rosters[roster_id][cfc_id] = (name, rating)
+
+    # every section's games, in one query
+    games = defaultdict(list)
+    rows = (
+        Match.objects.filter(section__tournament=t)
+        .order_by("round_number", "pk")
+        .values_list("section_id", "round_number", "white__cfc_id",
+                     "black__cfc_id", "result")
+        .iterator(chunk_size=database.CHUNK_SIZE)
+    )
+    for section_id, *game in rows:
+        games[section_id].append(tuple(game))
+
+    return [
+        {
+            "section": s.name,
+            "info": {**info, "name": f"{t.name} {s.name}",
+                     "pairing_system": s.pairing_system,
+                     "num_rounds": s.num_rounds},
+            "players": rosters.get(s.roster_id, {}),
+            "games": games[s.pk],
+        }
+        for s in sections
+    ]
+
+
+def finalize_tournament(t: Tournament, workers: int = None) -> list[dict]:
+    """Validate every section of a tournament and build its CTR, the
+    sections in parallel in a process pool.
+
+    Parameters
+    ----------
+    t : the tournament
+    workers : processes, default one per cpu, at most one per section
+
+    Returns
+    -------
+    list(dict) from writers.report_section, in section order
+    """
+    data = get_sections_data(t)
+    if len(data) == 1:
+        # a pool is not worth starting for one section
+        reports = [report_section(data[0])]
+    else:
+        workers = min(workers or os.cpu_count() or 1, len(data))
+        # spawn, the finalize job calls this from a worker thread, where
+        # forking is unsafe
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")) as pool:
+            reports = list(pool.map(report_section, data))
+
+    logger.info("%s finalized: %s sections, %s with errors", t.name,
+                len(reports), sum(1 for r in reports if r["errors"]))
+    return reports
+
+
+def write_reports(reports: list[dict], directory: str = ".") -> list[str]:
+    """write the CTR of each section without errors to directory.
+    side effect: creates one file per section, overwriting it if it exists.
+
+    Returns
+    -------
+    list(str) : paths of the written files
+    """
+    paths = []
+    for report in reports:
+        if report["ctr"] is None:
+            continue
+        path = os.path.join(directory, report["filename"])
+        with open(path, "w", encoding="utf-8") as ctr:
+            ctr.write(report["ctr"])
+        paths.append(path)
+    return paths
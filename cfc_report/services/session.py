@@ -14,110 +14,192 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import zlib
+
 from cfc_report import logger
-from django.contrib.sessions.backends.db import SessionStore
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase
 from django.shortcuts import get_object_or_404
 
 from ..models import Match, Player, Round, Tournament
 from . import database
 
-# get the current session
-session = SessionStore()
+# Every function takes the session it works on, request.session, which
+# the SessionMiddleware saves with the response, through CompactSerializer.
+# The session holds plain data only, never model instances, so it stays
+# small and is JSON serializable:
+#   "Tournament": pk of the Tournament being built
+#   "TournamentInfo": its fields, see normalize_tournament_info
+#   "TournamentRound": int, the round being entered
+#   "players_by_cfc": [cfc id], the roster
+#   "matches": [[pk, round, white cfc id, black cfc id, result]], the
+#       matches of the round being entered, black None for a bye
+#   "jobs": [pk], the last KEPT_JOBS jobs queued, whose files it may
+#       download
+# A finished round is in the database, so the session does not grow with
+# the number of rounds played.
+
+# the fields of "TournamentInfo", and the type each is stored as
+TOURNAMENT_INFO_FIELDS = {
+    "name": str,
+    "num_rounds": int,
+    "date": str,
+    "pairing_system": str,
+    "province": str,
+    "to_cfc": int,
+    "td_cfc": int,
+}
+
+# encoded sessions longer than this, in bytes, are zlib compressed
+COMPRESS_THRESHOLD = getattr(settings, "SESSION_COMPRESS_THRESHOLD", 1024)
+# an encoded session longer than this, in bytes, is logged
+SIZE_BUDGET = getattr(settings, "SESSION_SIZE_BUDGET", 16 * 1024)
+# first byte of a compressed session, JSON never starts with it
+COMPRESSED = b"z"
+# jobs a session remembers, the oldest are forgotten past it
+KEPT_JOBS = 20
+
+
+def encode(state: dict) -> bytes:
+    """compact JSON of a session, compressed over COMPRESS_THRESHOLD bytes.
+    logs a warning if the result is over SIZE_BUDGET bytes
+    """
+    data = json.dumps(state, separators=(",", ":")).encode()
+    if len(data) > COMPRESS_THRESHOLD:
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            data = COMPRESSED + packed
+    if len(data) > SIZE_BUDGET:
+        logger.warning("session is %s bytes, over its %s byte budget: %s",
+                       len(data), SIZE_BUDGET,
+                       {k: len(json.dumps(v)) for k, v in state.items()})
+    return data
 
 
-def get_players() -> list[Player]:
-    """get the players in current session
+def decode(data: bytes) -> dict:
+    """the session encoded by encode"""
+    if data[:1] == COMPRESSED:
+        data = zlib.decompress(data[1:])
+    return json.loads(data)
+
+
+class CompactSerializer:
+    """SESSION_SERIALIZER of compact, compressed JSON, see encode"""
+
+    def dumps(self, obj: dict) -> bytes:
+        return encode(obj)
 
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    def loads(self, data: bytes) -> dict:
+        return decode(data)
+
+
+def check_size(session: SessionBase) -> int:
+    """bytes of the session as it would be saved, logged over SIZE_BUDGET"""
+    return len(encode(dict(session.items())))
+
+
+def normalize_tournament_info(data: dict) -> dict:
+    """The tournament fields of data, without anything else in it, each
+    stored as its TOURNAMENT_INFO_FIELDS type
+
+    Parameters
+    ----------
+    data : dict
+        the fields, ie: database.get_report_info
 
     Returns
     -------
-    players : list(Player)
-        A list of the players in session
+    dict : {field: value}, the date as YYYY-MM-DD
+
+    Raises
+    ------
+    ValueError if a field is missing or not of its type
+    """
+    info = {}
+    for field, kind in TOURNAMENT_INFO_FIELDS.items():
+        if field not in data:
+            raise ValueError(f"no tournament {field}")
+        info[field] = kind(data[field])
+    return info
+
+
+def _roster(session: SessionBase) -> dict:
+    """the roster in the session, {str(cfc id): None}, created if needed.
+    A dict is an ordered set, and JSON keeps its order.
     """
+    roster = session.get("players_by_cfc")
+    if roster is None:
+        roster = session["players_by_cfc"] = {}
+    return roster
 
-    session_ids = session.get("players_by_cfc")
-    logger.debug("cfc id's got from session: %s", session_ids)
-    players: list[Player] = []
 
-    # go through the session player id's and fetch players from db
-    if session_ids:
-        for cfc_id in session_ids:
+def has_player(session: SessionBase, cfc_id: "CfcId") -> bool:
+    """True if a player is in the session roster, in constant time"""
+    return str(int(cfc_id)) in (session.get("players_by_cfc") or {})
 
-            p = database.get_player_by_cfc(cfc_id)
-            players.append(p)
 
-            logger.debug("session_id: %s got %s", cfc_id, p)
+def get_players(session: SessionBase) -> list[Player]:
+    """get the players in current session, in one query
 
-        logger.debug("Players in session: %s", players)
-    else:
-        logger.warning("No players gotten from session")
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
 
+    Returns
+    -------
+    players : list(Player)
+        A list of the players in session, in the order they were added
+    """
+    session_ids = get_player_ids(session)
+    by_cfc = {p.cfc_id: p
+              for p in Player.objects.filter(cfc_id__in=session_ids)}
+    players = [by_cfc[cfc_id] for cfc_id in session_ids if cfc_id in by_cfc]
+
+    if not players:
+        logger.warning("No players gotten from session")
+    logger.debug("Players in session: %s", players)
     return players
 
 
-def get_players_by_id() -> "dict{CfcId:Player}":
+def get_players_by_id(session: SessionBase) -> "dict{CfcId:Player}":
     """get the players in current session
 
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
 
     Returns
     -------
     players: "dict{CfcId:Player}"
         A dict of the players in session by there id
     """
+    return {p.cfc_id: p for p in get_players(session)}
 
-    session_players = session.get("players_by_cfc")
-    logger.debug("players got from session: %s", session_players)
-    players: "dict{CfcId:Player}" = {}
-
-    if session_players:
-        for cfc_id in session_players:
-            logger.debug("session_players: %s", session_players)
-
-            p = database.get_player_by_cfc(cfc_id)
 
-            players[cfc_id] = p
-
-        logger.debug("Players in session: %s", players)
-    else:
-        logger.warning("No players gotten from session")
-
-    return players
-
-
-def get_player_ids() -> list[str]:
+def get_player_ids(session: SessionBase) -> list[int]:
     """get the cfc id's of players in current session
 
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
 
     Returns
     -------
-    list(str)
-        A list of the cfc id's in session.
-        A cfc id is a 6 character numeric str
+    list(int)
+        the cfc id's in session, in the order they were added
     """
-
-    session_players = session.get("players_by_cfc")
-
-    # should return an empty list if None
-    if session_players is None:
-        session_players = []
+    session_players = [int(cfc_id) for cfc_id in
+                       session.get("players_by_cfc") or {}]
 
     logger.debug("session players id's gotten: %s", session_players)
     return session_players
 
 
-def update_players(players: list[Player]) -> None:
+def update_players(session: SessionBase, players: list[Player]) -> None:
     """update players in current session
 
     Parameters
@@ -127,15 +209,12 @@ def update_players(players: list[Player]) -> None:
     """
 
     logger.debug("updating session Players to be: %s", players)
-    session_players_cfc_id = []
-    for p in players:
-        session_players_cfc_id.append(p.cfc_id)
+    session["players_by_cfc"] = dict.fromkeys(str(p.cfc_id) for p in players)
+    check_size(session)
 
-    session["players_by_cfc"] = session_players_cfc_id
 
-
-def add_player_by_id(cfc_id: "CfcId") -> None:
-    """add a player to the current session
+def add_player_by_id(session: SessionBase, cfc_id: "CfcId") -> bool:
+    """add a player to the current session, if it is not in it already
 
     Side-effects
     ------------
@@ -145,17 +224,25 @@ def add_player_by_id(cfc_id: "CfcId") -> None:
     Parameters
     ----------
     cfc_id : CfcId
-        some player's cfc id to add to list
-    """
+        some player's cfc id to add to the roster
 
-    if "players_by_cfc" in session:
-        session["players_by_cfc"].append(cfc_id)
-    else:
-        session["players_by_cfc"] = [cfc_id]
+    Returns
+    -------
+    bool : False if the player was in the session already
+    """
+    roster = _roster(session)
+    key = str(int(cfc_id))
+    if key in roster:
+        return False
+    roster[key] = None
+    # the roster was changed in place, which the session cannot see
+    session.modified = True
+    check_size(session)
+    return True
 
 
-def remove_player_by_id(cfc_id: "CfcId") -> None:
-    """remove a player from session by id
+def remove_player_by_id(session: SessionBase, cfc_id: "CfcId") -> bool:
+    """remove a player from session by id, if it is in it
 
     Side-effects
     ------------
@@ -164,45 +251,81 @@ def remove_player_by_id(cfc_id: "CfcId") -> None:
     Parameters
     ----------
     cfc_id : CfcId
-        some player's cfc id to remove from the session list
+        some player's cfc id to remove from the roster
+
+    Returns
+    -------
+    bool : False if the player was not in the session
     """
-    session_players = session.get("players_by_cfc")
+    roster = _roster(session)
+    if str(int(cfc_id)) not in roster:
+        return False
+    del roster[str(int(cfc_id))]
+    session.modified = True
 
-    logger.debug("players in session by cfc i: %s", session_players)
+    logger.debug("removed %s, session_players now %s", cfc_id, roster)
+    return True
 
-    session_players.remove(cfc_id)
 
-    logger.debug("removed %s, session_players now %s", cfc_id, session_players)
+def _match_entry(m: Match) -> list:
+    """the session entry of a match with its players loaded"""
+    return [m.pk, m.round_number, m.white.cfc_id,
+            None if m.is_bye else m.black.cfc_id, m.result]
 
 
-def get_matches() -> list("Match"):
-    """Get the matches in the session
-    Uses
-    ----
-    session : A Django session
-        the active session
+def get_games(session: SessionBase) -> list[tuple]:
+    """the games of the matches in the session, without a query
 
     Returns
     -------
-    A list of the matches
+    list((round number, white cfc id, black cfc id, result))
     """
-    session_matches = session.get("matches")
+    return [tuple(entry[1:]) for entry in session.get("matches") or []]
 
-    logger.info("matches got from session: %s, of type: %s",
-                session_matches, type(session_matches))
 
+def get_matches(session: SessionBase) -> list["Match"]:
+    """Get the matches in the session, their players fetched in one query
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
+
+    Returns
+    -------
+    A list of the matches
+    """
+    entries = session.get("matches") or []
+    cfc_ids = {cfc_id for entry in entries for cfc_id in entry[2:4]
+               if cfc_id is not None}
+    players = {p.cfc_id: p
+               for p in Player.objects.filter(cfc_id__in=cfc_ids)}
+
+    session_matches = []
+    for pk, round_number, white, black, result in entries:
+        if white not in players or (black is not None
+                                    and black not in players):
+            logger.warning("session match %s: a player is gone", pk)
+            continue
+        session_matches.append(Match(
+            pk=pk, round_number=round_number, white=players[white],
+            black=players.get(black), result=result))
+
+    logger.debug("matches got from session: %s", session_matches)
     return session_matches
 
 
-def create_match(white_id: "CfcId", black_id: "CfcId", result: "w,b,or d") -> Match:
-    """Create a chess match in this session
-    Uses
-    ----
-    session - the django session got from the session store
+def create_match(session: SessionBase, white_id: "CfcId", black_id: "CfcId",
+                 result: str) -> Match:
+    """Create and save a chess match in this session, result is a
+    Match.result code, black_id is None for a bye
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
 
     side-effects
     ------------
-    modifies the session "matches"
+    modifies the session "matches", saves the match
 
     Returns
     -------
@@ -210,46 +333,67 @@ def create_match(white_id: "CfcId", black_id: "CfcId", result: "w,b,or d") -> Ma
     """
     # get match players from database
     white_player = database.get_player_by_cfc(white_id)
-    black_player = database.get_player_by_cfc(black_id)
-    tournament_rnd = get_tournament_round_number()
+    black_player = database.get_player_by_cfc(black_id) if black_id else None
+    tournament_rnd = get_tournament_round_number(session)
     chess_match = Match(
         white=white_player, black=black_player, result=result,
-        round_number=tournament_rnd)
+        round_number=tournament_rnd, tournament_id=session.get("Tournament"))
+    chess_match.save()
 
-    if session.has_key("matches") and session["matches"] is not None:
-        # update it
-        session["matches"].append(chess_match)
-    else:
-        # create it
-        session["matches"] = [chess_match]
+    session["matches"] = (session.get("matches") or []) + [
+        _match_entry(chess_match)]
+    check_size(session)
 
     return chess_match
 
 
-def remove_match_by_pk(pk: "PrimaryKey") -> None:
+def add_matches(session: SessionBase, matches: list[Match]) -> None:
+    """add saved matches, with their players loaded, to this session,
+    replacing any with the same pk
+
+    side-effects
+    ------------
+    modifies the session "matches"
+    """
+    by_pk = {m.pk: _match_entry(m) for m in matches}
+    session_matches = [by_pk.pop(entry[0], entry)
+                       for entry in session.get("matches") or []]
+    session["matches"] = session_matches + list(by_pk.values())
+    check_size(session)
+
+
+def remove_match_by_pk(session: SessionBase, pk: "PrimaryKey") -> None:
     """remove a match from this session by it's primarry key
 
     Parameters
     ----------
+    session : SessionBase
+        request.session
     pk : the primary key of the match
 
-    Uses
-    ----
-    session : Django session
-        the current session got from session store
-
     Side Effects
     ------------
-    removes the match from this session
+    removes the match from this session, and deletes it from the
+    tournament's saved games, see create_match
+    """
+    session["matches"] = _without_match(session.get("matches"), pk)
+    database.delete_tournament_match(get_tournament_pk(session), pk)
+
+
+def _without_match(old_matches: list[list], pk: "PrimaryKey") -> list[list]:
+    """the session match entries without the match with primary key pk
+
+    Raises
+    ------
+    RuntimeError if no match has primary key pk
     """
-    old_matches = get_matches()
     logger.debug("removing match with pk: %s\n all matches: %s",
                  pk, old_matches)
     match_found = False
     new_matches = []
     # check all the matches in order appending them if match.pk != pk
-    for m in old_matches:
-        if m.pk == pk:
+    for m in old_matches or []:
+        if m[0] == pk:
             logger.debug("found match for removal")
             match_found = True
         else:
@@ -257,23 +401,24 @@ def remove_match_by_pk(pk: "PrimaryKey") -> None:
 
     if match_found is False:
         raise RuntimeError(
-            "Could not find match %s in session matches %s", m, get_matches()
+            f"Could not find match {pk} in session matches {old_matches}"
         )
     logger.debug("match with pk %s removed. matches now %s", pk, new_matches)
-    session["matches"] = new_matches
+    return new_matches
 
-def get_rounds() -> "Queryset":
+
+def get_rounds(session: SessionBase) -> "Queryset":
     """Get the rounds from this session
 
-    Uses
-    ----
-    session : Django session
-        the current session got from session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
 
     """
 
 
-def finalize_round() -> None:
+def finalize_round(session: SessionBase) -> None:
     """Save this round, and prepair to add another one
 
     side-effects
@@ -283,69 +428,81 @@ def finalize_round() -> None:
     - reset matches in round to None
     """
 
-    round_number = get_tournament_round_number()
-    matches = get_matches()
+    round_number = get_tournament_round_number(session)
+    matches = session.get("matches")
 
     logger.debug(
         "session.finalize_round() entered. Finalizing rnd: %s, matches: %s",
         round_number,
         matches,
     )
-    rnd = Round(round_num=round_number, )
+    rnd = Round(round_num=round_number,
+                tournament_id=session.get("Tournament"))
     # save round
     rnd.save()
     logger.debug("Tournament round %s made and saved. round: %s", round_number, rnd)
 
     logger.debug("round made and saved. round: %s", rnd)
     # prepare for next round
-    set_tournament_round_number(round_number + 1)
+    set_tournament_round_number(session, round_number + 1)
     # reset the matches
-    session["matches"] = None
+    session["matches"] = []
 
     logger.debug("session prepaired for round %s", round_number)
 
-#def get_tournament() -> Tournament:
-    #"""get the tournament worked on in this session
-#
-    #Uses
-    #----
-    #session : A Django session
-        #the session got from the session store
-#
-    #Returns
-    #-------
-    #models.Tournament being worked on in this session.
-    #"""
-#
-    #key = get_tournament_name()
-#
-    #return get_object_or_404(Tournament, pk=key)
-#
+def get_tournament(session: SessionBase) -> Tournament:
+    """get the tournament worked on in this session
+
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
+
+    Returns
+    -------
+    models.Tournament being worked on in this session.
 
+    Raises
+    ------
+    Http404 if the session has no tournament, or it was deleted
+    """
+    return get_object_or_404(Tournament, pk=session.get("Tournament"))
 
 
-def get_tournament_info() -> "TournamentInfo":
+def get_tournament_pk(session: SessionBase) -> int | None:
+    """the primary key of the tournament worked on in this session, None
+    if there is none. No query, unlike get_tournament
+    """
+    return session.get("Tournament")
+
+
+def set_tournament(session: SessionBase, t: Tournament) -> None:
+    """start building a saved tournament in this session, its fields are
+    kept in the session so pages show them without a query
+
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
+    """
+    session["Tournament"] = t.pk
+    set_tournament_info(session, database.get_report_info(t))
+
+
+
+def get_tournament_info(session: SessionBase) -> "TournamentInfo":
     """get the TournamentInfo from this session
 
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
 
     Returns
     -------
     "TournamentInfo"
-        or {"name": self.name,
-            "num_rounds": self.num_rounds,
-            "date": str(self.date),
-            "pairing_system": str(self.pairing_system),
-            "province": str(self.province),
-            # TournamentOrganizer CFC id
-            "to_cfc": str(self.to_cfc),
-            # TournamentDirector CFC id
-            "td_cfc": str(self.td_cfc),
-        }
-        from tournament info form
+        {field: value} of TOURNAMENT_INFO_FIELDS, see
+        normalize_tournament_info
     """
     logger.debug("session keys: %s", session.keys())
 
@@ -356,13 +513,13 @@ def get_tournament_info() -> "TournamentInfo":
     return get
 
 
-def get_tournament_name() -> str:
+def get_tournament_name(session: SessionBase) -> str:
     """get the name of the tournament we are building
 
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
     Returns
     -------
     str : the tournament name
@@ -378,13 +535,13 @@ def get_tournament_name() -> str:
     return tournament_name
 
 
-def get_tournament_round_number() -> int:
+def get_tournament_round_number(session: SessionBase) -> int:
     """get the number of the tournament round we are building from this session
 
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
     Returns
     -------
     int : the round number
@@ -398,36 +555,33 @@ def get_tournament_round_number() -> int:
     return int(get)
 
 
-def set_tournament_round_number(rnd: int) -> None:
+def set_tournament_round_number(session: SessionBase, rnd: int) -> None:
     """set the tournament round we are building from this session
 
     Parameters
     ----------
+    session : SessionBase
+        request.session
     rnd : int
         the round number to set the round we are building to
-
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
     """
     logger.debug("session keys: %s", session.keys())
 
     session["TournamentRound"] = rnd
 
 
-def is_last_round() -> bool:
+def is_last_round(session: SessionBase) -> bool:
     """Check to see if this is the last round of the tourniment we are building
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
     """
-    cur_round = get_tournament_round_number()
+    cur_round = get_tournament_round_number(session)
 
     logger.debug("is_last_round entered on round %s", round)
 
-    info = get_tournament_info()
+    info = get_tournament_info(session)
 
     # check if number of rounds < cur_round.
     lr = int(info["num_rounds"]) < cur_round
@@ -436,31 +590,144 @@ def is_last_round() -> bool:
     return lr
 
 
-def set_tournament_info(info: "TournamentInfo") -> None:
+def set_tournament_info(session: SessionBase,
+                        info: "TournamentInfo") -> None:
     """set the tournament info for this session
 
     Parameters
     ----------
-    info : "TournamentInfo"
-        or {"name": self.name,
-            "num_rounds": self.num_rounds,
-            "date": str(self.date),
-            "pairing_system": str(self.pairing_system),
-            "province": str(self.province),
-            # TournamentOrganizer CFC id
-            "to_cfc": str(self.to_cfc),
-            # TournamentDirector CFC id
-            "td_cfc": str(self.td_cfc),
-
-        from tournament info from form
-
-    Uses
-    ----
-    session : A Django session
-        the session got from the session store
+    session : SessionBase
+        request.session
+    info : dict
+        the tournament fields, ie: database.get_report_info, only they
+        are kept, see normalize_tournament_info
+
+    Raises
+    ------
+    ValueError if a tournament field is missing or not of its type
     """
+    info = normalize_tournament_info(info)
     logger.debug("session key TournamentInfo set to %s", info)
     session["TournamentInfo"] = info
 
     # start building at round 1
     session["TournamentRound"] = 1
+    check_size(session)
+
+
+def add_job(session: SessionBase, job: "Job") -> None:
+    """remember a job queued in this session, see started_job
+
+    Parameters
+    ----------
+    session : SessionBase
+        request.session
+    """
+    session["jobs"] = (session.get("jobs", []) + [job.pk])[-KEPT_JOBS:]
+
+
+def started_job(session: SessionBase, pk: "PrimaryKey") -> bool:
+    """if this session queued job pk, and so may download its file"""
+    return pk in session.get("jobs", ())
+
+
+#  === async variants, used by the async htmx views ===
+
+
+async def aget_player_ids(session: SessionBase) -> list[int]:
+    """async get_player_ids
+
+    Returns
+    -------
+    list(int)
+        the cfc id's in session, in the order they were added
+    """
+    session_players = [int(cfc_id) for cfc_id in
+                       await session.aget("players_by_cfc") or {}]
+
+    logger.debug("session players id's gotten: %s", session_players)
+    return session_players
+
+
+async def aget_tournament_pk(session: SessionBase) -> int | None:
+    """async get_tournament_pk"""
+    return await session.aget("Tournament")
+
+
+async def aget_players(session: SessionBase) -> list[Player]:
+    """async get_players, fetches every session player in one query
+
+    Returns
+    -------
+    players : list(Player)
+        A list of the players in session, in session order
+    """
+    session_ids = await aget_player_ids(session)
+    players = await database.aget_players_by_cfc(session_ids)
+
+    logger.debug("Players in session: %s", players)
+    return players
+
+
+async def ahas_player(session: SessionBase, cfc_id: "CfcId") -> bool:
+    """async has_player"""
+    return str(int(cfc_id)) in (await session.aget("players_by_cfc") or {})
+
+
+async def aadd_player_by_id(session: SessionBase, cfc_id: "CfcId") -> bool:
+    """async add_player_by_id
+
+    Returns
+    -------
+    bool : False if the player was in the session already
+    """
+    roster = await session.aget("players_by_cfc") or {}
+    key = str(int(cfc_id))
+    if key in roster:
+        return False
+    await session.aset("players_by_cfc", {**roster, key: None})
+    check_size(session)
+    return True
+
+
+async def aremove_player_by_id(session: SessionBase,
+                               cfc_id: "CfcId") -> bool:
+    """async remove_player_by_id
+
+    Returns
+    -------
+    bool : False if the player was not in the session
+    """
+    roster = await session.aget("players_by_cfc") or {}
+    key = str(int(cfc_id))
+    if key not in roster:
+        return False
+    roster = {k: None for k in roster if k != key}
+    await session.aset("players_by_cfc", roster)
+
+    logger.debug("removed %s, session_players now %s", cfc_id, roster)
+    return True
+
+
+async def aget_matches(session: SessionBase) -> list[list]:
+    """async get of the session match entries
+
+    Returns
+    -------
+    list([pk, round, white cfc id, black cfc id, result])
+    """
+    return await session.aget("matches")
+
+
+async def aremove_match_by_pk(session: SessionBase,
+                              pk: "PrimaryKey") -> None:
+    """async remove_match_by_pk
+
+    Parameters
+    ----------
+    pk : the primary key of the match
+    """
+    matches = await aget_matches(session)
+    await session.aset("matches", _without_match(matches, pk))
+    await database.adelete_tournament_match(
+        await aget_tournament_pk(session), pk)
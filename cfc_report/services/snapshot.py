@@ -0,0 +1,240 @@
+"""tournament rosters as dense player indexes and array columns"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+from cfc_report import logger
+from cfc_report.models import Match, Player, Tournament
+from cfc_report.services import database
+from cfc_report.services.results import GAME_POINTS, OVER_THE_BOARD
+
+# A snapshot numbers the players of a tournament 0..N-1 and keeps each of
+# their values, and each game, in a flat array. Computations index arrays
+# instead of looking up Player objects by cfc id, and a snapshot of 500
+# players and 5000 games is a few hundred kB. The arrays support the
+# buffer protocol, so numpy.frombuffer can share them without a copy.
+
+# snapshots kept, the least recently used is dropped
+CACHE_SIZE = 32
+
+# colour history, one byte per player per round
+WHITE = ord("w")
+BLACK = ord("b")
+NO_COLOUR = ord("-")
+
+
+class RosterSnapshot:
+    """The players and games of a tournament at one version.
+
+    The roster players are 0..size-1, highest rating first, so an index is
+    also the starting rank. A player met in a game but not on the roster is
+    numbered after them.
+
+    Attributes
+    ----------
+    tournament, version, num_rounds : int
+        the tournament, and its version the snapshot was built from
+    size : int
+        players on the roster
+    cfc_ids, ratings : array("l")
+        by player index
+    names : list(str)
+        by player index
+    index : dict{cfc id: int}
+        player index of a cfc id
+    rounds, whites, blacks : array("l")
+        round and player indexes of each game, black -1 for a bye
+    results : bytes
+        Match.result code of each game
+    scores : array("d"), played : array("l")
+        points and games with a result, by player index
+    colours : bytearray
+        WHITE, BLACK or NO_COLOUR of each player in each round, see
+        colour_history
+    """
+
+    def __init__(self, tournament: int, version: int, num_rounds: int,
+                 players: Iterable[tuple], games: Iterable[tuple]):
+        """
+        Parameters
+        ----------
+        players : (cfc id, name, rating) of the roster
+        games : (round number, white cfc id, black cfc id, result),
+            black None for a bye
+        """
+        self.tournament = tournament
+        self.version = version
+        self.num_rounds = num_rounds
+        self.cfc_ids = array("l")
+        self.ratings = array("l")
+        self.names: list[str] = []
+        self.index: dict[int, int] = {}
+        for cfc_id, name, rating in sorted(players,
+                                           key=lambda p: (-p[2], p[0])):
+            self._add_player(cfc_id, name, rating)
+        self.size = len(self.cfc_ids)
+
+        self.rounds = array("l")
+        self.whites = array("l")
+        self.blacks = array("l")
+        codes = bytearray()
+        for round_number, white, black, result in games:
+            self.rounds.append(round_number)
+            self.whites.append(self._player(white))
+            self.blacks.append(-1 if black is None else self._player(black))
+            codes += result.encode()
+        self.results = bytes(codes)
+        self._score()
+
+    def _add_player(self, cfc_id: int, name: str, rating: int) -> int:
+        """number a player"""
+        self.index[cfc_id] = len(self.cfc_ids)
+        self.cfc_ids.append(cfc_id)
+        self.names.append(name)
+        self.ratings.append(rating or 0)
+        return self.index[cfc_id]
+
+    def _player(self, cfc_id: int) -> int:
+        """the index of a player in a game, numbered if not on the roster"""
+        i = self.index.get(cfc_id)
+        return i if i is not None else self._add_player(cfc_id, "", 0)
+
+    def _score(self) -> None:
+        """points, games and colours of every player, in one pass"""
+        n = len(self.cfc_ids)
+        self.scores = array("d", bytes(8 * n))
+        self.played = array("l", [0]) * n
+        self.colours = bytearray([NO_COLOUR]) * (n * self.num_rounds)
+        for g in range(len(self.rounds)):
+            points = GAME_POINTS.get(chr(self.results[g]))
+            white, black = self.whites[g], self.blacks[g]
+            if points is not None:
+                self.scores[white] += points[0]
+                self.played[white] += 1
+                if black >= 0:
+                    self.scores[black] += points[1]
+                    self.played[black] += 1
+            r = self.rounds[g] - 1
+            if 0 <= r < self.num_rounds and black >= 0:
+                self.colours[white * self.num_rounds + r] = WHITE
+                self.colours[black * self.num_rounds + r] = BLACK
+
+    def __len__(self) -> int:
+        return len(self.cfc_ids)
+
+    def colour_history(self, i: int) -> str:
+        """the colours of player i by round, ie: "wb-w", - without a game"""
+        start = i * self.num_rounds
+        return self.colours[start:start + self.num_rounds].decode()
+
+    def buchholz(self) -> array:
+        """by player index, the sum of the scores of the opponents met over
+        the board"""
+        totals = array("d", bytes(8 * len(self.cfc_ids)))
+        over_the_board = {ord(code) for code in OVER_THE_BOARD}
+        for g in range(len(self.rounds)):
+            black = self.blacks[g]
+            if black >= 0 and self.results[g] in over_the_board:
+                white = self.whites[g]
+                totals[white] += self.scores[black]
+                totals[black] += self.scores[white]
+        return totals
+
+    def ranking(self, buchholz: array = None) -> list[int]:
+        """roster player indexes, best score first, then by Buchholz, then
+        by starting rank"""
+        buchholz = buchholz or self.buchholz()
+        return sorted(range(self.size),
+                      key=lambda i: (-self.scores[i], -buchholz[i], i))
+
+    def roster(self) -> dict:
+        """dict{cfc id: (name, rating)} of the roster, for the writers"""
+        return {self.cfc_ids[i]: (self.names[i], self.ratings[i])
+                for i in range(self.size)}
+
+    def games(self) -> Iterator[tuple]:
+        """(round number, white cfc id, black cfc id, result) of each game,
+        black None for a bye, in round order"""
+        cfc_ids = self.cfc_ids
+        for g in range(len(self.rounds)):
+            black = self.blacks[g]
+            yield (self.rounds[g], cfc_ids[self.whites[g]],
+                   None if black < 0 else cfc_ids[black],
+                   chr(self.results[g]))
+
+
+def build_snapshot(t: Tournament) -> RosterSnapshot:
+    """the snapshot of a tournament, from one query for its roster and one
+    for its games"""
+    players = ([] if t.roster_id is None else
+               Player.objects.filter(rosters=t.roster_id)
+               .values_list("cfc_id", "name", "rating"))
+    snapshot = RosterSnapshot(t.pk, t.version, t.num_rounds, players,
+                              database.iter_tournament_games(t))
+    logger.debug("snapshot of %s built: %s players, %s games", t.name,
+                 len(snapshot), len(snapshot.rounds))
+    return snapshot
+
+
+_cache: OrderedDict[int, RosterSnapshot] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_snapshot(t: Tournament) -> RosterSnapshot:
+    """The snapshot of a tournament at t.version, built if it is not cached.
+    Load t in the request that uses the snapshot, so its version is fresh.
+    """
+    with _cache_lock:
+        snapshot = _cache.get(t.pk)
+        if snapshot is not None and snapshot.version == t.version:
+            _cache.move_to_end(t.pk)
+            return snapshot
+
+    snapshot = build_snapshot(t)
+    with _cache_lock:
+        _cache[t.pk] = snapshot
+        _cache.move_to_end(t.pk)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return snapshot
+
+
+def player_saved(sender, instance: Player, created: bool, **kwargs) -> None:
+    """post_save receiver for Player, connected in CfcReportConfig.ready"""
+    if not created:
+        database.touch_player_tournaments([instance.pk])
+
+
+def match_saved(sender, instance: Match, **kwargs) -> None:
+    """post_save receiver for Match, connected in CfcReportConfig.ready"""
+    database.touch_tournaments([instance.tournament_id])
+
+
+def roster_changed(sender, instance, action: str, reverse: bool, pk_set,
+                   **kwargs) -> None:
+    """m2m_changed receiver for Roster.players, connected in
+    CfcReportConfig.ready"""
+    if not action.startswith("post_"):
+        return
+    # a reverse change is made from a player, pk_set then holds rosters
+    roster_ids = (pk_set or []) if reverse else [instance.pk]
+    database.touch_tournaments(
+        Tournament.objects.filter(roster__in=roster_ids)
+        .values_list("pk", flat=True).union(
+            Tournament.objects.filter(sections__roster__in=roster_ids)
+            .values_list("pk", flat=True)))
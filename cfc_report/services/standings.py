@@ -0,0 +1,71 @@
+"""standings for a CFC rated tournament"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from cfc_report import logger
+from cfc_report.models import Player
+from cfc_report.services.results import OVER_THE_BOARD, game_points
+
+
+def compute_standings(players: list[Player], results: list[tuple]) -> list[dict]:
+    """compute the standings of a tournament
+
+    Parameters
+    ----------
+    players : list(Player)
+        the tournament players
+    results : list(tuple)
+        (white cfc id, black cfc id, result) for every match played.
+        black is None for a bye or withdrawal, which scores by its result.
+        Matches without a result yet are not counted.
+
+    Returns
+    -------
+    list(dict)
+        one {"rank", "player", "points", "played"} per player,
+        best score first, then by Buchholz: the sum of the scores of
+        the opponents met over the board, so byes and forfeits add none
+    """
+    points = {p.cfc_id: 0.0 for p in players}
+    played = {p.cfc_id: 0 for p in players}
+    opponents: dict["CfcId", list] = {p.cfc_id: [] for p in players}
+
+    for white, black, result in results:
+        match_points = game_points(result)
+        if match_points is None:
+            continue
+        for cfc_id, p in zip((white, black), match_points):
+            if cfc_id in points:
+                points[cfc_id] += p
+                played[cfc_id] += 1
+        if result in OVER_THE_BOARD and white in points and black in points:
+            opponents[white].append(black)
+            opponents[black].append(white)
+
+    buchholz = {cfc_id: sum(points[o] for o in met)
+                for cfc_id, met in opponents.items()}
+    ordered = sorted(players, key=lambda p: (-points[p.cfc_id],
+                                             -buchholz[p.cfc_id], p.name))
+    standings = [
+        {
+            "rank": rank,
+            "player": p,
+            "points": points[p.cfc_id],
+            "played": played[p.cfc_id],
+        }
+        for rank, p in enumerate(ordered, start=1)
+    ]
+
+    logger.debug("standings computed: %s", standings)
+    return standings
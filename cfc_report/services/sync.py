@@ -0,0 +1,154 @@
+"""apply batches of results entered offline by the result queue"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import uuid
+
+from django.db import transaction
+
+from cfc_report import logger
+from cfc_report.models import Match, Player
+from cfc_report.services import database
+from cfc_report.services.results import BYES
+
+# result codes a queued result may carry
+RESULT_CODES = {code for code, _ in Match.RESULT_CHOICES}
+
+
+class ResultSyncException(Exception):
+    """A batch of results could not be read"""
+    pass
+
+
+def apply_results(batch: list[dict], tournament_id: int = None) -> dict:
+    """Apply a batch of queued results in one transaction.
+
+    Every result carries a client generated id and a version. A result
+    whose id is new creates a match, one whose id is known updates the match
+    only if its version is higher (last write wins), so sending the same
+    batch twice changes nothing.
+
+    Parameters
+    ----------
+    batch : list(dict)
+        {"client_id", "version", "white", "black", "result", "round_number"}
+        white and black are cfc ids, result a Match result code,
+        black is None for a bye
+    tournament_id : int
+        pk of the tournament the results are for, the created matches
+        are in it
+
+    Returns
+    -------
+    dict
+        "applied": client ids created or updated,
+        "stale": client ids already stored at the same or a newer version,
+        "errors": {client id: message} of results that were not applied,
+        "matches": the created or updated Match objects
+
+    Raises
+    ------
+    ResultSyncException if batch is not a list of results
+    """
+    if not isinstance(batch, list):
+        raise ResultSyncException("a batch must be a list of results")
+
+    # the newest version of each result in the batch
+    incoming: dict[uuid.UUID, dict] = {}
+    errors: dict[str, str] = {}
+    for item in batch:
+        try:
+            result = _read_result(item)
+        except (KeyError, TypeError, ValueError) as err:
+            client_id = item.get("client_id") if isinstance(item, dict) else None
+            errors[str(client_id)] = f"bad result: {err}"
+            continue
+        known = incoming.get(result["client_id"])
+        if known is None or result["version"] > known["version"]:
+            incoming[result["client_id"]] = result
+
+    applied, stale, matches = [], [], []
+    with transaction.atomic():
+        existing = Match.objects.select_for_update().in_bulk(
+            list(incoming), field_name="client_id")
+
+        cfc_ids = {r["white"] for r in incoming.values()}
+        cfc_ids |= {r["black"] for r in incoming.values()
+                    if r["black"] is not None}
+        players = {p.cfc_id: p
+                   for p in Player.objects.filter(cfc_id__in=cfc_ids)}
+
+        to_create, to_update = [], []
+        for client_id, result in incoming.items():
+            match = existing.get(client_id)
+            if match is not None and match.version >= result["version"]:
+                stale.append(str(client_id))
+                continue
+
+            try:
+                white = players[result["white"]]
+                black = (None if result["black"] is None
+                         else players[result["black"]])
+            except KeyError as err:
+                errors[str(client_id)] = f"unknown player {err}"
+                continue
+
+            if match is None:
+                match = Match(client_id=client_id,
+                              tournament_id=tournament_id)
+                to_create.append(match)
+            else:
+                to_update.append(match)
+            match.white = white
+            match.black = black
+            match.result = result["result"]
+            match.round_number = result["round_number"]
+            match.version = result["version"]
+            applied.append(str(client_id))
+            matches.append(match)
+
+        Match.objects.bulk_create(to_create)
+        Match.objects.bulk_update(
+            to_update, ["white", "black", "result", "round_number", "version"])
+        database.touch_tournaments(m.tournament_id for m in matches)
+
+    logger.info("result batch synced: %s applied, %s stale, %s errors",
+                len(applied), len(stale), len(errors))
+    return {"applied": applied, "stale": stale, "errors": errors,
+            "matches": matches}
+
+
+def _read_result(item: dict) -> dict:
+    """check and type one queued result
+
+    Raises
+    ------
+    KeyError, TypeError or ValueError if the result is malformed
+    """
+    result = item["result"]
+    if result not in RESULT_CODES:
+        raise ValueError(f"unknown result code {result!r}")
+
+    black = item.get("black")
+    if (black in (None, "")) != (result in BYES):
+        raise ValueError(f"result {result!r} for black {black!r}")
+
+    return {
+        "client_id": uuid.UUID(str(item["client_id"])),
+        "version": int(item["version"]),
+        "white": int(item["white"]),
+        "black": None if result in BYES else int(black),
+        "result": result,
+        "round_number": int(item["round_number"]),
+    }
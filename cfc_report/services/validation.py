@@ -0,0 +1,136 @@
+"""check a tournament report before it is written"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from collections import defaultdict
+from typing import Iterable
+
+from cfc_report import logger
+from cfc_report.services.results import BYES, CODES
+
+# a game: (round number, white cfc id, black cfc id, Match.result)
+# black is None for a bye or withdrawal
+
+# Match.result of a game without a result
+NO_RESULT = {"_", "", None}
+
+
+class ReportError:
+    """A problem with a report, that the CFC would reject it for
+
+    Attributes
+    ----------
+    code : str
+        kind of problem, one of ReportError.CODES
+    message : str
+        description for the TD
+    round_number : int or None
+        the round the problem is in
+    cfc_ids : tuple(CfcId)
+        the players involved
+    """
+
+    CODES = {
+        "double_booked": "player in more than one game in a round",
+        "not_on_roster": "game against a player not in the tournament",
+        "self_paired": "player paired against themselves",
+        "no_result": "game without a result",
+        "bad_result": "game with a result no report can encode",
+        "bad_bye": "bye with an opponent, or game without one",
+        "unpaired": "player missing from a round",
+    }
+
+    def __init__(self, code: str, message: str, round_number: int = None,
+                 cfc_ids: tuple = ()):
+        self.code = code
+        self.message = message
+        self.round_number = round_number
+        self.cfc_ids = tuple(cfc_ids)
+
+    def __str__(self):
+        where = f"round {self.round_number}: " if self.round_number else ""
+        return f"{where}{self.message}"
+
+    def __repr__(self):
+        return f"ReportError({self.code!r}, {str(self)!r})"
+
+
+def validate_games(roster: Iterable["CfcId"],
+                   games: Iterable[tuple]) -> list[ReportError]:
+    """Check a tournament's games in one pass, with set lookups,
+    so it runs in O(games + roster * rounds)
+
+    Parameters
+    ----------
+    roster : the cfc ids of the tournament players
+    games : (round number, white cfc id, black cfc id, result) per game
+
+    Returns
+    -------
+    list(ReportError) empty if the report is good
+    """
+    roster = {int(cfc_id) for cfc_id in roster}
+    errors: list[ReportError] = []
+    # round number -> cfc ids that played in it
+    played: dict[int, set] = defaultdict(set)
+
+    for round_number, white, black, result in games:
+        pairing = f"{white} - {'bye' if black is None else black}"
+        in_round = played[round_number]
+
+        if white == black:
+            errors.append(ReportError(
+                "self_paired", f"{white} is paired against themselves",
+                round_number, (white,)))
+        for cfc_id in {white, black} - {None}:
+            if cfc_id not in roster:
+                errors.append(ReportError(
+                    "not_on_roster",
+                    f"{cfc_id} in game {pairing} is not in the tournament",
+                    round_number, (cfc_id,)))
+            if cfc_id in in_round:
+                errors.append(ReportError(
+                    "double_booked",
+                    f"{cfc_id} is in more than one game",
+                    round_number, (cfc_id,)))
+            in_round.add(cfc_id)
+
+        if result in NO_RESULT:
+            errors.append(ReportError(
+                "no_result", f"game {pairing} has no result",
+                round_number, (white, black)))
+        elif result not in CODES:
+            errors.append(ReportError(
+                "bad_result", f"game {pairing} has unknown result {result!r}",
+                round_number, (white, black)))
+        elif (black is None) != (result in BYES):
+            errors.append(ReportError(
+                "bad_bye", f"game {pairing} has result {result!r}",
+                round_number, (white, black)))
+
+    for round_number in sorted(played):
+        for cfc_id in sorted(roster - played[round_number]):
+            errors.append(ReportError(
+                "unpaired", f"{cfc_id} has no game", round_number,
+                (cfc_id,)))
+
+    logger.debug("report validated, %s errors: %s", len(errors), errors)
+    return errors
+
+
+def match_games(matches: Iterable["Match"]) -> list[tuple]:
+    """the games of Match objects, with their players loaded"""
+    return [(m.round_number, m.white.cfc_id,
+             None if m.is_bye else m.black.cfc_id, m.result)
+            for m in matches]
@@ -0,0 +1,358 @@
+"""streaming report writers: CTR, FIDE TRF-16 and PGN"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import tempfile
+import zipfile
+from typing import Iterable, Iterator
+
+from django.utils.text import slugify
+
+from cfc_report import logger
+from cfc_report.services import results
+from cfc_report.services.validation import validate_games
+
+# a game as read by database.iter_tournament_games:
+#   (round number, white cfc id, black cfc id, Match.result)
+#   black is None for a bye or withdrawal
+# players: {cfc id: (name, rating)}
+# info: the Tournament fields, see database.get_report_info
+# section: {"section": name, "info", "players", "games"} of one section,
+#   see sections.get_sections_data
+
+# bytes of a spooled report kept in memory before it spills to disk
+SPOOL_SIZE = 1024 * 1024
+
+
+def report_name(info: dict) -> str:
+    """file name, without extension, for the reports of a tournament"""
+    return f"{slugify(info['name'])}-{info['date']}"
+
+
+class ReportWriter:
+    """A report format, written in one pass over a tournament's games.
+
+    Each method returns the text it adds to the report, so the caller
+    decides where it goes: a file, a zip member, a response.
+
+    Attributes
+    ----------
+    extension : str
+        file extension of the format
+    info : dict
+        the tournament fields
+    players : dict{cfc id: (name, rating)}
+        the tournament roster
+    """
+
+    extension = ""
+
+    def __init__(self, info: dict, players: dict):
+        self.info = info
+        self.players = players
+
+    def filename(self) -> str:
+        """file name of this report"""
+        return f"{report_name(self.info)}.{self.extension}"
+
+    def header(self) -> Iterable[str]:
+        """text before the games"""
+        return ()
+
+    def game(self, round_number: int, white: int, black: int,
+             result: str) -> Iterable[str]:
+        """text for one game"""
+        return ()
+
+    def footer(self) -> Iterable[str]:
+        """text after the games"""
+        return ()
+
+
+class CTRWriter(ReportWriter):
+    """CFC tournament report: a header line, then three lines per player
+    per game, written as the games come.
+    """
+
+    extension = "ctr"
+
+    def header(self):
+        info = self.info
+        pairing = "S" if info["pairing_system"] == "SW" else "R"
+        yield (f'"{info["name"]}","{info["province"]}","0","{pairing}",'
+               f'"{info["date"]}","{len(self.players)}",'
+               f'"{info["td_cfc"]}","{info["to_cfc"]}"\n')
+
+    def game(self, round_number, white, black, result):
+        if result not in results.CODES:
+            # an unplayed game is not a loss, leave it out of the report
+            logger.warning("CTR %s: round %s game %s - %s has no result %r",
+                           self.info["name"], round_number, white, black,
+                           result)
+            return
+        for cfc_id, colour in results.sides(white, black):
+            letter, points = results.ctr_result(result, colour)
+            yield f'"{cfc_id}"\n"{letter}","0"\n"{points}"\n'
+
+
+class TRFWriter(ReportWriter):
+    """FIDE TRF-16. Player lines hold every round, so only a compact
+    (opponent, colour, result) per player per round is kept until footer().
+    """
+
+    extension = "trf"
+
+    def __init__(self, info, players):
+        super().__init__(info, players)
+        # start ranks, by rating then name
+        ordered = sorted(players, key=lambda p: (-(players[p][1] or 0),
+                                                 players[p][0]))
+        self.ranks = {cfc_id: n for n, cfc_id in enumerate(ordered, start=1)}
+        self.rounds = {cfc_id: {} for cfc_id in players}
+        self.points = dict.fromkeys(players, 0.0)
+
+    def header(self):
+        info = self.info
+        yield f"012 {info['name']}\n"
+        yield f"022 {info['province']}\n"
+        yield f"042 {info['date'].strftime('%Y/%m/%d')}\n"
+        yield f"062 {len(self.players)}\n"
+        system = "Swiss-System" if info["pairing_system"] == "SW" else "Round Robin"
+        yield f"092 Individual: {system}\n"
+
+    def game(self, round_number, white, black, result):
+        if (result not in results.CODES or white not in self.ranks
+                or (black is not None and black not in self.ranks)):
+            return ()
+        if black is None:
+            # a bye: no opponent and no colour
+            _, trf, points = results.encode(result, results.WHITE)
+            self.rounds[white][round_number] = (0, "-", trf)
+            self.points[white] += points
+            return ()
+        for cfc_id, colour, opponent in ((white, results.WHITE, black),
+                                         (black, results.BLACK, white)):
+            _, trf, points = results.encode(result, colour)
+            self.rounds[cfc_id][round_number] = (self.ranks[opponent], colour,
+                                                 trf)
+            self.points[cfc_id] += points
+        return ()
+
+    def footer(self):
+        num_rounds = self.info["num_rounds"]
+        by_score = sorted(self.players, key=lambda p: (-self.points[p],
+                                                       self.ranks[p]))
+        place = {cfc_id: n for n, cfc_id in enumerate(by_score, start=1)}
+
+        yield f"XXR {num_rounds}\n"
+        for cfc_id in sorted(self.players, key=self.ranks.get):
+            name, rating = self.players[cfc_id]
+            # the FIDE id column is left empty, a cfc id is not one
+            line = (f"001 {self.ranks[cfc_id]:4d}      {name[:33]:<33} "
+                    f"{rating or 0:4d}     {'':>11} {'':10} "
+                    f"{self.points[cfc_id]:4.1f} {place[cfc_id]:4d}")
+            for rnd in range(1, num_rounds + 1):
+                entry = self.rounds[cfc_id].get(rnd)
+                if entry is None:
+                    # no game entered: left blank, "-" is a forfeit loss
+                    line += " " * 10
+                    continue
+                opponent, colour, result = entry
+                # a bye's opponent is 0000
+                line += f"  {opponent:4d} {colour} {result}" if opponent \
+                    else f"  0000 {colour} {result}"
+            yield line.rstrip() + "\n"
+
+
+class PGNWriter(ReportWriter):
+    """PGN result stub: the tag pairs and result of each game, no moves"""
+
+    extension = "pgn"
+
+    def game(self, round_number, white, black, result):
+        if black is None:
+            # a bye is not a game
+            return
+        info = self.info
+        white_name, white_rating = self.players.get(white, (str(white), 0))
+        black_name, black_rating = self.players.get(black, (str(black), 0))
+        pgn_result = results.PGN_RESULTS.get(result, "*")
+        yield (f'[Event "{info["name"]}"]\n'
+               f'[Site "{info["province"]}"]\n'
+               f'[Date "{info["date"].strftime("%Y.%m.%d")}"]\n'
+               f'[Round "{round_number}"]\n'
+               f'[White "{white_name}"]\n'
+               f'[Black "{black_name}"]\n'
+               f'[Result "{pgn_result}"]\n'
+               f'[WhiteElo "{white_rating or 0}"]\n'
+               f'[BlackElo "{black_rating or 0}"]\n'
+               f'\n{pgn_result}\n\n')
+
+
+WRITERS = {
+    "ctr": CTRWriter,
+    "trf": TRFWriter,
+    "pgn": PGNWriter,
+}
+
+
+def render(info: dict, players: dict, games: Iterable[tuple],
+           formats: Iterable[str] = WRITERS) -> Iterator[tuple[ReportWriter, str]]:
+    """Render every format in one pass over games
+
+    Yields
+    ------
+    (writer, text) in the order the text is produced
+    """
+    writers = [WRITERS[f](info, players) for f in formats]
+
+    for writer in writers:
+        for text in writer.header():
+            yield writer, text
+    for game in games:
+        for writer in writers:
+            for text in writer.game(*game):
+                yield writer, text
+    for writer in writers:
+        for text in writer.footer():
+            yield writer, text
+
+
+def write_files(directory: str, info: dict, players: dict,
+                games: Iterable[tuple],
+                formats: Iterable[str] = WRITERS) -> list[str]:
+    """Write every format to directory in one pass over games. All the
+    files are open at once and filled as the text is rendered.
+
+    Returns
+    -------
+    list(str) : paths of the written files
+    """
+    files = {}
+    try:
+        for writer, text in render(info, players, games, formats):
+            if writer not in files:
+                path = os.path.join(directory, writer.filename())
+                files[writer] = open(path, "w", encoding="utf-8")
+            files[writer].write(text)
+    finally:
+        for f in files.values():
+            f.close()
+
+    paths = [f.name for f in files.values()]
+    logger.info("reports written: %s", paths)
+    return paths
+
+
+def render_reports(info: dict, players: dict, games: Iterable[tuple],
+                   formats: Iterable[str] = WRITERS) -> list[tuple[str, bytes]]:
+    """Render every format in one pass over games, in memory
+
+    Returns
+    -------
+    list((file name, content)) one per format
+    """
+    texts = {}
+    for writer, text in render(info, players, games, formats):
+        texts.setdefault(writer, []).append(text)
+    return [(w.filename(), "".join(t).encode()) for w, t in texts.items()]
+
+
+def report_section(section: dict) -> dict:
+    """Validate a section and render its CTR. Touches no database, so the
+    sections of a tournament are reported in parallel by a process pool.
+
+    Returns
+    -------
+    dict
+        "section": its name, "filename": of its CTR,
+        "ctr": the CTR text, None if the section has errors,
+        "errors": list(ReportError)
+    """
+    info, players, games = section["info"], section["players"], section["games"]
+    writer = CTRWriter(info, players)
+    errors = validate_games(players, games)
+
+    ctr = None
+    if not errors:
+        ctr = "".join(text for _, text in render(info, players, games,
+                                                 ["ctr"]))
+    logger.info("section %s reported, %s errors", info["name"], len(errors))
+    return {"section": section["section"], "filename": writer.filename(),
+            "ctr": ctr, "errors": errors}
+
+
+class _ZipStream:
+    """write-only file object that hands back what was written to it"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_stream(members: Iterable[tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    """Stream a zip archive of members as it is built
+
+    Parameters
+    ----------
+    members : (file name, chunks of content) per archive member
+
+    Yields
+    ------
+    bytes of the archive
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in members:
+            with zf.open(name, "w") as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
+
+
+def zip_reports(info: dict, players: dict, games: Iterable[tuple],
+                formats: Iterable[str] = WRITERS) -> Iterator[bytes]:
+    """Stream a zip of every format, rendered in one pass over games.
+
+    Zip members can not be interleaved, so each format is spooled while
+    the games are read, in memory up to SPOOL_SIZE and on disk past it.
+    """
+    spools = {}
+    for writer, text in render(info, players, games, formats):
+        if writer not in spools:
+            spools[writer] = tempfile.SpooledTemporaryFile(
+                max_size=SPOOL_SIZE, mode="w+b")
+        spools[writer].write(text.encode())
+
+    def chunks(spool):
+        spool.seek(0)
+        while chunk := spool.read(64 * 1024):
+            yield chunk
+        spool.close()
+
+    yield from zip_stream((w.filename(), chunks(s)) for w, s in spools.items())
@@ -14,6 +14,1374 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.test import TestCase
+import asyncio
+import datetime
+import functools
+import io
+import itertools
+import json
+import os
+import pstats
+import tempfile
+import uuid
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, models
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import (AsyncClient, Client, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+
+from cfc_report.forms import TournamentInfoForm
+from cfc_report.middleware import ProfileMiddleware
+from cfc_report.management.commands.load_test import (percentiles,
+                                                      retryable, round_robin)
+from cfc_report.models import (ApiToken, Job, Match, Player, Roster, Round,
+                               Tournament)
+from cfc_report.services import (api, jobs, profiling, results, search,
+                                 session, sync)
+from cfc_report.services.dedupe import (blocking_keys, find_duplicates,
+                                        merge_players, similarity, skeleton)
+from cfc_report.services import importer
+from cfc_report.services.importer import save_report
+from cfc_report.services.parsers import (ReportImportException, parse_file,
+                                         read_ctr, read_trf)
+from cfc_report.services.search import TrigramIndex, normalize
+from cfc_report.services.snapshot import RosterSnapshot
+from cfc_report.services.ctr import CTR, CtrCreationException
+from cfc_report.services.standings import compute_standings
+from cfc_report.services.validation import validate_games
+from cfc_report.services.writers import (CTRWriter, TRFWriter, render,
+                                         report_section)
+
+
+class ResultEncodingTests(SimpleTestCase):
+    """every (result code, colour) pair, against the CFC and FIDE codes"""
+
+    # (code, colour): (CTR letter, TRF result, points), written out by hand
+    EXPECTED = {
+        ("w", "w"): ("W", "1", 1.0),
+        ("w", "b"): ("L", "0", 0.0),
+        ("b", "w"): ("L", "0", 0.0),
+        ("b", "b"): ("W", "1", 1.0),
+        ("d", "w"): ("D", "=", 0.5),
+        ("d", "b"): ("D", "=", 0.5),
+        ("+", "w"): ("+", "+", 1.0),
+        ("+", "b"): ("-", "-", 0.0),
+        ("-", "w"): ("-", "-", 0.0),
+        ("-", "b"): ("+", "+", 1.0),
+        ("B", "w"): ("B", "F", 1.0),
+        ("H", "w"): ("H", "H", 0.5),
+        ("U", "w"): ("U", "Z", 0.0),
+    }
+
+    def test_every_code_and_colour(self):
+        codes = {code for code, _ in Match.RESULT_CHOICES} | results.BYES
+        codes |= {"", "x", "W", "1", None}
+        for code, colour in itertools.product(codes, ("w", "b", "x")):
+            with self.subTest(code=code, colour=colour):
+                expected = self.EXPECTED.get((code, colour))
+                if expected is None:
+                    with self.assertRaises(results.ResultCodeException):
+                        results.encode(code, colour)
+                else:
+                    self.assertEqual(results.encode(code, colour), expected)
+                    self.assertEqual(results.ctr_result(code, colour),
+                                     (expected[0], expected[2]))
+
+    def test_games_share_one_point(self):
+        for code in results.CODES - results.BYES:
+            with self.subTest(code=code):
+                self.assertEqual(sum(results.game_points(code)), 1.0)
+        for code in results.BYES:
+            with self.subTest(code=code):
+                self.assertIsNone(results.game_points(code)[1])
+        self.assertIsNone(results.game_points("_"))
+
+    def test_every_choice_is_encoded(self):
+        for code, display in Match.RESULT_CHOICES:
+            with self.subTest(code=code):
+                if code == results.NOT_PLAYED:
+                    self.assertNotIn(code, results.CODES)
+                    continue
+                self.assertIn(code, results.CODES)
+                self.assertEqual(results.from_entry(display), code)
+                self.assertEqual(results.from_entry(code), code)
+
+    def test_unknown_entry(self):
+        for value in ("", "_", "1-0", "white"):
+            with self.subTest(value=value):
+                with self.assertRaises(results.ResultCodeException):
+                    results.from_entry(value)
+
+    def test_report_letters_read_back(self):
+        for code in results.CODES:
+            letter, trf, _ = results.encode(code, results.WHITE)
+            self.assertEqual(results.FROM_CTR[letter], code)
+            self.assertEqual(results.FROM_TRF[trf], code)
+
+
+class ResultReportTests(SimpleTestCase):
+    """the formats and standings encode through the result table"""
+
+    INFO = {"name": "Open", "province": "ON", "pairing_system": "SW",
+            "date": datetime.date(2024, 5, 1), "num_rounds": 1,
+            "td_cfc": 1, "to_cfc": 2}
+    PLAYERS = {100: ("Ann", 1500), 200: ("Bob", 1400)}
+
+    def ctr_games(self, result):
+        writer = CTRWriter(self.INFO, self.PLAYERS)
+        return "".join(writer.game(1, 100, 200, result))
+
+    def test_ctr_writer(self):
+        self.assertEqual(self.ctr_games("b"),
+                         '"100"\n"L","0"\n"0.0"\n"200"\n"W","0"\n"1.0"\n')
+        self.assertEqual(self.ctr_games("d"),
+                         '"100"\n"D","0"\n"0.5"\n"200"\n"D","0"\n"0.5"\n')
+        self.assertEqual(self.ctr_games("-"),
+                         '"100"\n"-","0"\n"0.0"\n"200"\n"+","0"\n"1.0"\n')
+
+    def test_ctr_writer_leaves_out_unplayed_games(self):
+        with self.assertLogs("CFC_REPORT", "WARNING"):
+            self.assertEqual(self.ctr_games("_"), "")
+
+    def test_trf_writer_forfeit(self):
+        writer = TRFWriter(self.INFO, self.PLAYERS)
+        writer.game(1, 100, 200, "+")
+        self.assertEqual(writer.rounds[100][1], (2, "w", "+"))
+        self.assertEqual(writer.rounds[200][1], (1, "b", "-"))
+        self.assertEqual(writer.points, {100: 1.0, 200: 0.0})
+
+    def test_ctr_match_report(self):
+        white = Player(cfc_id=100, name="Ann")
+        black = Player(cfc_id=200, name="Bob")
+        for code in results.CODES - results.BYES:
+            match = Match(white=white, black=black, result=code,
+                          round_number=1)
+            for player, colour in ((white, "w"), (black, "b")):
+                with self.subTest(code=code, colour=colour):
+                    letter, points = results.ctr_result(code, colour)
+                    report = CTR.make_match_report(None, match, player)
+                    self.assertEqual(report, [f'"{player.cfc_id}"',
+                                              f'"{letter}","0"',
+                                              f'"{points}"'])
+
+    def test_standings(self):
+        players = [Player(cfc_id=100, name="Ann"),
+                   Player(cfc_id=200, name="Bob")]
+        standings = compute_standings(
+            players, [(100, 200, "w"), (200, 100, "-"), (100, 200, "_")])
+        self.assertEqual([(row["player"].cfc_id, row["points"], row["played"])
+                          for row in standings],
+                         [(100, 2.0, 2), (200, 0.0, 2)])
+
+    def test_validation_flags_unknown_codes(self):
+        errors = validate_games([100, 200], [(1, 100, 200, "x")])
+        self.assertEqual([e.code for e in errors], ["bad_result"])
+        self.assertFalse(validate_games([100, 200], [(1, 100, 200, "+")]))
+
+
+class ByeTests(SimpleTestCase):
+    """byes and withdrawals are matches without a black player"""
+
+    INFO = {"name": "Open", "province": "ON", "pairing_system": "SW",
+            "date": datetime.date(2024, 5, 1), "num_rounds": 2,
+            "td_cfc": 1, "to_cfc": 2}
+    PLAYERS = {100: ("Ann", 1500), 200: ("Bob", 1400), 300: ("Cy", 1300)}
+    # an odd field: someone sits out every round
+    GAMES = [
+        (1, 100, 200, "w"),
+        (1, 300, None, "B"),
+        (2, 300, 100, "d"),
+        (2, 200, None, "U"),
+    ]
+
+    def test_validation(self):
+        self.assertEqual(validate_games(self.PLAYERS, self.GAMES), [])
+        errors = validate_games(self.PLAYERS, [
+            (1, 100, 200, "H"), (1, 300, None, "w")])
+        self.assertEqual([e.code for e in errors], ["bad_bye", "bad_bye"])
+
+    def test_standings(self):
+        players = [Player(cfc_id=cfc_id, name=name)
+                   for cfc_id, (name, _) in self.PLAYERS.items()]
+        standings = compute_standings(
+            players, [game[1:] for game in self.GAMES])
+        self.assertEqual([(row["player"].cfc_id, row["points"], row["played"])
+                          for row in standings],
+                         [(100, 1.5, 2), (300, 1.5, 2), (200, 0.0, 2)])
+
+    def test_buchholz_breaks_ties(self):
+        players = [Player(cfc_id=cfc_id, name=name)
+                   for cfc_id, (name, _) in self.PLAYERS.items()]
+        # everyone has a point: Bob met two opponents, Ann and Cy one,
+        # Cy's bye adds nothing
+        standings = compute_standings(players, [
+            (200, 100, "b"), (300, None, "B"), (200, 300, "w")])
+        self.assertEqual([(row["player"].cfc_id, row["points"])
+                          for row in standings],
+                         [(200, 1.0), (100, 1.0), (300, 1.0)])
+
+    def test_ctr_round_trip(self):
+        ctr = "".join(text for writer, text in render(
+            self.INFO, self.PLAYERS, self.GAMES, ["ctr"]))
+        self.assertIn('"300"\n"B","0"\n"1.0"\n"300"\n"D"', ctr)
+        games = [row[1:] for row in read_ctr(ctr.splitlines(True))
+                 if row[0] == "game"]
+        self.assertEqual(games, self.GAMES)
+
+    def test_trf_round_trip(self):
+        trf = "".join(text for writer, text in render(
+            self.INFO, self.PLAYERS, self.GAMES, ["trf"]))
+        rows = list(read_trf(trf.splitlines(True)))
+        # a TRF has no cfc ids: players are by start rank, without a FIDE id
+        by_name = {name: cfc_id for cfc_id, (name, _) in self.PLAYERS.items()}
+        cfc_ids = {row[1]: by_name[row[2]] for row in rows
+                   if row[0] == "player"}
+        self.assertEqual({row[4] for row in rows if row[0] == "player"},
+                         {None})
+        games = [(number, cfc_ids[white], cfc_ids.get(black), result)
+                 for number, white, black, result in
+                 (row[1:] for row in rows if row[0] == "game")]
+        self.assertEqual(sorted(games, key=lambda g: (g[0], g[1])),
+                         sorted(self.GAMES, key=lambda g: (g[0], g[1])))
+
+    def test_trf_missing_round(self):
+        # Bob's round 2 bye not entered yet
+        trf = "".join(text for writer, text in render(
+            self.INFO, self.PLAYERS, self.GAMES[:3], ["trf"]))
+        lines = {line[14:47].strip(): line for line in trf.splitlines()
+                 if line.startswith("001")}
+        self.assertTrue(lines["Bob"].endswith("     1 b 0"), lines["Bob"])
+        self.assertTrue(lines["Cy"].endswith("  0000 - F     1 w ="),
+                        lines["Cy"])
+        games = [row[1:] for row in read_trf(trf.splitlines(True))
+                 if row[0] == "game"]
+        self.assertEqual(len(games), 3)
+        self.assertNotIn(2, [number for number, white, black, _ in games
+                             if black is None])
+
+    def test_pgn(self):
+        pgn = "".join(text for writer, text in render(
+            self.INFO, self.PLAYERS, self.GAMES, ["pgn"]))
+        # byes are not games
+        self.assertEqual(pgn.count("[Event "), 2)
+        self.assertIn('[Round "2"]\n[White "Cy"]\n[Black "Ann"]\n'
+                      '[Result "1/2-1/2"]\n[WhiteElo "1300"]\n'
+                      '[BlackElo "1500"]\n\n1/2-1/2\n\n', pgn)
+        self.assertIn('[Date "2024.05.01"]', pgn)
+
+    def test_trf_fide_id(self):
+        def line(rank, name, rating, fide_id, opponent, colour, result):
+            return (f"001 {rank:4d}      {name:<33} {rating:4d}     "
+                    f"{fide_id:>11} {'':10} {0.0:4.1f} {rank:4d}"
+                    f"  {opponent:4d} {colour} {result}\n")
+
+        rows = list(read_trf([
+            "012 Open\n", "042 2024/05/01\n",
+            line(1, "Smith, John", 1850, "2012345", 2, "w", "1"),
+            line(2, "Jones, Ann", 1700, "", 1, "b", "0")]))
+        self.assertEqual(rows[1], ("player", 1, "Smith, John", 1850,
+                                   2012345))
+        self.assertEqual(rows[2], ("player", 2, "Jones, Ann", 1700, None))
+        self.assertEqual(rows[3:], [("game", 1, 1, 2, "w")])
+
+    def test_ctr_match_report(self):
+        white = Player(cfc_id=100, name="Ann")
+        match = Match(white=white, black=None, result="H", round_number=1)
+        self.assertTrue(match.is_bye)
+        self.assertEqual(CTR.make_match_report(None, match, white),
+                         ['"100"', '"H","0"', '"0.5"'])
+
+
+class SectionReportTests(SimpleTestCase):
+    """each section is validated and reported on its own"""
+
+    INFO = {"name": "Open U1800", "province": "ON", "pairing_system": "RR",
+            "date": datetime.date(2024, 5, 1), "num_rounds": 1,
+            "td_cfc": 1, "to_cfc": 2}
+    PLAYERS = {100: ("Ann", 1500), 200: ("Bob", 1400)}
+
+    def test_good_section(self):
+        report = report_section({"section": "U1800", "info": self.INFO,
+                                 "players": self.PLAYERS,
+                                 "games": [(1, 100, 200, "d")]})
+        self.assertEqual(report["errors"], [])
+        self.assertEqual(report["filename"], "open-u1800-2024-05-01.ctr")
+        self.assertTrue(report["ctr"].startswith('"Open U1800","ON","0","R"'))
+
+    def test_section_with_errors(self):
+        report = report_section({"section": "U1800", "info": self.INFO,
+                                 "players": self.PLAYERS,
+                                 "games": [(1, 100, 300, "d")]})
+        self.assertIsNone(report["ctr"])
+        self.assertEqual({e.code for e in report["errors"]},
+                         {"not_on_roster", "unpaired"})
+
+
+class TrigramIndexTests(SimpleTestCase):
+    """prefix, misspelled and accented names, ranked"""
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        for cfc_id, name in [(100001, "Jonathan Smith"),
+                             (100002, "John Smyth"),
+                             (100003, "Joan Smithers"),
+                             (100004, "Hélène Côté"),
+                             (100005, "Bob Jones")]:
+            self.index.add(cfc_id, name)
+
+    def test_normalize(self):
+        self.assertEqual(normalize("  Hélène   CÔTÉ-Roy "), "helene cote roy")
+
+    def test_prefix(self):
+        self.assertEqual(self.index.search("jon smi")[0], 100001)
+        self.assertEqual(self.index.search("smith")[:2], [100001, 100003])
+
+    def test_misspelled(self):
+        self.assertEqual(self.index.search("jonathon smiht")[0], 100001)
+        self.assertEqual(self.index.search("john smith")[:2],
+                         [100002, 100001])
+
+    def test_accents(self):
+        self.assertEqual(self.index.search("helene cote"), [100004])
+
+    def test_rename_and_remove(self):
+        self.index.add(100005, "Robert Jones")
+        self.assertEqual(self.index.search("robert"), [100005])
+        self.assertNotIn(100005, self.index.search("bob"))
+        self.index.remove(100005)
+        self.assertEqual(self.index.search("robert"), [])
+
+
+class DedupeKeyTests(SimpleTestCase):
+    """blocking keys put likely duplicates together, similarity tells them
+    apart"""
+
+    def test_skeleton(self):
+        self.assertEqual(skeleton("smith"), skeleton("smyth"))
+        self.assertEqual(skeleton("smith"), skeleton("smitth"))
+        self.assertEqual(skeleton(""), "")
+
+    def test_blocking_keys(self):
+        a = blocking_keys(100001, normalize("Jonathan Smith"))
+        self.assertIn("name:jonathan smith", a)
+        self.assertIn("name:jonathan smith",
+                      blocking_keys(100002, normalize("Smith, Jonathan")))
+        self.assertTrue(set(a) & set(blocking_keys(100003, "john smyth")))
+        self.assertFalse(set(a) & set(blocking_keys(100004, "bob jones")))
+
+    def test_similarity(self):
+        self.assertEqual(similarity("smith jonathan", "jonathan smith"), 1.0)
+        self.assertGreater(similarity("jonathan smith", "jonathon smith"),
+                           0.85)
+        self.assertLess(similarity("jonathan smith", "joan smithers"), 0.85)
+
+
+class JobTests(SimpleTestCase):
+    """job states and progress, and the kinds of job the worker runs"""
+
+    def test_percent(self):
+        self.assertEqual(Job(progress=3, total=4).percent, 75)
+        self.assertEqual(Job(progress=3, total=0).percent, 0)
+
+    def test_finished(self):
+        self.assertFalse(Job(status=Job.RUNNING).is_finished)
+        self.assertTrue(Job(status=Job.CANCELLED).is_finished)
+
+    def test_kinds(self):
+        self.assertLessEqual({"finalize_report", "finalize_tournament",
+                              "bulk_export", "import_reports"},
+                             set(jobs.HANDLERS))
+        with self.assertRaises(ValueError):
+            jobs.enqueue("no_such_job")
+
+    def test_failed_errors(self):
+        err = jobs.JobFailedException("2 errors", [1, "bad bye"])
+        self.assertEqual(err.errors, ["1", "bad bye"])
+
+
+class AdminTests(SimpleTestCase):
+    """change lists that stay a fixed number of queries however long"""
+
+    def test_related_columns_joined(self):
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label != "cfc_report":
+                continue
+            related = {f.name for f in model._meta.get_fields()
+                       if isinstance(f, models.ForeignKey)}
+            columns = {c.split("__")[0] for c in model_admin.list_display
+                       if isinstance(c, str)}
+            with self.subTest(model=model.__name__):
+                self.assertFalse(model_admin.show_full_result_count)
+                self.assertLessEqual(related & columns,
+                                     set(model_admin.list_select_related
+                                         or ()))
+
+    def test_player_fields_searched(self):
+        for model, model_admin in admin.site._registry.items():
+            for name in (model_admin.autocomplete_fields
+                         if model._meta.app_label == "cfc_report" else ()):
+                target = model._meta.get_field(name).related_model
+                with self.subTest(model=model.__name__, field=name):
+                    self.assertTrue(admin.site._registry[target].search_fields)
+
+
+class TournamentInfoFormTests(SimpleTestCase):
+    """posted tournament info is validated and typed once"""
+
+    POSTED = {"csrfmiddlewaretoken": "x", "name": "Test Open",
+              "num_rounds": "5", "date_year": "2024", "date_month": "6",
+              "date_day": "1", "pairing_system": "SW", "province": "ON",
+              "to_cfc": "100001", "td_cfc": "100002"}
+
+    def test_typed(self):
+        form = TournamentInfoForm(self.POSTED)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data, {
+            "name": "Test Open", "num_rounds": 5,
+            "date": datetime.date(2024, 6, 1), "pairing_system": "SW",
+            "province": "ON", "to_cfc": 100001, "td_cfc": 100002})
+
+    def test_invalid(self):
+        for field, value in (("num_rounds", "0"), ("td_cfc", "000000"),
+                             ("date_month", "13"), ("province", "XX")):
+            with self.subTest(field=field):
+                form = TournamentInfoForm({**self.POSTED, field: value})
+                self.assertFalse(form.is_valid())
+
+
+class SessionPayloadTests(SimpleTestCase):
+    """the session holds plain data, and does not grow with the rounds"""
+
+    # TournamentInfoForm.cleaned_data, and something that is not a field
+    CLEANED = {"name": "Test Open", "num_rounds": 8,
+               "date": datetime.date(2024, 6, 1), "pairing_system": "SW",
+               "province": "ON", "to_cfc": 100001, "td_cfc": 100002,
+               "version": 3}
+
+    def setUp(self):
+        self.session = SessionStore()
+
+    def test_tournament_info(self):
+        session.set_tournament_info(self.session, self.CLEANED)
+        self.assertEqual(session.get_tournament_info(self.session), {
+            "name": "Test Open", "num_rounds": 8, "date": "2024-06-01",
+            "pairing_system": "SW", "province": "ON", "to_cfc": 100001,
+            "td_cfc": 100002})
+        with self.assertRaises(ValueError):
+            session.set_tournament_info(self.session,
+                                        {**self.CLEANED, "num_rounds": "x"})
+
+    def test_bounded_per_round(self):
+        players = [Player(cfc_id=100000 + n) for n in range(60)]
+        session.set_tournament_info(self.session, self.CLEANED)
+        session.update_players(self.session, players)
+        sizes = []
+        with mock.patch.object(session.Round, "save"):
+            for round_number in range(1, 9):
+                session.add_matches(self.session, [
+                    Match(pk=100 * round_number + n, white=w, black=b,
+                          result="d", round_number=round_number)
+                    for n, (w, b) in enumerate(zip(players[::2],
+                                                   players[1::2]))])
+                self.assertEqual(len(session.get_games(self.session)), 30)
+                sizes.append(session.check_size(self.session))
+                session.finalize_round(self.session)
+        self.assertLessEqual(max(sizes) - min(sizes), 8)
+
+    def test_roster_is_an_ordered_set(self):
+        self.assertTrue(session.add_player_by_id(self.session, "100002"))
+        self.assertTrue(self.session.modified)
+        self.assertTrue(session.add_player_by_id(self.session, 100001))
+        self.assertFalse(session.add_player_by_id(self.session, 100002))
+        self.assertEqual(session.get_player_ids(self.session),
+                         [100002, 100001])
+        self.assertTrue(session.has_player(self.session, "100001"))
+        self.assertTrue(session.remove_player_by_id(self.session, 100002))
+        self.assertFalse(session.remove_player_by_id(self.session, 100002))
+        self.assertEqual(session.get_player_ids(self.session), [100001])
+
+    async def test_async_roster(self):
+        other = SessionStore()
+        self.assertEqual(await asyncio.gather(
+            session.aadd_player_by_id(self.session, "100002"),
+            session.aadd_player_by_id(other, 100001),
+            session.aadd_player_by_id(self.session, 100001)),
+            [True, True, True])
+        self.assertFalse(
+            await session.aadd_player_by_id(self.session, 100002))
+        self.assertTrue(self.session.modified)
+        self.assertEqual(await session.aget_player_ids(self.session),
+                         [100002, 100001])
+        self.assertEqual(await session.aget_player_ids(other), [100001])
+        self.assertTrue(
+            await session.aremove_player_by_id(self.session, 100002))
+        self.assertFalse(await session.ahas_player(self.session, 100002))
+        self.assertEqual(await session.aget_player_ids(other), [100001])
+
+    def test_unchanged_rows(self):
+        player = Player(name="Ann", cfc_id=100001)
+        html = render_to_string(
+            "cfc_report/create/partials/toggle-player.html",
+            {"player": player, "selected": True, "changed": False,
+             "selected_ids": {100001}})
+        self.assertIn('id="dbp-100001"', html)
+        self.assertIn("/create/roster/100001/remove", html)
+        self.assertNotIn("hx-swap-oob", html)
+
+    def test_encoding(self):
+        small = {"TournamentRound": 3}
+        self.assertEqual(session.encode(small), b'{"TournamentRound":3}')
+        big = {"players_by_cfc": list(range(100000, 101000))}
+        data = session.encode(big)
+        self.assertTrue(data.startswith(session.COMPRESSED))
+        self.assertLess(len(data), len(str(big)) // 2)
+        self.assertEqual(session.decode(data), big)
+
+
+class TdSessionTests(TestCase):
+    """each TD builds their tournament in their own session"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Player.objects.bulk_create(
+            Player(name=name, cfc_id=cfc_id,
+                   slug=Player.make_slug(name, cfc_id))
+            for name, cfc_id in (("Ann", 100100), ("Bob", 100200)))
+
+    def test_rosters_apart(self):
+        ann, bob = Client(), Client()
+        for client, cfc_id in ((ann, 100100), (bob, 100200)):
+            response = client.post(
+                reverse("create-toggle-player", args=[str(cfc_id)]))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.get_player_ids(ann.session), [100100])
+        self.assertEqual(session.get_player_ids(bob.session), [100200])
+        self.assertNotEqual(ann.session.session_key, bob.session.session_key)
+
+    def test_saved_compact(self):
+        self.client.post(reverse("create-toggle-player", args=["100100"]))
+        stored = Session.objects.get(
+            pk=self.client.session.session_key).session_data
+        self.assertEqual(signing.loads(
+            stored, salt="django.contrib.sessions.SessionStore",
+            serializer=session.CompactSerializer),
+            {"players_by_cfc": {"100100": None}})
+
+
+class LoadTestTests(SimpleTestCase):
+    """the pairings and statistics of the load_test command"""
+
+    def test_round_robin(self):
+        players = list(range(100000, 100008))
+        pairs = set()
+        for number in range(1, len(players)):
+            games = round_robin(players, number)
+            seen = [cfc_id for game in games for cfc_id in game]
+            self.assertCountEqual(seen, players)
+            pairs |= {frozenset(game) for game in games}
+        self.assertEqual(len(pairs), 8 * 7 // 2)
+
+    def test_percentiles(self):
+        p50, p95, p99 = percentiles([n / 1000 for n in range(1, 101)])
+        self.assertAlmostEqual(p50, 0.0505)
+        self.assertLess(p95, p99)
+        self.assertEqual(percentiles([0.2]), (0.2, 0.2, 0.2))
+
+    def test_retryable(self):
+        for response, error, retry in (
+                (None, "locked", True),
+                (None, "OperationalError: disk I/O error", True),
+                (HttpResponse(status=503), "503", True),
+                (HttpResponse(status=400), "400", False),
+                (HttpResponse(status=409), "409", False)):
+            with self.subTest(error=error):
+                self.assertIs(retryable(response, error), retry)
+
+
+class ApiTests(SimpleTestCase):
+    """field selection, cursors, ETags and bulk write bodies"""
+
+    def test_select_fields(self):
+        self.assertEqual(api.select_fields(None, api.MATCH_FIELDS),
+                         api.MATCH_FIELDS)
+        self.assertEqual(api.select_fields("result, id", api.MATCH_FIELDS),
+                         {"result": "result", "id": "pk"})
+        with self.assertRaises(api.ApiException):
+            api.select_fields("id,password", api.MATCH_FIELDS)
+
+    def test_cursor(self):
+        self.assertEqual(api.decode_cursor(api.encode_cursor(1234)), 1234)
+        for bad in ("zzz", "cGs6eA==", ""):
+            with self.assertRaises(api.ApiException):
+                api.decode_cursor(bad)
+
+    def test_etag(self):
+        body = api.render({"results": [{"id": 1, "result": "w"}]})
+        self.assertEqual(api.etag(body), api.etag(body))
+        self.assertNotEqual(
+            api.etag(body),
+            api.etag(api.render({"results": [{"id": 1, "result": "d"}]})))
+
+    def test_bulk_items(self):
+        with self.assertRaises(api.ApiException):
+            api.create_tournaments({"name": "not an array"})
+        with self.assertRaises(api.ApiException) as err:
+            api.update_tournaments([{"id": 1}, {"name": "x"}, 7,
+                                    {"id": "1"}])
+        self.assertEqual(set(err.exception.errors), {1, 2, 3})
+
+
+class RosterSnapshotTests(SimpleTestCase):
+    """dense indexes, scores, colours and ranking from arrays"""
+
+    def setUp(self):
+        players = [(100001, "Low", 1200), (100002, "High", 2000),
+                   (100003, "Mid", 1600)]
+        games = [(1, 100002, 100001, "w"), (1, 100003, None, "H"),
+                 (2, 100001, 100003, "d"), (2, 100002, 100009, "+")]
+        self.snap = RosterSnapshot(1, 4, 2, players, games)
+
+    def test_indexes(self):
+        # the roster by rating, then a player only met in a game
+        self.assertEqual(list(self.snap.cfc_ids),
+                         [100002, 100003, 100001, 100009])
+        self.assertEqual(self.snap.size, 3)
+        self.assertEqual(self.snap.index[100001], 2)
+        self.assertEqual(list(self.snap.blacks), [2, -1, 1, 3])
+
+    def test_scores_and_colours(self):
+        self.assertEqual(list(self.snap.scores), [2.0, 1.0, 0.5, 0.0])
+        self.assertEqual(list(self.snap.played), [2, 2, 2, 1])
+        self.assertEqual(self.snap.colour_history(0), "ww")
+        self.assertEqual(self.snap.colour_history(1), "-b")
+        self.assertEqual(self.snap.colour_history(2), "bw")
+
+    def test_ranking(self):
+        # the forfeit is not over the board, so adds no Buchholz
+        self.assertEqual(list(self.snap.buchholz()), [0.5, 0.5, 3.0, 0.0])
+        self.assertEqual(self.snap.ranking(), [0, 1, 2])
+
+    def test_report_data(self):
+        self.assertEqual(self.snap.roster(), {100002: ("High", 2000),
+                                              100003: ("Mid", 1600),
+                                              100001: ("Low", 1200)})
+        self.assertEqual(list(self.snap.games())[1], (1, 100003, None, "H"))
+
+
+class DedupeMergeTests(TestCase):
+    """only players with the same cfc id are merged"""
+
+    def players(self, *people):
+        return Player.objects.bulk_create(
+            Player(name=name, cfc_id=cfc_id,
+                   slug=Player.make_slug(name, f"{cfc_id}-{n}"))
+            for n, (name, cfc_id) in enumerate(people))
+
+    def test_alike_names_with_other_ids_are_reviewed(self):
+        john, jon, smyth = self.players(("John Smith", 123456),
+                                        ("Jon Smith", 123456),
+                                        ("John Smyth", 223456))
+        roster = Roster.objects.create()
+        roster.players.set([jon, smyth])
+        Match.objects.create(round_number=1, white=jon, black=smyth,
+                             result="d")
+
+        found = find_duplicates()
+        self.assertEqual([[p["pk"] for p in group]
+                          for group in found["duplicates"]],
+                         [[john.pk, jon.pk]])
+        self.assertIn(smyth.pk, {p["pk"] for pair in found["candidates"]
+                                 for p in pair})
+
+        stats = merge_players(found["duplicates"])
+        self.assertEqual((stats["merged"], stats["skipped"]), (1, []))
+        self.assertCountEqual(Player.objects.values_list("pk", flat=True),
+                              [jon.pk, smyth.pk])
+        match = Match.objects.get()
+        self.assertEqual((match.white_id, match.black_id),
+                         (jon.pk, smyth.pk))
+        self.assertCountEqual(roster.players.all(), [jon, smyth])
+
+    def test_groups_never_merged(self):
+        ann, anne, bob, rob = self.players(
+            ("Ann Lee", 100100), ("Anne Lee", 100100),
+            ("Bob Ray", 100200), ("Rob Ray", 100300))
+        # merged, Ann would play herself
+        Match.objects.create(round_number=1, white=ann, black=anne,
+                             result="w")
+        with self.assertLogs("CFC_REPORT", "WARNING"):
+            stats = merge_players([[{"pk": ann.pk}, {"pk": anne.pk}],
+                                   [{"pk": bob.pk}, {"pk": rob.pk}]])
+        self.assertEqual(stats["merged"], 0)
+        self.assertEqual(stats["skipped"], [[ann.pk, anne.pk],
+                                            [bob.pk, rob.pk]])
+        self.assertEqual(Player.objects.count(), 4)
+
+
+class CtrTournamentTests(TestCase):
+    """a CTR reports the games of its own tournament"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.players = Player.objects.bulk_create(
+            Player(name=name, cfc_id=cfc_id,
+                   slug=Player.make_slug(name, cfc_id))
+            for name, cfc_id in (("Ann", 100100), ("Bob", 100200)))
+        cls.tournaments = [
+            Tournament.objects.create(
+                name="Club Night", num_rounds=1, pairing_system="RR",
+                date=datetime.date(2024, month, 1), province="ON",
+                to_cfc=100100, td_cfc=100100)
+            for month in (5, 6)]
+        white, black = cls.players
+        Match.objects.bulk_create(
+            Match(tournament=t, round_number=1, white=white, black=black,
+                  result=result)
+            for t, result in zip(cls.tournaments, ("w", "d")))
+
+    def test_same_players_in_two_tournaments(self):
+        for t, letter in zip(self.tournaments, ("W", "D")):
+            with self.subTest(date=t.date):
+                ctr = CTR(t, [100100, 100200])
+                self.assertEqual(ctr.errors, [])
+                self.assertEqual(ctr.ctr[1:], [
+                    '"100100"', f'"{letter}","0"',
+                    f'"{1.0 if letter == "W" else 0.5}"', '"100200"',
+                    f'"{"L" if letter == "W" else "D"}","0"',
+                    f'"{0.0 if letter == "W" else 0.5}"'])
+
+    def test_rejected(self):
+        t = self.tournaments[0]
+        white, black = self.players
+        Match.objects.create(tournament=t, round_number=2, white=black,
+                             black=white, result="_")
+        with self.assertRaises(CtrCreationException) as caught:
+            CTR(t, [100100, 100200])
+        self.assertEqual([e.code for e in caught.exception.errors],
+                         ["no_result"])
+
+    def test_synced_results_in_tournament(self):
+        later = self.tournaments[1]
+        synced = sync.apply_results([{
+            "client_id": str(uuid.uuid4()), "version": 1, "white": 100200,
+            "black": 100100, "result": "b", "round_number": 1}], later.pk)
+        self.assertEqual(synced["matches"][0].tournament_id, later.pk)
+        self.assertEqual(later.matches.count(), 2)
+
+    def test_finalize_report_job(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        later = self.tournaments[1]
+        job = Job.objects.create(kind="finalize_report", params={
+            "tournament": later.pk, "player_ids": [100100, 100200]})
+        with override_settings(JOBS_DIR=directory.name):
+            jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE, job.message)
+        with open(job.output, encoding="utf-8") as ctr:
+            self.assertIn('"D","0"', ctr.read())
+
+    def test_removed_game_left_out(self):
+        later = self.tournaments[1]
+        td_session = self.client.session
+        session.set_tournament(td_session, later)
+        session.update_players(td_session, self.players)
+        removed = session.create_match(td_session, 100200, 100100, "b")
+        td_session.save()
+        self.assertEqual(later.matches.count(), 2)
+
+        response = self.client.post(reverse("select-match-round",
+                                            args=[removed.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Match.objects.filter(pk=removed.pk).exists())
+        self.assertGreater(Tournament.objects.get(pk=later.pk).version,
+                           later.version)
+        standings = self.client.get(reverse("live-standings"))
+        self.assertEqual(standings.context["standings"], compute_standings(
+            self.players, [(100100, 100200, "d")]))
+        self.assertEqual(len(CTR(later, [100100, 100200]).ctr), 7)
+
+
+class PlayerFtsTests(TestCase):
+    """the FTS5 player index is made by migrate, not by a search"""
+
+    def setUp(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("FTS5 is SQLite only")
+        self.addCleanup(setattr, search, "_fts_ready", search._fts_ready)
+        search._fts_ready = None
+
+    def test_made_by_migrate(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertTrue(search.fts_available())
+        self.assertFalse([q for q in captured if "CREATE" in q["sql"]])
+
+    def test_kept_by_triggers(self):
+        player = Player.objects.create(name="Zebulon Quist", cfc_id=100900)
+        self.assertEqual(search._fts_search("zebu qui", 5), [player])
+        player.name = "Zara Quist"
+        player.save()
+        self.assertEqual(search._fts_search("zebu", 5), [])
+        self.assertEqual(search._fts_search("zar", 5), [player])
+
+
+class LiveReportTests(TestCase):
+    """the live page of a tournament shows its own players and games"""
+
+    @classmethod
+    def setUpTestData(cls):
+        players = Player.objects.bulk_create(
+            Player(name=name, cfc_id=cfc_id,
+                   slug=Player.make_slug(name, cfc_id))
+            for name, cfc_id in (("Ann", 100100), ("Bob", 100200),
+                                 ("Cyd", 100300)))
+        cls.tournaments = [
+            Tournament.objects.create(
+                name="Club Night", num_rounds=1, pairing_system="RR",
+                date=datetime.date(2024, month, 1), province="ON",
+                to_cfc=100100, td_cfc=100100)
+            for month in (5, 6)]
+        Match.objects.bulk_create([
+            Match(tournament=cls.tournaments[0], round_number=1,
+                  white=players[0], black=players[1], result="w"),
+            Match(tournament=cls.tournaments[1], round_number=1,
+                  white=players[2], black=players[0], result="b")])
+
+    def test_players_of_each_tournament(self):
+        for t, shown, hidden in zip(self.tournaments, ("Bob", "Cyd"),
+                                    ("Cyd", "Bob")):
+            with self.subTest(date=t.date):
+                response = self.client.get(
+                    reverse("live-report", args=[t.pk]))
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, shown)
+                self.assertNotContains(response, hidden)
+                self.assertContains(
+                    response, reverse("live-stream", args=[t.pk]))
+
+    def test_unknown_tournament(self):
+        response = self.client.get(reverse("live-report", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryCountTests(TestCase):
+    """Every URL of the app runs as many queries for a big tournament as
+    for a small one, so a query per player or per match fails here.
+    Runs as a staff user, with a job output and a saved profile to
+    download, so every request gets as far as its expected status.
+    """
+
+    # (players, rounds) of the tournaments compared
+    SIZES = ((4, 2), (16, 6))
+
+    # (url name, method, url args, data, status) of each request, args and
+    # data are functions of the tournament fixture
+    CASES = [
+        ("index", "get", None, None, 200),
+        ("create-report-info", "get", None, None, 200),
+        ("create-report-info", "post", None, lambda fx: {
+            "name": fx.t.name, "num_rounds": fx.t.num_rounds,
+            "date_year": 2024, "date_month": 6, "date_day": 1,
+            "pairing_system": "SW", "province": "ON", "to_cfc": 100001,
+            "td_cfc": 100001}, 302),
+        ("create-report-players", "get", None, None, 200),
+        ("create-report", "get", None, None, 200),
+        ("create-report-round", "get", None, None, 200),
+        ("create-report-match", "get", None, None, 200),
+        ("create-report-match", "post", None, lambda fx: {
+            "white": fx.ids[0], "black": fx.ids[1], "result": "1 - 0"}, 200),
+        ("create-report-sync", "post", None, lambda fx: {"results": [{
+            "client_id": str(uuid.uuid4()), "version": 1,
+            "white": fx.ids[0], "black": fx.ids[1], "result": "d",
+            "round_number": fx.t.num_rounds}]}, 200),
+        ("create-round-confirm", "get", None, None, 200),
+        ("create-round-finalize", "get", None, None, 302),
+        ("create-report-finalize", "get", None, None, 302),
+        ("add-player", "get", None, None, 200),
+        ("view-report", "get", None, None, 200),
+        ("export-report", "get", lambda fx: [fx.t.pk], {"format": "ctr"},
+         200),
+        ("export-report", "get", lambda fx: [fx.t.pk], None, 200),
+        ("finalize-tournament", "post", lambda fx: [fx.t.pk], None, 302),
+        ("bulk-export", "get", None, lambda fx: {"tournament": fx.t.pk},
+         302),
+        ("live-report", "get", lambda fx: [fx.t.pk], None, 200),
+        ("job", "get", lambda fx: [fx.job.pk], None, 200),
+        ("job-download", "get", lambda fx: [fx.job.pk], None, 200),
+        ("import-reports", "get", None, None, 200),
+        ("api-tournaments", "get", None, None, 200),
+        ("api-tournament", "get", lambda fx: [fx.t.pk], None, 200),
+        ("api-roster", "get", lambda fx: [fx.t.pk], None, 200),
+        ("api-rounds", "get", lambda fx: [fx.t.pk], None, 200),
+        ("api-round", "get", lambda fx: [fx.t.pk, 1], None, 200),
+        ("api-matches", "get", lambda fx: [fx.t.pk], None, 200),
+        ("api-standings", "get", lambda fx: [fx.t.pk], None, 200),
+        ("profiles", "get", None, None, 200),
+        ("profile-download", "get",
+         lambda fx: [QueryCountTests.PROFILE, "prof"], None, 200),
+        ("create-toggle-player", "post", lambda fx: [fx.ids[0]], None, 200),
+        ("create-add-player", "post", lambda fx: [fx.other], None, 200),
+        ("create-remove-player", "post", lambda fx: [fx.ids[0]], None, 200),
+        ("create-search-players", "get", None, {"q": "Count"}, 200),
+        ("select-match-round", "post", lambda fx: [fx.match_pk], None, 200),
+        ("live-standings", "get", None, None, 200),
+        ("job-progress", "get", lambda fx: [fx.job.pk], None, 200),
+        ("job-cancel", "post", lambda fx: [fx.job.pk], None, 200),
+    ]
+    # url names not requested, and why
+    SKIPPED = {
+        "live-stream": "an event stream that never ends",
+    }
+    # name of the profile downloaded
+    PROFILE = "count"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = [cls.tournament(n, *size)
+                        for n, size in enumerate(cls.SIZES)]
+        # build the trigram index, and look up the FTS5 table, now, not in
+        # the first search counted
+        search.get_index()
+        search.fts_available()
+        cls.addClassCleanup(setattr, search, "_index", None)
+        cls.staff = User.objects.create_user("staff", is_staff=True)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(JOBS_DIR=directory.name,
+                                            PROFILE_DIR=directory.name))
+        for fx in self.fixtures:
+            fx.job.output = jobs.job_file(fx.job, "report.ctr")
+            with open(fx.job.output, "w", encoding="utf-8") as output:
+                output.write("report")
+            fx.job.save(update_fields=["output"])
+        _, profiler = profiling.profile(sum, ())
+        profiler.dump_stats(os.path.join(directory.name,
+                                         self.PROFILE + profiling.PSTATS))
+        self.client.force_login(self.staff)
+
+    @classmethod
+    def tournament(cls, n: int, num_players: int, num_rounds: int):
+        """a tournament of num_players who played num_rounds rounds"""
+        first = 100000 + 1000 * n
+        players = Player.objects.bulk_create(
+            Player(name=f"Count {n} {i}", cfc_id=first + i,
+                   slug=Player.make_slug(f"Count {n} {i}", first + i))
+            for i in range(num_players + 1))
+        # the last is not on the roster
+        other = players.pop()
+        roster = Roster.objects.create()
+        roster.players.set(players)
+        t = Tournament.objects.create(
+            name=f"Count Open {n}", num_rounds=num_rounds,
+            date=datetime.date(2024, 6, 1), pairing_system="SW",
+            province="ON", to_cfc=100001, td_cfc=100001, roster=roster)
+        ids = [p.cfc_id for p in players]
+        by_cfc = {p.cfc_id: p for p in players}
+        matches = Match.objects.bulk_create(
+            Match(tournament=t, round_number=number, white=by_cfc[w],
+                  black=by_cfc[b], result="d")
+            for number in range(1, num_rounds + 1)
+            for w, b in round_robin(ids, number))
+        job = Job.objects.create(kind="finalize_report", status=Job.DONE,
+                                 params={"tournament": t.pk})
+        return SimpleNamespace(t=t, players=players, ids=ids,
+                               other=other.cfc_id, matches=matches,
+                               match_pk=matches[-1].pk, job=job)
+
+    def use(self, fx) -> None:
+        """make fx the tournament being built in the client's session, in
+        its last round"""
+        td_session = self.client.session
+        session.set_tournament(td_session, fx.t)
+        session.update_players(td_session, fx.players)
+        session.set_tournament_round_number(td_session, fx.t.num_rounds)
+        td_session["matches"] = []
+        session.add_matches(
+            td_session,
+            [m for m in fx.matches if m.round_number == fx.t.num_rounds])
+        td_session.save()
+
+    def queries(self, fx, name: str, method: str, args, data,
+                status: int) -> int:
+        """queries run by one request, its response read to the end"""
+        self.use(fx)
+        url = reverse(name, args=args(fx) if args else None)
+        data = data(fx) if callable(data) else data
+        kwargs = {}
+        if name == "create-report-sync":
+            data, kwargs = json.dumps(data), {"content_type":
+                                              "application/json"}
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data, **kwargs)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, status, url)
+        return len(captured)
+
+    def test_every_url_covered(self):
+        names = {p.name for p in get_resolver("cfc_report.urls").url_patterns}
+        self.assertEqual(names - set(self.SKIPPED),
+                         {name for name, *_ in self.CASES})
+
+    def test_constant_queries(self):
+        for name, method, args, data, status in self.CASES:
+            with self.subTest(url=name, method=method, data=data):
+                counts = [self.queries(fx, name, method, args, data, status)
+                          for fx in self.fixtures]
+                self.assertEqual(len(set(counts)), 1, counts)
+
+
+class ReassignRoundTests(TestCase):
+    """the admin moves matches only to rounds their tournament has"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin")
+        white, black = Player.objects.bulk_create(
+            Player(name=name, cfc_id=cfc_id,
+                   slug=Player.make_slug(name, cfc_id))
+            for name, cfc_id in (("Ann", 100100), ("Bob", 100200)))
+        cls.tournaments = [
+            Tournament.objects.create(
+                name=name, num_rounds=num_rounds, pairing_system="SW",
+                date=datetime.date(2024, 5, 1), province="ON",
+                to_cfc=100100, td_cfc=100100)
+            for name, num_rounds in (("Long", 5), ("Short", 3))]
+        cls.matches = Match.objects.bulk_create(
+            Match(tournament=t, round_number=1, white=white, black=black,
+                  result="w")
+            for t in cls.tournaments)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def reassign(self, matches, round_number):
+        return self.client.post(
+            reverse("admin:cfc_report_match_changelist"),
+            {"action": "reassign_round", "index": 0,
+             "_selected_action": [m.pk for m in matches],
+             "round_number": round_number}, follow=True)
+
+    def test_over_num_rounds(self):
+        response = self.reassign(self.matches, 4)
+        self.assertContains(response, "No round 4: Short (2024-05-01) has 3")
+        self.assertEqual(set(Match.objects.values_list("round_number",
+                                                       flat=True)), {1})
+        self.assertFalse(Round.objects.exists())
+
+    def test_rounds_created(self):
+        long, short = self.tournaments
+        self.reassign(self.matches, 3)
+        self.assertEqual(set(Match.objects.values_list("round_number",
+                                                       flat=True)), {3})
+        self.reassign(self.matches[:1], 5)
+        self.assertEqual(
+            sorted(Round.objects.values_list("tournament", "round_num")),
+            sorted([(long.pk, 3), (long.pk, 5), (short.pk, 3)]))
+
+
+class ApiTokenTests(TestCase):
+    """API writes are made with the key of a staff user's token"""
+
+    @classmethod
+    def setUpTestData(cls):
+        staff = User.objects.create_user("td", is_staff=True)
+        cls.token, cls.key = ApiToken.issue(staff, "pairing program")
+        _, cls.player_key = ApiToken.issue(User.objects.create_user("ann"))
+
+    def write(self, authorization: str = None):
+        headers = {"HTTP_AUTHORIZATION": authorization} \
+            if authorization else {}
+        return self.client.post(
+            reverse("api-tournaments"), json.dumps([{
+                "name": "Token Open", "num_rounds": 1,
+                "date": "2024-06-01", "pairing_system": "RR",
+                "province": "ON", "td_cfc": 100001, "to_cfc": 100001}]),
+            content_type="application/json", **headers)
+
+    def test_statuses(self):
+        for authorization, status in (
+                (f"Token {self.key}", 201),
+                (None, 401),
+                ("Token ", 401),
+                (f"Token {self.key}x", 401),
+                (f"Bearer {self.key}", 401),
+                (f"Token {self.player_key}", 403)):
+            with self.subTest(authorization=authorization):
+                response = self.write(authorization)
+                self.assertEqual(response.status_code, status)
+                if status == 401:
+                    self.assertIn("Token", response["WWW-Authenticate"])
+        self.assertEqual(Tournament.objects.count(), 1)
+
+    def test_key_not_kept(self):
+        self.assertNotIn(self.key, self.token.digest)
+        self.assertEqual(self.token.digest, ApiToken.hash(self.key))
+
+    def test_no_password_hash(self):
+        with mock.patch.object(User, "check_password") as check:
+            self.assertEqual(self.write(f"Token {self.key}").status_code, 201)
+            self.assertEqual(self.write("Token nope").status_code, 401)
+        check.assert_not_called()
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("api_token", "td", "--name", "swiss", stdout=out)
+        token = ApiToken.objects.get(name="swiss")
+        self.assertEqual(token.digest, ApiToken.hash(out.getvalue().strip()))
+        with self.assertRaises(CommandError):
+            call_command("api_token", "ann", stdout=out)
+
+    def test_if_match(self):
+        t = Tournament.objects.create(
+            name="Match Open", num_rounds=1, date=datetime.date(2024, 6, 1),
+            pairing_system="RR", province="ON", td_cfc=100001, to_cfc=100001)
+        players = [{"cfc_id": 100100, "name": "Ann"},
+                   {"cfc_id": 100200, "name": "Bob"}]
+        for name, args, body in (
+                ("api-roster", [t.pk], players),
+                ("api-round", [t.pk, 1], [{"white": 100100, "black": 100200,
+                                           "result": "w"}])):
+            with self.subTest(url=name):
+                url = reverse(name, args=args)
+                tag = self.client.get(url)["ETag"]
+                put = functools.partial(
+                    self.client.put, url, json.dumps(body),
+                    content_type="application/json",
+                    HTTP_AUTHORIZATION=f"Token {self.key}")
+                self.assertEqual(put(HTTP_IF_MATCH=tag).status_code, 200)
+                self.assertNotEqual(self.client.get(url)["ETag"], tag)
+                self.assertEqual(put(HTTP_IF_MATCH=tag).status_code, 412)
+
+
+class JobAccessTests(TestCase):
+    """imports and cancels are for staff, a job's file for staff and the
+    session that queued the job"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(JOBS_DIR=directory.name))
+        t = Tournament.objects.create(
+            name="Job Open", num_rounds=1, date=datetime.date(2024, 6, 1),
+            pairing_system="RR", province="ON", td_cfc=100001, to_cfc=100001)
+        response = self.client.get(reverse("bulk-export"),
+                                   {"tournament": t.pk})
+        self.job = Job.objects.get()
+        self.assertRedirects(response, self.job.get_absolute_url(),
+                             fetch_redirect_response=False)
+        # as if the worker ran it
+        self.job.output = jobs.job_file(self.job, "export.zip")
+        with open(self.job.output, "wb") as output:
+            output.write(b"zip")
+        self.job.status = Job.DONE
+        self.job.save()
+        self.staff = User.objects.create_user("staff", is_staff=True)
+
+    def test_download(self):
+        url = reverse("job-download", args=[self.job.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        other = Client()
+        self.assertEqual(other.get(url).status_code, 404)
+        self.assertNotContains(
+            other.get(reverse("job", args=[self.job.pk])), url)
+        other.force_login(self.staff)
+        self.assertEqual(other.get(url).status_code, 200)
+
+    def test_staff_only(self):
+        for method, url in (
+                ("post", reverse("job-cancel", args=[self.job.pk])),
+                ("get", reverse("import-reports")),
+                ("post", reverse("import-reports"))):
+            with self.subTest(url=url, method=method):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, 302)
+                self.assertIn(reverse("admin:login"), response["Location"])
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse("import-reports"))
+                         .status_code, 200)
+
+
+class ImporterTests(TestCase):
+    """report files are saved against the players already known"""
+
+    INFO = {"name": "Import Open", "province": "ON", "pairing_system": "RR",
+            "date": datetime.date(2024, 5, 1), "num_rounds": 1,
+            "td_cfc": 100100, "to_cfc": 100100}
+    PLAYERS = {100100: ("John Smith", 1850), 100200: ("Ann Jones", 1700)}
+    GAMES = [(1, 100100, 100200, "w")]
+
+    @classmethod
+    def setUpTestData(cls):
+        Player.objects.bulk_create(
+            Player(name=name, cfc_id=cfc_id, rating=rating,
+                   slug=Player.make_slug(name, cfc_id))
+            for cfc_id, (name, rating) in cls.PLAYERS.items())
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+
+    def write(self, name: str, text: str) -> str:
+        path = os.path.join(self.dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def report(self, fmt: str, players: dict = None,
+               games: list = None) -> str:
+        return "".join(text for _, text in render(
+            self.INFO, players or self.PLAYERS, games or self.GAMES, [fmt]))
+
+    def trf(self, fide_ids: dict) -> dict:
+        """the parsed TRF of the tournament, with FIDE ids by cfc id"""
+        path = self.write("open.trf", self.report("trf"))
+        parsed = parse_file(path)
+        by_name = {name: cfc_id for cfc_id, (name, _) in self.PLAYERS.items()}
+        parsed["players"] = {
+            rank: (name, rating, fide_ids.get(by_name.get(name)))
+            for rank, (name, rating, _) in parsed["players"].items()}
+        return parsed
+
+    def test_trf_players_found(self):
+        tournament = save_report(self.trf({100100: 2012345}))
+        match = tournament.matches.get()
+        self.assertEqual((match.white.cfc_id, match.black.cfc_id),
+                         (100100, 100200))
+        smith = Player.objects.get(cfc_id=100100)
+        self.assertEqual(smith.fide_id, 2012345)
+        # found by the FIDE id now, whatever the name
+        Player.objects.filter(pk=smith.pk).update(name="J. Smith")
+        self.assertEqual(save_report(self.trf({100100: 2012345}))
+                         .matches.get().white, smith)
+        self.assertEqual(Player.objects.count(), 2)
+
+    def test_trf_unknown_player(self):
+        parsed = self.trf({})
+        parsed["players"][1] = ("Nobody Known", 1500, 2099999)
+        with self.assertRaisesRegex(ReportImportException, "Nobody Known"):
+            save_report(parsed)
+        self.assertFalse(Tournament.objects.exists())
+
+    def test_ctr_bad_cfc_id(self):
+        path = self.write("open.ctr", self.report(
+            "ctr", {100100: ("John Smith", 0), 2012345: ("Ann", 0)},
+            [(1, 100100, 2012345, "d")]))
+        with self.assertRaisesRegex(ReportImportException, "2012345"):
+            save_report(parse_file(path))
+        self.assertFalse(Player.objects.filter(cfc_id=2012345).exists())
+
+    def test_errors_per_file(self):
+        good = self.write("good.ctr", self.report("ctr"))
+        bad = self.write("bad.ctr", '"Open","ON","0","S","2024-13-01"\n')
+        conflict = self.write("conflict.ctr", self.report("ctr"))
+        real_save = importer.save_report
+
+        def save(parsed):
+            if parsed["path"] == conflict:
+                raise IntegrityError("UNIQUE constraint failed")
+            return real_save(parsed)
+
+        with mock.patch.object(importer, "save_report", save), \
+                self.assertLogs("CFC_REPORT", "WARNING"):
+            done = {os.path.basename(path): error for path, _, error
+                    in importer.import_files([bad, conflict, good], 1)}
+        self.assertIsNone(done["good.ctr"])
+        self.assertIn("UNIQUE", done["conflict.ctr"])
+        self.assertTrue(done["bad.ctr"])
+
+
+class ProfileTests(TestCase):
+    """requests profiled on demand, and the profiles kept"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=directory.name))
+        self.dir = directory.name
+        self.staff = User.objects.create_user("staff", is_staff=True)
+
+    def test_collapsed_stacks(self):
+        def leaf():
+            return sum(range(200000))
+
+        def parent():
+            return leaf() + leaf()
+
+        _, profiler = profiling.profile(parent)
+        stacks = dict(profiling.collapsed_stacks(pstats.Stats(profiler)))
+        leaf_stacks = [s for s in stacks if s.split(";")[-1]
+                       .startswith("<built-in method builtins.sum>")]
+        self.assertEqual(len(leaf_stacks), 1)
+        frames = leaf_stacks[0].split(";")
+        self.assertEqual([f.split(" ")[0] for f in frames[:2]],
+                         ["parent", "leaf"])
+
+    def test_profile_on_demand(self):
+        url = reverse("api-tournaments")
+        self.assertNotIn("X-Profile", self.client.get(url, {"profile": 1}))
+
+        self.client.force_login(self.staff)
+        self.assertNotIn("X-Profile", self.client.get(url))
+        name = self.client.get(url, {"profile": 1})["X-Profile"]
+        self.assertEqual(self.client.get(url, HTTP_X_PROFILE="1")
+                         .status_code, 200)
+        self.assertEqual(len(profiling.list_profiles()), 2)
+
+        page = self.client.get(reverse("profiles"))
+        self.assertContains(page, name)
+        collapsed = self.client.get(
+            reverse("profile-download", args=[name, "collapsed"]))
+        self.assertIn(b"tournaments", b"".join(collapsed.streaming_content))
+        for bad in ("../" + name, name + "\n"):
+            self.assertIsNone(profiling.get_profile_path(bad, ".prof"))
+        self.assertEqual(self.client.get(
+            reverse("profile-download", args=[name, "txt"])).status_code, 404)
+
+    def test_profile_on_demand_asgi(self):
+        t = Tournament.objects.create(
+            name="Profile Open", num_rounds=1, date=datetime.date(2024, 6, 1),
+            pairing_system="RR", province="ON", td_cfc=100001, to_cfc=100001)
+        self.assertTrue(iscoroutinefunction(
+            ProfileMiddleware(AsyncClient().handler.get_response_async)))
+
+        async def profiled(url: str) -> str:
+            client = AsyncClient()
+            await client.aforce_login(self.staff)
+            response = await client.get(url, {"profile": 1})
+            self.assertEqual(response.status_code, 200)
+            with open(profiling.get_profile_path(response["X-Profile"],
+                                                 profiling.COLLAPSED),
+                      encoding="utf-8") as collapsed:
+                return collapsed.read()
+
+        # a sync view, run in a thread, and an async one, on the loop
+        for url, view in ((reverse("api-tournaments"), "tournaments ("),
+                          (reverse("live-report", args=[t.pk]),
+                           "live_report (")):
+            with self.subTest(url=url):
+                self.assertIn(view, async_to_sync(profiled)(url))
+
+    def test_oldest_deleted(self):
+        _, profiler = profiling.profile(sum, range(10))
+        with mock.patch.object(profiling, "KEEP", 2):
+            names = [profiling.save(profiler, "GET", f"/page/{n}")
+                     for n in range(3)]
+        self.assertEqual([p["name"] for p in profiling.list_profiles()],
+                         names[:0:-1])
+        self.assertEqual(len(os.listdir(self.dir)), 4)
@@ -17,7 +17,7 @@
 from django.contrib import admin
 from django.urls import path
 
-from .views import home, player
+from .views import api, home, jobs, player, profiles
 from .views.report import create, view
 
 
@@ -30,6 +30,7 @@ urlpatterns = [
     path("create/report", create.report, name="create-report"),
     path("create/report/round", create.round, name="create-report-round"),
     path("create/report/match", create.chess_match, name="create-report-match"),
+    path("create/report/sync", create.sync_results, name="create-report-sync"),
     path("create/report/confirm-round", create.confirm_round, name="create-round-confirm"),
     path("create/finalize/round", create.finalize_round, name="create-round-finalize"),
     path("create/finalize/report", create.finalize_report, name="create-report-finalize"),
@@ -37,12 +38,44 @@ urlpatterns = [
 
     # view
     path("view/", view.report, name="view-report"),
+    path("view/<int:pk>/export", view.export, name="export-report"),
+    path("view/<int:pk>/finalize", view.finalize_tournament, name="finalize-tournament"),
+    path("view/export", view.bulk_export_view, name="bulk-export"),
+    path("view/live/<int:pk>", view.live_report, name="live-report"),
+    path("view/live/<int:pk>/stream", view.live_stream, name="live-stream"),
+
+    # background jobs
+    path("jobs/<int:pk>", jobs.job, name="job"),
+    path("jobs/<int:pk>/download", jobs.download_job, name="job-download"),
+    path("jobs/import", jobs.import_reports, name="import-reports"),
+
+    # JSON API
+    path("api/tournaments", api.tournaments, name="api-tournaments"),
+    path("api/tournaments/<int:pk>", api.tournament, name="api-tournament"),
+    path("api/tournaments/<int:pk>/roster", api.roster, name="api-roster"),
+    path("api/tournaments/<int:pk>/rounds", api.rounds, name="api-rounds"),
+    path("api/tournaments/<int:pk>/rounds/<int:number>", api.tournament_round,
+         name="api-round"),
+    path("api/tournaments/<int:pk>/matches", api.matches, name="api-matches"),
+    path("api/tournaments/<int:pk>/standings", api.standings,
+         name="api-standings"),
+
+    # request profiles, for staff
+    path("profiles/", profiles.profiles, name="profiles"),
+    path("profiles/<str:name>.<str:kind>", profiles.download_profile,
+         name="profile-download"),
 ]
 
 # htmx url patterns, cleaner this way?
 htmx_urlpatterns = [
     path("create/select-player/<str:cfc_id>", create.toggle_player_session, name="create-toggle-player"),
+    path("create/roster/<int:cfc_id>/add", create.add_player_session, name="create-add-player"),
+    path("create/roster/<int:cfc_id>/remove", create.remove_player_session, name="create-remove-player"),
+    path("create/search-players", create.search_players, name="create-search-players"),
     path("create/select-match/<int:pk>", create.remove_match_session, name="select-match-round"),
+    path("view/standings", view.standings, name="live-standings"),
+    path("jobs/<int:pk>/progress", jobs.job_progress, name="job-progress"),
+    path("jobs/<int:pk>/cancel", jobs.cancel_job, name="job-cancel"),
     # path("create/select-round/<int:pk>", TODO
 ]
 
@@ -0,0 +1,274 @@
+"""JSON API for tournaments, rosters, rounds and results"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import functools
+import json
+
+from django.core.exceptions import RequestDataTooBig
+from django.db import IntegrityError
+from django.http import HttpResponse, HttpResponseNotModified
+from django.views.decorators.csrf import csrf_exempt
+
+from .. import logger
+from ..models import ApiToken, Round, Tournament
+from ..services import api, snapshot
+
+# Reads are open, like the rest of the site. Writes need the key of an
+# ApiToken of a staff user, "Authorization: Token <key>": the API is used
+# by scripts, so it takes no CSRF token, and the session cookie alone must
+# not be enough to write. A key is checked by one SHA-256 and an indexed
+# lookup, not a password hash, so writes stay cheap and bad keys cannot be
+# used to burn CPU.
+
+
+def _json(data, status: int = 200, headers: dict = None) -> HttpResponse:
+    """a JSON answer"""
+    response = HttpResponse(api.render(data), status=status,
+                            content_type="application/json")
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def _error(err: api.ApiException) -> HttpResponse:
+    """the JSON answer of a failed request"""
+    body = {"error": str(err)}
+    if err.errors:
+        body["errors"] = err.errors
+    headers = ({"WWW-Authenticate": 'Token realm="horizon report api"'}
+               if err.status == 401 else None)
+    return _json(body, err.status, headers)
+
+
+def _conditional(request, data) -> HttpResponse:
+    """a read answered with an ETag, 304 Not Modified if the client has it"""
+    body = api.render(data)
+    tag = api.etag(body)
+    if tag in _tags(request.headers.get("If-None-Match")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = tag
+    return response
+
+
+def _tags(header: str | None) -> list[str]:
+    """the ETags of an If-Match or If-None-Match header"""
+    return [t.strip().removeprefix("W/") for t in (header or "").split(",")]
+
+
+def _precondition(request, current) -> None:
+    """Refuse a write made against data that has changed since the client
+    read it, if it sent If-Match
+
+    Parameters
+    ----------
+    current : the data a GET of the resource answers with now
+    """
+    expected = request.headers.get("If-Match")
+    if expected and expected.strip() != "*":
+        if api.etag(api.render(current)) not in _tags(expected):
+            raise api.ApiException("the resource has changed", status=412)
+
+
+def _staff(request) -> None:
+    """Check the token of a write, see ApiToken
+
+    Raises
+    ------
+    ApiException 401 or 403
+    """
+    kind, _, key = request.headers.get("Authorization", "").partition(" ")
+    if kind.lower() != "token" or not key.strip():
+        raise api.ApiException("writes need an API token", status=401)
+    try:
+        token = ApiToken.objects.select_related("user").get(
+            digest=ApiToken.hash(key.strip()))
+    except ApiToken.DoesNotExist:
+        raise api.ApiException("bad token", status=401) from None
+    if not token.user.is_active:
+        raise api.ApiException("bad token", status=401)
+    if not token.user.is_staff:
+        raise api.ApiException("writes need a staff user", status=403)
+
+
+def _tournament(pk: int) -> Tournament:
+    """the tournament pk, a 404 answer if there is none"""
+    try:
+        return Tournament.objects.get(pk=pk)
+    except Tournament.DoesNotExist:
+        raise api.ApiException(f"no tournament {pk}", status=404) from None
+
+
+def _body(request):
+    """the JSON body of a write"""
+    try:
+        return json.loads(request.body)
+    except RequestDataTooBig as err:
+        raise api.ApiException(str(err), status=413) from None
+    except ValueError as err:
+        raise api.ApiException(f"bad JSON: {err}") from None
+
+
+def endpoint(*methods):
+    """An API view answering methods: no CSRF token, writes by staff, and
+    ApiException answered as JSON"""
+    def decorate(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return _json({"error": f"{request.method} not allowed"}, 405,
+                             {"Allow": ", ".join(methods)})
+            try:
+                if request.method != "GET":
+                    _staff(request)
+                return view(request, *args, **kwargs)
+            except api.ApiException as err:
+                logger.debug("api %s %s: %s", request.method, request.path,
+                             err)
+                return _error(err)
+            except IntegrityError as err:
+                return _error(api.ApiException(f"conflict: {err}", 409))
+        return wrapper
+    return decorate
+
+
+@endpoint("GET", "POST", "PATCH")
+def tournaments(request) -> HttpResponse:
+    """GET a page of tournaments, POST an array of tournaments to create,
+    PATCH an array of {"id", fields} to update
+
+    Query
+    -----
+    fields : comma separated fields of a tournament, default all
+    cursor, limit : the page, see services.api.page
+    """
+    if request.method == "POST":
+        created = api.create_tournaments(_body(request))
+        return _json({"results": [api.tournament_object(t) for t in created]},
+                     201)
+    if request.method == "PATCH":
+        updated = api.update_tournaments(_body(request))
+        return _json({"results": [api.tournament_object(t) for t in updated]})
+
+    fields = api.select_fields(request.GET.get("fields"),
+                               api.TOURNAMENT_FIELDS)
+    return _conditional(request, api.page(api.tournament_rows(), fields,
+                                          request.GET.get("cursor"),
+                                          request.GET.get("limit")))
+
+
+@endpoint("GET")
+def tournament(request, pk: int) -> HttpResponse:
+    """GET a tournament, ?fields= selects its fields"""
+    fields = api.select_fields(request.GET.get("fields"),
+                               api.TOURNAMENT_FIELDS)
+    found = api.rows(api.tournament_rows([pk]), fields)
+    if not found:
+        raise api.ApiException(f"no tournament {pk}", status=404)
+    return _conditional(request, found[0])
+
+
+def _roster_page(request, t: Tournament) -> dict:
+    """the page of t's players the query of request asks for"""
+    fields = api.select_fields(request.GET.get("fields"), api.PLAYER_FIELDS)
+    return api.page(api.roster_rows(t), fields, request.GET.get("cursor"),
+                    request.GET.get("limit"))
+
+
+@endpoint("GET", "PUT")
+def roster(request, pk: int) -> HttpResponse:
+    """GET a page of the players of a tournament, PUT an array of
+    {"cfc_id", "name", "rating"} to replace them. Send the ETag of the GET
+    as If-Match, with the same query, to not overwrite a change made since.
+    """
+    t = _tournament(pk)
+    if request.method == "PUT":
+        _precondition(request, _roster_page(request, t))
+        return _json({"players": api.set_roster(t, _body(request))})
+    return _conditional(request, _roster_page(request, t))
+
+
+@endpoint("GET")
+def rounds(request, pk: int) -> HttpResponse:
+    """GET the rounds of a tournament"""
+    t = _tournament(pk)
+    fields = api.select_fields(request.GET.get("fields"), api.ROUND_FIELDS)
+    return _conditional(request, {"results": api.rows(
+        Round.objects.filter(tournament=t).order_by("round_num", "pk"),
+        fields)})
+
+
+@endpoint("GET")
+def standings(request, pk: int) -> HttpResponse:
+    """GET the standings of a tournament. The ETag is the tournament's
+    version, so an unchanged tournament is answered without computing them.
+    """
+    t = _tournament(pk)
+    tag = f'"t{t.pk}-v{t.version}"'
+    if tag in _tags(request.headers.get("If-None-Match")):
+        response = HttpResponseNotModified()
+    else:
+        response = _json({"results": api.standings(
+            snapshot.get_snapshot(t))})
+    response["ETag"] = tag
+    return response
+
+
+@endpoint("GET", "PUT")
+def tournament_round(request, pk: int, number: int) -> HttpResponse:
+    """GET every match of a round, PUT an array of matches to replace them,
+    so a pairing program syncs a whole round in one request. Send the ETag
+    of the GET as If-Match to not overwrite a change made since.
+    """
+    t = _tournament(pk)
+    matches = api.match_rows(t, number).order_by("pk")
+    if request.method == "PUT":
+        _precondition(request, {"results": api.rows(matches,
+                                                     api.MATCH_FIELDS)})
+        return _json({"results": api.replace_round(t, number,
+                                                   _body(request))})
+
+    fields = api.select_fields(request.GET.get("fields"), api.MATCH_FIELDS)
+    return _conditional(request, {"results": api.rows(matches, fields)})
+
+
+@endpoint("GET", "POST", "PATCH")
+def matches(request, pk: int) -> HttpResponse:
+    """GET a page of the matches of a tournament, POST an array of matches
+    to add, PATCH an array of {"id", fields} to change, ie: results
+
+    Query
+    -----
+    round : only the matches of a round
+    fields : comma separated fields of a match, default all
+    cursor, limit : the page, see services.api.page
+    """
+    t = _tournament(pk)
+    if request.method == "POST":
+        return _json({"results": api.create_matches(t, _body(request))}, 201)
+    if request.method == "PATCH":
+        return _json({"results": api.update_matches(t, _body(request))})
+
+    try:
+        number = (int(request.GET["round"]) if request.GET.get("round")
+                  else None)
+    except ValueError:
+        raise api.ApiException("round must be a number") from None
+    fields = api.select_fields(request.GET.get("fields"), api.MATCH_FIELDS)
+    return _conditional(request, api.page(api.match_rows(t, number), fields,
+                                          request.GET.get("cursor"),
+                                          request.GET.get("limit")))
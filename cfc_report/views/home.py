@@ -24,12 +24,12 @@ from ..services import database as db
 
 def index(request):
     """Main index page"""
-    player_list = db.get_players()
-
+    # a page at a time, the database may hold every CFC member
+    page = db.get_players_page(request.GET.get("page"))
 
     return render(
         request, "cfc_report/home/index.html", {
             "reports": {},
-            "players": player_list,
+            "players": page,
             "players_heading": "Player's in Database",
         })
@@ -0,0 +1,86 @@
+"""views of background jobs: progress, cancel, download, and imports"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
+
+from .. import logger
+from ..models import Job
+from ..services import jobs as job_services
+from ..services import session
+
+
+def _may_download(request, pk: int) -> bool:
+    """if the file of job pk is for this request: staff, or the session
+    that queued the job"""
+    return request.user.is_staff or session.started_job(request.session, pk)
+
+
+def _context(request, pk: int) -> dict:
+    """the context of the job page and its progress partial"""
+    return {"job": get_object_or_404(Job, pk=pk),
+            "can_download": _may_download(request, pk)}
+
+
+def job(request, pk: int) -> HttpResponse:
+    """page of a job, its progress polled by htmx until it finishes"""
+    return render(request, "cfc_report/show/job.html", _context(request, pk))
+
+
+def job_progress(request, pk: int) -> HttpResponse:
+    """htmx partial with the progress of a job"""
+    return render(request, "cfc_report/show/partials/job-progress.html",
+                  _context(request, pk))
+
+
+@staff_member_required
+@require_POST
+def cancel_job(request, pk: int) -> HttpResponse:
+    """cancel a job, answers with its progress partial"""
+    job_services.cancel(get_object_or_404(Job, pk=pk).pk)
+    return job_progress(request, pk)
+
+
+def download_job(request, pk: int) -> FileResponse:
+    """the file a finished job wrote, for staff or the session that
+    queued the job"""
+    if not _may_download(request, pk):
+        raise Http404("no such job")
+    job = get_object_or_404(Job, pk=pk, status=Job.DONE)
+    if not job.output or not os.path.exists(job.output):
+        raise Http404("this job has no file")
+    return FileResponse(open(job.output, "rb"), as_attachment=True,
+                        filename=job.result.get("filename")
+                        or os.path.basename(job.output))
+
+
+@staff_member_required
+def import_reports(request) -> HttpResponse:
+    """upload CTR and TRF reports, imported by a background job, which
+    replaces the games of the tournaments they report, so staff only"""
+    context = {}
+    if request.method == "POST":
+        paths = job_services.save_uploads(request.FILES.getlist("reports"))
+        if paths:
+            job = job_services.enqueue("import_reports", {"paths": paths})
+            session.add_job(request.session, job)
+            logger.debug("import of %s reports queued", len(paths))
+            return redirect(job)
+        context["error"] = "no CTR or TRF report files were uploaded"
+    return render(request, "cfc_report/create/import.html", context)
@@ -0,0 +1,43 @@
+"""list and download the profiles of requests, for staff"""
+# Copyright (C) 2024  Nicolas Vaagen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import render
+
+from ..middleware import PROFILE_PARAM
+from ..services import profiling
+
+
+@staff_member_required
+def profiles(request) -> HttpResponse:
+    """the saved profiles, newest first, in the admin's look"""
+    return render(request, "cfc_report/show/profiles.html", {
+        **admin.site.each_context(request),
+        "title": "Request profiles",
+        "profiles": profiling.list_profiles(),
+        "profile_dir": profiling.profile_dir(),
+        "param": PROFILE_PARAM,
+    })
+
+
+@staff_member_required
+def download_profile(request, name: str, kind: str) -> FileResponse:
+    """one file of a saved profile, kind "prof" or "collapsed" """
+    path = profiling.get_profile_path(name, f".{kind}")
+    if path is None:
+        raise Http404("no such profile")
+    return FileResponse(open(path, "rb"), as_attachment=True)
@@ -13,15 +13,20 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+
 from cfc_report import logger
 from cfc_report.forms import TournamentInfoForm
-from cfc_report.models import Match, Player
+from cfc_report.models import Player
 from cfc_report.services import database as db
-from cfc_report.services import session
-from cfc_report.services.ctr import CTR
-from django.http import HttpResponse
+from cfc_report.services import (jobs, live, results, search, session,
+                                 sync)
+from cfc_report.services.validation import validate_games
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         JsonResponse)
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.views.decorators.http import require_POST
 
 
 def initial(request):
@@ -33,16 +38,19 @@ def initial(request):
     logger.debug("Report.initial entered with request: %s", request)
     # if is the form being submitted
     if request.method == "POST":
-        tournament_info = request.POST
-        logger.debug("POST request with value: %s", tournament_info)
-        # save tournament info to session
-        session.set_tournament_info(tournament_info)
-        logger.debug("TournamentInfoForm made from POST: %s", tournament_info)
-
-        # redirect to view to choose players
-        return redirect("create-report-players")
-
-    form = TournamentInfoForm()
+        form = TournamentInfoForm(request.POST)
+        logger.debug("POST request with value: %s", request.POST)
+        if form.is_valid():
+            # saved once, typed, everything after reads the tournament
+            tournament = db.save_tournament_info(form.cleaned_data)
+            session.set_tournament(request.session, tournament)
+            logger.debug("TournamentInfoForm saved as: %s", tournament)
+
+            # redirect to view to choose players
+            return redirect("create-report-players")
+        logger.warning("bad tournament info: %s", form.errors.as_json())
+    else:
+        form = TournamentInfoForm()
 
     context = {
         "title": "Enter tournament information",
@@ -53,16 +61,21 @@ def initial(request):
     return render(request, "cfc_report/base/base-form.html", context)
 
 
+# players listed by the picker before anything is searched for
+PICKER_SIZE = 50
+
+
 def players(request):
     """set information about what players in a tournament"""
 
-    db_players = db.get_players()
-    tournament_players = session.get_players()
+    db_players = db.get_players().order_by("name")[:PICKER_SIZE]
+    tournament_players = session.get_players(request.session)
     context = {
         "title": "choose tournament players",
         "action_url": reverse("create-report-players"),
         "players": db_players,
         "tournament_players": tournament_players,
+        "selected_ids": {p.cfc_id for p in tournament_players},
         "include_nav_bar": False,
     }
 
@@ -83,6 +96,25 @@ def players(request):
     return render(request, "cfc_report/create/toggle-players.html", context)
 
 
+def search_players(request) -> HttpResponse:
+    """htmx typeahead for the player picker: the Player Database rows of the
+    players matching ?q=, a cfc id or all or part of a name
+    """
+    query = request.GET.get("q", "")
+    if query.strip():
+        found = search.search_players(query, limit=PICKER_SIZE)
+    else:
+        found = db.get_players().order_by("name")[:PICKER_SIZE]
+
+    context = {
+        "players": found,
+        "selected_ids": set(session.get_player_ids(request.session)),
+    }
+    return render(request,
+                  "cfc_report/create/partials/database-player-rows.html",
+                  context)
+
+
 def chess_match(request):
     """Enter information about a chess match
     Arguments
@@ -98,41 +130,70 @@ def chess_match(request):
         match_info = request.POST
         logger.debug("POST request with value: %s", match_info)
 
-        black_id = match_info["black"]
+        # no black player for a bye or withdrawal
+        black_id = match_info.get("black") or None
         white_id = match_info["white"]
-        result = match_info["result"]
-
-        # RESULT_CHOICES = [("b", "0 - 1"), ("w", "1 - 0"), ("d", "0.5 - 0.5"),
-        # ... ("_", "_")]
-        # set the winning player_id from the result
-        if result == Match.RESULT_CHOICES[0][1]:
-            winner = white_id
-        elif result == Match.RESULT_CHOICES[1][1]:
-            winner = black_id
-        # we are assuming match is done, :. draw
-        else:
-            winner = Match.RESULT_CHOICES[2][1]
+
+        # the form posts the display value of Match.RESULT_CHOICES
+        try:
+            result = results.from_entry(match_info["result"])
+        except results.ResultCodeException as err:
+            logger.warning("chess_match: %s", err)
+            return HttpResponseBadRequest(str(err))
+        if (black_id is None) != (result in results.BYES):
+            return HttpResponseBadRequest(
+                "a bye has no black player, and a game needs one")
         # create the chess match model, and save it to the db
-        chess_match = session.create_match(white_id, black_id, winner)
+        chess_match = session.create_match(request.session, white_id,
+                                           black_id, result)
         logger.debug(
-            "chess_match entered: black_id %s, white_id: %s, result: %s, winner: %s",
+            "chess_match entered: black_id %s, white_id: %s, result: %s",
             black_id,
             white_id,
             result,
-            winner,
         )
-        chess_match.save()
+        live.publish_match(chess_match)
 
     # Continue letting user add more games
     context = {
-        "tournament_players": session.get_players(),
-        "round_number": session.get_tournament_round_number(),
-        "entered_matches": session.get_matches(),
+        "tournament_players": session.get_players(request.session),
+        "round_number": session.get_tournament_round_number(request.session),
+        "entered_matches": session.get_matches(request.session),
     }
 
     return render(request, "cfc_report/create/match.html", context)
 
 
+@require_POST
+def sync_results(request) -> JsonResponse:
+    """Apply a batch of results from the offline result queue
+    (static/result-queue.js) in one transaction
+
+    Arguments
+    ---------
+    request : HttpRequest
+        POST with a JSON body {"results": [result, ...]},
+        see services.sync.apply_results
+    """
+    logger.debug("Create.sync_results entered with request: %s", request)
+    try:
+        batch = json.loads(request.body)["results"]
+        synced = sync.apply_results(
+            batch, session.get_tournament(request.session).pk)
+    except (ValueError, KeyError, TypeError, sync.ResultSyncException) as err:
+        logger.warning("bad result batch: %s", err)
+        return JsonResponse({"error": str(err)}, status=400)
+
+    matches = synced.pop("matches")
+    if matches:
+        # keep the round builder and the spectators up to date
+        session.add_matches(request.session, matches)
+        for chess_match in matches:
+            live.publish_match(chess_match)
+
+    return JsonResponse(synced)
+
+
 def round(request) -> HttpResponse:
     """Enter info for a round in a chess tournament
 
@@ -140,13 +201,16 @@ def round(request) -> HttpResponse:
     ---------
     request : HttpRequest
     """
-    tournament_info = session.get_tournament_info()
+    tournament_info = session.get_tournament_info(request.session)
 
     logger.debug("Create.round entered with request: %s", request)
 
-    context = {"entered_matches": session.get_matches(),
-               "round_number": session.get_tournament_round_number(),
-               "rounds": session.get_rounds()}
+    context = {"entered_matches": session.get_matches(request.session),
+               "round_number":
+                   session.get_tournament_round_number(request.session),
+               "rounds": session.get_rounds(request.session),
+               "tournament_name": tournament_info["name"],
+               "tournament_pk": session.get_tournament_pk(request.session)}
     return render(request, "cfc_report/create/round.html", context)
 
 
@@ -159,12 +223,15 @@ def confirm_round(request) -> HttpResponse:
     request : HttpRequest
     """
 
-    tournament_info = session.get_tournament_info()
+    tournament_info = session.get_tournament_info(request.session)
+    matches = session.get_matches(request.session)
     context = {
         "tournament_name": tournament_info["name"],
-        "round_number": session.get_tournament_round_number(),
-        "matches": session.get_matches(),
-        "players": session.get_players(),
+        "round_number": session.get_tournament_round_number(request.session),
+        "matches": matches,
+        "players": session.get_players(request.session),
+        "errors": validate_games(session.get_player_ids(request.session),
+                                 session.get_games(request.session)),
     }
     logger.debug(
         "Create.confirm_round entered, confirming round completion. TournamentInfo: %s",
@@ -176,12 +243,12 @@ def confirm_round(request) -> HttpResponse:
 def report(request) -> HttpResponse:
     """Create report"""
 
-    tournament_info = session.get_tournament_info()
+    tournament_info = session.get_tournament_info(request.session)
     context = {
         "tournament_name": tournament_info["name"],
-        "round_number": session.get_tournament_round_number(),
-        "matches": session.get_matches(),
-        "players": session.get_players(),
+        "round_number": session.get_tournament_round_number(request.session),
+        "matches": session.get_matches(request.session),
+        "players": session.get_players(request.session),
     }
     return render(request, "cfc_report/create/report.html", context)
 
@@ -195,10 +262,10 @@ def finalize_round(request) -> HttpResponse:
     """
     logger.debug("Create.finalize_round entered with request: %s", request)
     # finalize the round, and prep for new one
-    session.finalize_round()
+    session.finalize_round(request.session)
 
     # check if rounds are over. IE this is the last round
-    if session.is_last_round():
+    if session.is_last_round(request.session):
         return redirect("create-report-finalize")
 
     # start creation of next round
@@ -206,35 +273,30 @@ def finalize_round(request) -> HttpResponse:
 
 
 def finalize_report(request) -> HttpResponse:
-    """finalize a chess tournament report
+    """finalize a chess tournament report, the CTR is built by a background
+    job, see services.jobs
 
     Arguments
     ---------
     request : HttpRequest
     """
     logger.debug("Create.finalize_report entered with request: %s", request)
-    # get tournament information
-    t_info = session.get_tournament_info()
-
-    logger.debug("Tournament Info got: %s", t_info)
-    ctr = CTR(t_info, session)
-    logger.debug("|CTR| created: %s", ctr)
-
-    ctr.write_file()
-    context = {
-        "ctr": str(ctr)
-    }
-
-    return render(request, "cfc_report/show/ctr.html", context)
+    # the job gets the session as it is now
+    job = jobs.enqueue("finalize_report", {
+        "tournament": session.get_tournament(request.session).pk,
+        "player_ids": session.get_player_ids(request.session),
+    })
+    session.add_job(request.session, job)
+    return redirect(job)
 
 
 def preview(request):
     """Preview the tournament report"""
     # get the tournament info set in Create.initial()
-    tournament_info = session.get_tournament_info()
+    tournament_info = session.get_tournament_info(request.session)
 
     # get information on tournament players from the session
-    players: list[Player] = session.get_players()
+    players: list[Player] = session.get_players(request.session)
 
     context = {
         "name": tournament_info["name"],
@@ -249,10 +311,65 @@ def preview(request):
     return render(request, "cfc_report/show/index.html", context)
 
 
-def toggle_player_session(request, cfc_id=None):
+async def _roster_rows(request, cfc_id: "CfcId", add: bool = None):
+    """add (True), remove (False) or toggle (None) a session player, and
+    render only the rows that changed: its Player Database row, and its
+    In Tournament row added or deleted out of band. Adding a player that is
+    in the session, or removing one that is not, changes nothing, so a
+    double click is harmless.
+    """
+    try:
+        player = await db.aget_player_by_cfc(cfc_id)
+    except (Player.DoesNotExist, ValueError):
+        raise Http404(f"no player {cfc_id}") from None
+
+    if add is None:
+        add = not await session.ahas_player(request.session, player.cfc_id)
+    if add:
+        changed = await session.aadd_player_by_id(request.session,
+                                                  player.cfc_id)
+    else:
+        changed = await session.aremove_player_by_id(request.session,
+                                                     player.cfc_id)
+    logger.debug("player %s %s the session, changed: %s", player.cfc_id,
+                 "added to" if add else "removed from", changed)
+
+    context = {
+        "player": player,
+        "selected": add,
+        "changed": changed,
+        "selected_ids": {player.cfc_id} if add else set(),
+    }
+    return render(request, "cfc_report/create/partials/toggle-player.html",
+                  context)
+
+
+@require_POST
+async def add_player_session(request, cfc_id=None):
+    """htmx: add a player to the session, if it is not in it already.
+
+    Side-effects
+    ------------
+    changes the CfcId's in session.
+    """
+    return await _roster_rows(request, cfc_id, add=True)
+
+
+@require_POST
+async def remove_player_session(request, cfc_id=None):
+    """htmx: remove a player from the session, if it is in it.
+
+    Side-effects
+    ------------
+    changes the CfcId's in session.
+    """
+    return await _roster_rows(request, cfc_id, add=False)
+
+
+async def toggle_player_session(request, cfc_id=None):
     """Pick a player if it is not in the session, add it.
-    If it is in the session, remove it. This uses htmx under the hood
-    to replace on the DOM
+    If it is in the session, remove it. The picker uses the add and remove
+    views, which a repeated click cannot undo.
 
     Side-effects
     ------------
@@ -265,35 +382,10 @@ def toggle_player_session(request, cfc_id=None):
     cfc_id : "CfcId"
         The Player to add/removed to the session
     """
-
-    logger.debug(
-        "toggle_player_session entered with request: \
-        %s and  player CfcId: %s",
-        request,
-        cfc_id,
-    )
-    assert cfc_id
-
-    # if cfc id in session, remove it
-    if cfc_id in session.get_player_ids():
-        session.remove_player_by_id(cfc_id)
-    else:
-        # if not in session add to it
-        session.add_player_by_id(cfc_id)
-
-    db_players = db.get_players()
-    tournament_players = session.get_players()
-
-    context = {
-        "players": db_players,
-        "tournament_players": tournament_players,
-        "include_nav_bar": False,
-    }
-
-    return render(request, "cfc_report/create/player-form.html", context)
+    return await _roster_rows(request, cfc_id)
 
 
-def remove_match_session(request, pk=None) -> HttpResponse:
+async def remove_match_session(request, pk=None) -> HttpResponse:
     """toggle a match from the db into the session and visa versa
 
     Side-effects
@@ -314,8 +406,8 @@ def remove_match_session(request, pk=None) -> HttpResponse:
         request,
         pk,
     )
-    # remove the match from the session by primary key
-    session.remove_match_by_pk(pk)
+    # remove the match from the session, and its saved game, by primary key
+    await session.aremove_match_by_pk(request.session, pk)
 
     # return an empty http response, because why not
     return HttpResponse("")
@@ -14,10 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import datetime
+
 from cfc_report import logger
-from django.http import HttpResponse
-from django.shortcuts import render
-from cfc_report.services import database
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         StreamingHttpResponse)
+from django.shortcuts import (aget_object_or_404, get_object_or_404,
+                              redirect, render)
+from cfc_report.models import Tournament
+from cfc_report.services import (database, jobs, live, sections, session,
+                                 writers)
+from cfc_report.services.standings import compute_standings
 
 
 def report(request) -> HttpResponse:
@@ -25,8 +33,7 @@ def report(request) -> HttpResponse:
 
     logger.debug("view.report entered with request: %s", request)
 
-    player_list = database.get_players()
-    num_players = player_list.count()
+    page = database.get_players_page(request.GET.get("page"))
     report = {
         "name": "The Masters",
         "province": "SK",
@@ -34,7 +41,166 @@ def report(request) -> HttpResponse:
         "td_cfc": "111111",  # FIXME
         "to_cfc": "222222",
         "date": "06/06/87",
-        "players": player_list,
-        "num_players": num_players,
+        "players": page,
+        "num_players": page.paginator.count,
     }
     return render(request, "cfc_report/show/index.html", report)
+
+
+async def standings(request) -> HttpResponse:
+    """htmx partial with the live standings of the tournament being built"""
+
+    logger.debug("view.standings entered with request: %s", request)
+
+    pk = await session.aget_tournament_pk(request.session)
+    players = await database.aget_tournament_players(pk)
+    results = await database.aget_tournament_results(pk)
+
+    context = {"standings": compute_standings(players, results)}
+    return render(request, "cfc_report/show/partials/standings.html", context)
+
+
+async def live_report(request, pk: int) -> HttpResponse:
+    """spectator page of a tournament, kept up to date by live_stream"""
+
+    logger.debug("view.live_report entered with request: %s", request)
+
+    tournament = await aget_object_or_404(Tournament, pk=pk)
+    players = await database.aget_tournament_players(pk)
+    matches = await database.aget_tournament_matches(pk)
+    results = [(m.white.cfc_id, None if m.is_bye else m.black.cfc_id,
+                m.result) for m in matches]
+
+    context = {
+        "tournament": tournament,
+        "name": tournament.name,
+        "standings": compute_standings(players, results),
+        "matches": matches,
+    }
+    return render(request, "cfc_report/show/live.html", context)
+
+
+# seconds between keep-alive comments on an idle stream
+KEEP_ALIVE = 15
+
+
+async def live_stream(request, pk: int) -> StreamingHttpResponse:
+    """Server-Sent Events stream of tournament pk's results and
+    standings rows, see services.live. Needs the ASGI app.
+    """
+    feed = live.get_feed(pk)
+    queue = feed.subscribe()
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(),
+                                                         KEEP_ALIVE)
+                except TimeoutError:
+                    # dropped by the feed for falling behind
+                    if queue not in feed.subscribers:
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield live.format_event(event, data)
+        finally:
+            feed.unsubscribe(queue)
+
+    response = StreamingHttpResponse(events(),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def export(request, pk: int) -> StreamingHttpResponse:
+    """Download a tournament's reports. ?format=ctr, trf or pgn for one
+    report, a zip of all of them by default. A tournament in sections is
+    always a zip, with the reports of each section.
+    """
+    tournament = get_object_or_404(Tournament, pk=pk)
+    info = database.get_report_info(tournament)
+    fmt = request.GET.get("format")
+
+    if tournament.sections.exists():
+        formats = [fmt] if fmt in writers.WRITERS else list(writers.WRITERS)
+        content = writers.zip_stream(
+            (name, [text])
+            for section in sections.get_sections_data(tournament)
+            for name, text in writers.render_reports(
+                section["info"], section["players"], section["games"],
+                formats)
+        )
+        filename = f"{writers.report_name(info)}.zip"
+        response = StreamingHttpResponse(content,
+                                         content_type="application/zip")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    # games are streamed from the database, not held, so a large
+    # tournament is exported in constant memory
+    players = database.get_roster(tournament)
+    games = database.iter_tournament_games(tournament)
+
+    if fmt in writers.WRITERS:
+        writer = writers.WRITERS[fmt](info, players)
+        content = (text for _, text in writers.render(info, players, games,
+                                                      [fmt]))
+        filename = writer.filename()
+        content_type = "text/plain; charset=utf-8"
+    else:
+        content = writers.zip_reports(info, players, games)
+        filename = f"{writers.report_name(info)}.zip"
+        content_type = "application/zip"
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def bulk_export_view(request) -> HttpResponse:
+    """Export the reports of many tournaments to a zip, built by a
+    background job, see services.jobs. Redirects to the job's page.
+
+    Query
+    -----
+    start, end : YYYY-MM-DD, the tournament date range
+    tournament : tournament id, repeatable
+    format : ctr, trf or pgn, repeatable, default ctr
+    """
+    try:
+        for key in ("start", "end"):
+            if request.GET.get(key):
+                datetime.date.fromisoformat(request.GET[key])
+        pks = [int(pk) for pk in request.GET.getlist("tournament")]
+    except ValueError as err:
+        return HttpResponseBadRequest(f"bad export query: {err}")
+
+    formats = [f for f in request.GET.getlist("format")
+               if f in writers.WRITERS] or ["ctr"]
+    job = jobs.enqueue("bulk_export", {
+        "start": request.GET.get("start") or None,
+        "end": request.GET.get("end") or None,
+        "tournaments": pks,
+        "formats": formats,
+    })
+    session.add_job(request.session, job)
+    return redirect(job)
+
+
+def finalize_tournament(request, pk: int) -> HttpResponse:
+    """Finalize every section of a tournament in one action: GET shows the
+    sections, POST queues a job that validates them and builds a zip of
+    their CTRs, and redirects to its page.
+    """
+    tournament = get_object_or_404(Tournament, pk=pk)
+    if request.method == "POST":
+        job = jobs.enqueue("finalize_tournament", {"tournament": tournament.pk})
+        session.add_job(request.session, job)
+        return redirect(job)
+
+    context = {"tournament": tournament,
+               "sections": tournament.sections.order_by("pk")}
+    return render(request, "cfc_report/show/finalize.html", context)
@@ -2,6 +2,8 @@
 ASGI config for horizon_report project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, for example ``uvicorn horizon_report.asgi:application``,
+so the async htmx views run on the event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -9,8 +11,10 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "horizon_report.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# django-configurations must be installed before django sets up
+from configurations.asgi import get_asgi_application  # noqa: E402
 
 application = get_asgi_application()
@@ -47,6 +47,7 @@ class Dev(Configuration):
         "django.contrib.messages.middleware.MessageMiddleware",
         "django.middleware.clickjacking.XFrameOptionsMiddleware",
         "django_htmx.middleware.HtmxMiddleware",
+        "cfc_report.middleware.ProfileMiddleware",
     ]
 
 
@@ -122,7 +123,93 @@ class Dev(Configuration):
         #"/var/www/static/",
     ]
     STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+    # sessions are compact JSON, zlib compressed over
+    # SESSION_COMPRESS_THRESHOLD bytes, and a warning is logged for one over
+    # SESSION_SIZE_BUDGET bytes, see cfc_report.services.session
+    SESSION_SERIALIZER = "cfc_report.services.session.CompactSerializer"
+    SESSION_COMPRESS_THRESHOLD = 1024
+    SESSION_SIZE_BUDGET = 16 * 1024
+
+    # files written by background jobs, ie: CTRs, export archives and
+    # uploaded reports waiting to be imported, see cfc_report.services.jobs
+    JOBS_DIR = os.getenv("DJANGO_JOBS_DIR", str(BASE_DIR / "jobs"))
+    # profiles of the requests staff ask to profile, with ?profile or an
+    # X-Profile header, see cfc_report.middleware.ProfileMiddleware.
+    # Profiling is off unless DJANGO_PROFILE_DIR is set, ie: to profiles/
+    PROFILE_DIR = os.getenv("DJANGO_PROFILE_DIR", "")
     # Default primary key field type
     # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
     DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+class Prod(Dev):
+    """Production configuration, select with DJANGO_CONFIGURATION=Prod"""
+    DEBUG = False
+
+    # the cached loader keeps compiled templates in memory for the life of the
+    # worker, so htmx partials are not re-read and re-parsed on every request.
+    # APP_DIRS must be off when loaders are given explicitly.
+    TEMPLATES = [
+        {
+            **Dev.TEMPLATES[0],
+            "APP_DIRS": False,
+            "OPTIONS": {
+                **Dev.TEMPLATES[0]["OPTIONS"],
+                "loaders": [
+                    (
+                        "django.template.loaders.cached.Loader",
+                        [
+                            "django.template.loaders.filesystem.Loader",
+                            "django.template.loaders.app_directories.Loader",
+                        ],
+                    ),
+                ],
+            },
+        },
+    ]
+
+    # Database
+    # connections are kept open between requests instead of being set up on
+    # every one. Set DJANGO_DB_ENGINE=postgresql to leave SQLite behind,
+    # the POSTGRES_* variables then describe the server (needs psycopg).
+    CONN_MAX_AGE = int(os.getenv("DJANGO_CONN_MAX_AGE", "600"))
+
+    if os.getenv("DJANGO_DB_ENGINE") == "postgresql":
+        DATABASES = {
+            "default": {
+                "ENGINE": "django.db.backends.postgresql",
+                "NAME": os.getenv("POSTGRES_DB", "horizon_report"),
+                "USER": os.getenv("POSTGRES_USER", ""),
+                "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+                "HOST": os.getenv("POSTGRES_HOST", ""),
+                "PORT": os.getenv("POSTGRES_PORT", ""),
+                "CONN_MAX_AGE": CONN_MAX_AGE,
+                "CONN_HEALTH_CHECKS": True,
+            }
+        }
+    else:
+        DATABASES = {
+            "default": {
+                **Dev.DATABASES["default"],
+                "CONN_MAX_AGE": CONN_MAX_AGE,
+                "CONN_HEALTH_CHECKS": True,
+                "OPTIONS": {
+                    # take the write lock at BEGIN, so concurrent writers
+                    # wait on busy_timeout instead of failing on upgrade
+                    "transaction_mode": "IMMEDIATE",
+                },
+            }
+        }
+
+    # applied to every new SQLite connection by the connection_created signal,
+    # see cfc_report.services.database.set_sqlite_pragmas
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        # the one lock wait: the sqlite3 "timeout" option is left unset,
+        # this pragma would replace it on every connection
+        "busy_timeout": 5000,  # ms
+        "mmap_size": 134217728,  # 128 MiB
+    }
@@ -9,8 +9,10 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "horizon_report.settings")
+os.environ.setdefault("DJANGO_CONFIGURATION", "Dev")
+
+# django-configurations must be installed before django sets up
+from configurations.wsgi import get_wsgi_application  # noqa: E402
 
 application = get_wsgi_application()
@@ -0,0 +1,87 @@
+/*
+ * Server-Sent Events for htmx 2.
+ * Copyright (C) 2024  Nicolas Vaagen, GNU AGPL v3 or later.
+ *
+ * Implements the markup of the htmx sse extension used by cfc_report:
+ *
+ *   <section hx-ext="sse" sse-connect="/stream/url">
+ *     <tbody sse-swap="result" hx-swap="beforeend"></tbody>
+ *     <tr sse-swap="standing-111111" hx-swap="outerHTML">...</tr>
+ *   </section>
+ *
+ * One EventSource is opened per sse-connect element. Every event named in
+ * an sse-swap attribute below it is swapped into that element, using its
+ * hx-swap style (innerHTML by default). Elements swapped in later are
+ * picked up too, so rows can replace themselves.
+ */
+(function () {
+  function eventNames(elt) {
+    return elt.getAttribute("sse-swap").split(",").map(function (name) {
+      return name.trim();
+    });
+  }
+
+  function dispatch(connector, name, data) {
+    connector.querySelectorAll("[sse-swap]").forEach(function (target) {
+      if (eventNames(target).indexOf(name) < 0) {
+        return;
+      }
+      htmx.swap(target, data, {
+        swapStyle: target.getAttribute("hx-swap") || "innerHTML",
+        swapDelay: 0,
+        settleDelay: 0,
+      });
+    });
+  }
+
+  function listen(connector, elt) {
+    if (!elt.hasAttribute("sse-swap")) {
+      return;
+    }
+    eventNames(elt).forEach(function (name) {
+      if (connector.sseEvents.has(name)) {
+        return;
+      }
+      connector.sseEvents.add(name);
+      connector.sseSource.addEventListener(name, function (event) {
+        dispatch(connector, name, event.data);
+      });
+    });
+  }
+
+  function connect(connector) {
+    if (connector.sseSource) {
+      return;
+    }
+    connector.sseEvents = new Set();
+    connector.sseSource = new EventSource(connector.getAttribute("sse-connect"));
+    connector.sseSource.onerror = function () {
+      htmx.trigger(connector, "htmx:sseError", {});
+    };
+  }
+
+  htmx.defineExtension("sse", {
+    getSelectors: function () {
+      return ["[sse-connect]", "[sse-swap]"];
+    },
+
+    onEvent: function (name, evt) {
+      const elt = evt.detail.elt;
+      if (name === "htmx:beforeCleanupElement") {
+        if (elt.sseSource) {
+          elt.sseSource.close();
+        }
+        return;
+      }
+      if (name !== "htmx:afterProcessNode") {
+        return;
+      }
+      const connector = elt.closest("[sse-connect]");
+      if (!connector) {
+        return;
+      }
+      connect(connector);
+      listen(connector, elt);
+    },
+  });
+})();
@@ -0,0 +1,143 @@
+/*
+ * Offline result queue for the match form (create/match.html).
+ * Copyright (C) 2024  Nicolas Vaagen, GNU AGPL v3 or later.
+ *
+ * Entered results are kept in localStorage and sent to the sync endpoint
+ * (create-report-sync) in batches, whenever the network is there. Each
+ * game, by round and players, keeps one client id, re-entering it bumps
+ * its version so the server keeps the newest result.
+ */
+(function () {
+  const QUEUE_KEY = "cfc_report.result_queue";
+  const VERSIONS_KEY = "cfc_report.result_versions";
+  const BATCH_SIZE = 50;
+  const RETRY_MS = 10000;
+
+  const form = document.getElementById("match_form");
+  if (!form) {
+    return;
+  }
+  const list = document.getElementById("queued_results");
+  const token = form.querySelector("[name=csrfmiddlewaretoken]").value;
+  let syncing = false;
+
+  function load(key, empty) {
+    return JSON.parse(localStorage.getItem(key) || empty);
+  }
+
+  function store(key, value) {
+    localStorage.setItem(key, JSON.stringify(value));
+  }
+
+  function newId() {
+    if (window.crypto && crypto.randomUUID) {
+      return crypto.randomUUID();
+    }
+    // crypto.randomUUID needs https, fall back to a random v4 uuid
+    return "10000000-1000-4000-8000-100000000000".replace(/[018]/g, function (c) {
+      return (c ^ (Math.random() * 16) >> (c / 4)).toString(16);
+    });
+  }
+
+  function render() {
+    const queue = load(QUEUE_KEY, "[]");
+    list.replaceChildren(...queue.map(function (result) {
+      const item = document.createElement("li");
+      item.textContent = result.label + (result.error ? " - " + result.error : " - waiting to sync");
+      return item;
+    }));
+  }
+
+  function enqueue() {
+    const data = new FormData(form);
+    const checked = form.querySelector("input[name=result]:checked");
+    const round = form.dataset.round;
+    const key = [round, data.get("white"), data.get("black")].join(":");
+
+    const versions = load(VERSIONS_KEY, "{}");
+    const game = versions[key] || { client_id: newId(), version: 0 };
+    game.version += 1;
+    versions[key] = game;
+    store(VERSIONS_KEY, versions);
+
+    const queue = load(QUEUE_KEY, "[]").filter(function (result) {
+      return result.client_id !== game.client_id;
+    });
+    queue.push({
+      client_id: game.client_id,
+      version: game.version,
+      white: data.get("white"),
+      black: data.get("black"),
+      result: checked.dataset.code,
+      round_number: round,
+      label: "round " + round + ": " + data.get("white") + " " +
+        checked.value + " " + data.get("black"),
+    });
+    store(QUEUE_KEY, queue);
+  }
+
+  async function flush() {
+    if (syncing || !navigator.onLine) {
+      return;
+    }
+    const batch = load(QUEUE_KEY, "[]").filter(function (result) {
+      return !result.error;
+    }).slice(0, BATCH_SIZE);
+    if (!batch.length) {
+      return;
+    }
+
+    syncing = true;
+    let synced = null;
+    try {
+      const response = await fetch(form.dataset.syncUrl, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "X-CSRFToken": token },
+        body: JSON.stringify({ results: batch }),
+      });
+      if (response.ok) {
+        synced = await response.json();
+      }
+    } catch (err) {
+      // offline, the queue is kept and retried
+    } finally {
+      syncing = false;
+    }
+    if (synced === null) {
+      return;
+    }
+
+    // results re-entered while the batch was in flight stay queued
+    const sent = {};
+    batch.forEach(function (result) {
+      sent[result.client_id] = result.version;
+    });
+    const done = new Set(synced.applied.concat(synced.stale));
+    const queue = load(QUEUE_KEY, "[]").filter(function (result) {
+      return !(done.has(result.client_id) && sent[result.client_id] === result.version);
+    });
+    queue.forEach(function (result) {
+      if (synced.errors[result.client_id]) {
+        result.error = synced.errors[result.client_id];
+      }
+    });
+    store(QUEUE_KEY, queue);
+    render();
+
+    if (done.size) {
+      flush();
+    }
+  }
+
+  form.addEventListener("submit", function (event) {
+    event.preventDefault();
+    enqueue();
+    render();
+    flush();
+  });
+  window.addEventListener("online", flush);
+  setInterval(flush, RETRY_MS);
+
+  render();
+  flush();
+})();